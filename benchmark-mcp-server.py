@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+
+"""
+Offline benchmark for the Elastic OTEL MCP Server
+Drives every tool against a local fake ES|QL /_query endpoint and reports latency, throughput and peak memory
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from mcp.types import CallToolRequest, CallToolRequestParams, ListToolsRequest
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "elastic-otel-mcp-server.py")
+
+# Arguments used for each tool; tools missing here are called with {}
+TOOL_SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "get_application_health": {"time_range": "15m"},
+    "get_service_metrics": {"service_name": "service-1", "time_range": "15m"},
+    "get_error_analysis": {"time_range": "15m", "severity": "ERROR"},
+    "get_performance_issues": {"time_range": "15m", "threshold_ms": 1000},
+    "get_resource_utilization": {"time_range": "15m", "resource_type": "cpu"},
+    "get_trace_analysis": {"time_range": "15m"},
+    "get_code_recommendations": {"analysis_type": "resources", "time_range": "15m"},
+    "get_incident_triage": {"time_range": "15m"},
+}
+
+def load_server_module():
+    """Import elastic-otel-mcp-server.py despite the hyphenated file name"""
+    spec = importlib.util.spec_from_file_location("elastic_otel_mcp_server", SERVER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def _split_top_level(text: str) -> List[str]:
+    """Split on commas that are not inside parentheses"""
+    parts, depth, current = [], 0, ""
+    for char in text:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+        else:
+            current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+class FakeElastic:
+    """Synthetic ES|QL /_query endpoint
+    
+    Responses are shaped from the query itself: every ``STATS`` aggregate
+    becomes a numeric column and every ``BY`` field a keyword (or date for
+    ``BUCKET``) column, with ``rows`` groups per response.
+    """
+    
+    def __init__(self, rows: int = 50, latency_ms: float = 20.0, jitter_ms: float = 5.0, seed: int = 42):
+        self.rows = rows
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.bytes_out = 0
+    
+    def shape(self, query: str) -> Tuple[List[Dict[str, str]], List[List[Any]]]:
+        """Columns and row-major values for a query"""
+        stats_clauses = re.findall(r"\bSTATS\b(.*?)(?=\n\s*\||$)", query, re.S)
+        stats = stats_clauses[-1] if stats_clauses else ""
+        by: List[str] = []
+        if re.search(r"\bBY\b", stats):
+            stats, by_clause = re.split(r"\bBY\b", stats, maxsplit=1)
+            by = _split_top_level(by_clause)
+        aggregates = [aggregate.split("=")[0].strip() for aggregate in _split_top_level(stats)]
+        # Fields computed by EVAL are numeric, like the sketch series' duration_bin
+        computed = set(re.findall(r"\bEVAL\s+(\w+)\s*=", query))
+        
+        columns = [{"name": name, "type": "double"} for name in aggregates]
+        for field in by:
+            name = field.split("=")[0].strip()
+            kind = "date" if "BUCKET" in field else "long" if name in computed else "keyword"
+            columns.append({"name": name, "type": kind})
+        
+        now_minute = int(time.time() // 60)
+        groups = self.rows if by else 1
+        values = []
+        for group in range(groups):
+            row: List[Any] = []
+            for name in aggregates:
+                if any(hint in name for hint in ("rate", "cpu", "memory", "utilization")):
+                    row.append(round(self.random.random(), 4))
+                else:
+                    row.append(self.random.randint(1, 5_000_000))
+            for field in by:
+                if "BUCKET" in field:
+                    minute = now_minute - group % 60
+                    row.append(datetime.fromtimestamp(minute * 60, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z"))
+                elif field.split("=")[0].strip() in computed:
+                    row.append(group % 200)
+                elif ".target." in field:
+                    # A call target is another group, so dependency edges are not self-loops
+                    row.append(f"{field.split('.')[0]}-{(group + 1) % self.rows}")
+                else:
+                    row.append(f"{field.split('=')[0].strip().split('.')[0]}-{group}")
+            values.append(row)
+        return columns, values
+    
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms))
+        await asyncio.sleep(delay / 1000)
+        
+        body = json.loads(request.content)
+        columns, values = self.shape(body["query"])
+        self.requests += 1
+        
+        if request.url.params.get("format") == "arrow":
+            import pyarrow
+            import pyarrow.ipc
+            
+            table = pyarrow.table({
+                column["name"]: [row[i] for row in values] for i, column in enumerate(columns)
+            })
+            sink = io.BytesIO()
+            with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            content = sink.getvalue()
+            self.bytes_out += len(content)
+            return httpx.Response(200, content=content, headers={"Content-Type": "application/vnd.apache.arrow.stream"})
+        
+        if body.get("columnar"):
+            values = [list(column) for column in zip(*values)] if values else [[] for _ in columns]
+        payload = {"columns": columns, "values": values}
+        self.bytes_out += len(json.dumps(payload))
+        return httpx.Response(200, json=payload)
+    
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handler)
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def summarize(samples: List[float], wall_seconds: float) -> Dict[str, float]:
+    return {
+        "calls": len(samples),
+        "p50_ms": round(percentile(samples, 50), 3),
+        "p95_ms": round(percentile(samples, 95), 3),
+        "p99_ms": round(percentile(samples, 99), 3),
+        "mean_ms": round(statistics.fmean(samples), 3) if samples else 0.0,
+        "throughput_per_s": round(len(samples) / wall_seconds, 2) if wall_seconds else 0.0,
+    }
+
+async def call_tool(server, name: str, arguments: Dict[str, Any]) -> float:
+    """Invoke a tool through the MCP handler and return its latency in ms"""
+    handler = server.server.request_handlers[CallToolRequest]
+    request = CallToolRequest(method="tools/call", params=CallToolRequestParams(name=name, arguments=arguments))
+    started = time.perf_counter()
+    result = await handler(request)
+    elapsed = (time.perf_counter() - started) * 1000
+    text = result.root.content[0].text
+    if text.startswith("Error:"):
+        raise RuntimeError(f"{name} failed: {text}")
+    return elapsed
+
+async def list_tool_names(server) -> List[str]:
+    handler = server.server.request_handlers[ListToolsRequest]
+    result = await handler(ListToolsRequest(method="tools/list"))
+    return [tool.name for tool in result.root.tools]
+
+async def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    module = load_server_module()
+    fake = FakeElastic(args.rows, args.latency_ms, args.jitter_ms, args.seed)
+    
+    settings = module.settings_from_env()
+    if not args.cache:
+        settings["cache_size"] = 0
+    server = module.ElasticOTELMCPServer("http://fake-elastic.local", "benchmark", transport=fake.transport(), **settings)
+    
+    tool_names = await list_tool_names(server)
+    if args.tools:
+        tool_names = [name for name in tool_names if name in args.tools]
+    
+    report: Dict[str, Any] = {
+        "created": datetime.now().isoformat(),
+        "config": {
+            "rows": args.rows,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "cache": args.cache,
+        },
+        "serial": {},
+        "concurrent": {},
+    }
+    
+    try:
+        for name in tool_names:
+            arguments = TOOL_SCENARIOS.get(name, {})
+            await call_tool(server, name, arguments)  # warm-up
+            
+            # Serial: one call at a time
+            samples = []
+            started = time.perf_counter()
+            for _ in range(args.iterations):
+                samples.append(await call_tool(server, name, arguments))
+            report["serial"][name] = summarize(samples, time.perf_counter() - started)
+            
+            # Concurrent: `concurrency` callers issuing `iterations` calls in total
+            samples = []
+            queue: asyncio.Queue = asyncio.Queue()
+            for _ in range(args.iterations):
+                queue.put_nowait(None)
+            
+            async def worker():
+                while not queue.empty():
+                    queue.get_nowait()
+                    samples.append(await call_tool(server, name, arguments))
+            
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            report["concurrent"][name] = summarize(samples, time.perf_counter() - started)
+        
+        # Memory is traced in a separate pass so tracing overhead does not skew latency
+        tracemalloc.start()
+        try:
+            await asyncio.gather(*(
+                call_tool(server, name, TOOL_SCENARIOS.get(name, {}))
+                for name in tool_names for _ in range(args.concurrency)
+            ))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        await server.close()
+    
+    report["peak_memory_mb"] = round(peak / (1024 * 1024), 3)
+    report["elastic_requests"] = fake.requests
+    report["elastic_bytes"] = fake.bytes_out
+    return report
+
+async def measure_startup(env: Dict[str, str]) -> Dict[str, float]:
+    """Spawn the stdio server and time the initialize and tools/list round trips, in ms since spawn"""
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, SERVER_PATH,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        env=env,
+    )
+    
+    async def request(message: Dict[str, Any]) -> float:
+        process.stdin.write((json.dumps(message) + "\n").encode())
+        await process.stdin.drain()
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                raise RuntimeError("Server exited during startup")
+            # The banner shares stdout with the protocol
+            with contextlib.suppress(ValueError):
+                if json.loads(line).get("id") == message["id"]:
+                    return round((time.perf_counter() - started) * 1000, 3)
+    
+    try:
+        initialize_ms = await request({
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "initialize",
+            "params": {
+                "protocolVersion": "2024-11-05",
+                "capabilities": {},
+                "clientInfo": {"name": "benchmark", "version": "1.0"},
+            },
+        })
+        process.stdin.write(b'{"jsonrpc": "2.0", "method": "notifications/initialized"}\n')
+        tools_ms = await request({"jsonrpc": "2.0", "id": 2, "method": "tools/list"})
+    finally:
+        process.stdin.close()
+        with contextlib.suppress(ProcessLookupError):
+            process.terminate()
+        await process.wait()
+    return {"initialize_ms": initialize_ms, "tools_list_ms": tools_ms}
+
+async def run_startup_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """Cold-start the stdio server repeatedly, as an MCP client does once per session"""
+    env = dict(os.environ)
+    env.update({
+        "ELASTIC_ENDPOINT": env.get("ELASTIC_ENDPOINT", "http://127.0.0.1:9"),
+        "ELASTIC_API_KEY": env.get("ELASTIC_API_KEY", "benchmark"),
+        "MCP_TRANSPORT": "stdio",
+        "MCP_PREFETCH": "false",
+    })
+    runs = [await measure_startup(env) for _ in range(args.startup)]
+    report = {
+        metric: {
+            "p50_ms": round(percentile([run[metric] for run in runs], 50), 3),
+            "p95_ms": round(percentile([run[metric] for run in runs], 95), 3),
+            "max_ms": max(run[metric] for run in runs),
+        }
+        for metric in ("initialize_ms", "tools_list_ms")
+    }
+    report["runs"] = len(runs)
+    return report
+
+def print_report(report: Dict[str, Any]):
+    print(f"📊 Fake Elastic: {report['config']['rows']} rows/response, "
+          f"{report['config']['latency_ms']}ms ±{report['config']['jitter_ms']}ms latency")
+    for mode in ("serial", "concurrent"):
+        label = "serial" if mode == "serial" else f"concurrent (x{report['config']['concurrency']})"
+        print(f"\n🎯 {label}")
+        print(f"  {'tool':<28} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'calls/s':>9}")
+        for name, stats in report[mode].items():
+            print(f"  {name:<28} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} "
+                  f"{stats['p99_ms']:>9.2f} {stats['throughput_per_s']:>9.1f}")
+    print(f"\n🧠 Peak traced memory: {report['peak_memory_mb']} MB")
+    print(f"🔁 Elastic requests: {report['elastic_requests']} ({report['elastic_bytes']} bytes)")
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return regressions where p95 latency or peak memory grew beyond tolerance"""
+    regressions = []
+    for mode in ("serial", "concurrent"):
+        for name, stats in current[mode].items():
+            previous = baseline.get(mode, {}).get(name)
+            if not previous or not previous["p95_ms"]:
+                continue
+            change = (stats["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"]
+            if change > tolerance:
+                regressions.append(
+                    f"{mode} {name}: p95 {previous['p95_ms']:.2f}ms -> {stats['p95_ms']:.2f}ms (+{change:.0%})"
+                )
+    previous_memory = baseline.get("peak_memory_mb")
+    if previous_memory:
+        change = (current["peak_memory_mb"] - previous_memory) / previous_memory
+        if change > tolerance:
+            regressions.append(
+                f"peak memory {previous_memory}MB -> {current['peak_memory_mb']}MB (+{change:.0%})"
+            )
+    return regressions
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Offline benchmark for the Elastic OTEL MCP Server")
+    parser.add_argument("--rows", type=int, default=50, help="Rows (groups) per synthetic ES|QL response")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Simulated Elastic latency per query")
+    parser.add_argument("--jitter-ms", type=float, default=5.0, help="Uniform jitter added to the latency")
+    parser.add_argument("--iterations", type=int, default=50, help="Calls per tool in each mode")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent callers in concurrent mode")
+    parser.add_argument("--cache", action="store_true", help="Keep the result cache enabled")
+    parser.add_argument("--tools", nargs="*", help="Only benchmark these tools")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for synthetic data")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write the report as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="Compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression before failing (0.2 = 20%%)")
+    parser.add_argument("--startup", type=int, metavar="RUNS", help="Only measure cold starts of the stdio server")
+    parser.add_argument("--startup-target-ms", type=float, help="Fail when the p50 time to a tools/list answer exceeds this")
+    args = parser.parse_args()
+    
+    if args.startup:
+        report = asyncio.run(run_startup_benchmark(args))
+        print(f"🚀 Cold starts: {report['runs']}")
+        print(f"  {'until':<28} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+        for metric in ("initialize_ms", "tools_list_ms"):
+            stats = report[metric]
+            print(f"  {metric[:-3]:<28} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['max_ms']:>9.1f}")
+        if args.startup_target_ms and report["tools_list_ms"]["p50_ms"] > args.startup_target_ms:
+            print(f"\n❌ Startup p50 {report['tools_list_ms']['p50_ms']:.1f}ms exceeds the {args.startup_target_ms:.0f}ms target")
+            sys.exit(1)
+        return
+    
+    # Per-request logging would dominate the measurements
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    
+    report = asyncio.run(run_benchmark(args))
+    print_report(report)
+    
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Baseline saved to {args.save_baseline}")
+    
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.tolerance)
+        if regressions:
+            print("\n❌ Regressions against baseline:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print("\n✅ No regressions against baseline")
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,29 @@ Provides real-time insights into application health from Elastic Serverless OTEL
 """
 
 import asyncio
+import base64
+import bisect
+import contextlib
+import hashlib
+import heapq
+import hmac
+import importlib
+import importlib.util
+import inspect
 import json
 import logging
-from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
+import math
+import multiprocessing
+import os
+import random
+import re
+import socket
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
 import httpx
 from mcp.server import Server
@@ -27,12 +46,2944 @@ from mcp.types import (
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Set for the duration of a tool call that passed ``no_cache: true``
+bypass_cache: ContextVar[bool] = ContextVar("bypass_cache", default=False)
+
+# Endpoint failures and approximate columns seen by queries of the current tool call
+federation_report: ContextVar[Optional[Dict[str, Any]]] = ContextVar("federation_report", default=None)
+
+# Entries each ranked collection keeps for the current tool call (None for the server default)
+result_budget: ContextVar[Optional[int]] = ContextVar("result_budget", default=None)
+
+# Set while a composite tool runs, so its sub-tools' queries share scans
+shared_scans: ContextVar[Optional["SharedScanPlanner"]] = ContextVar("shared_scans", default=None)
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    """Read a boolean flag from the environment"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def module_available(name: str) -> bool:
+    """Whether an optional module is installed, without paying for its import"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+def settings_from_env() -> Dict[str, Any]:
+    """Build ElasticOTELMCPServer keyword settings from environment variables"""
+    return {
+        "max_connections": int(os.getenv('ELASTIC_MAX_CONNECTIONS', '20')),
+        "max_keepalive_connections": int(os.getenv('ELASTIC_MAX_KEEPALIVE', '10')),
+        "keepalive_expiry": float(os.getenv('ELASTIC_KEEPALIVE_EXPIRY', '30')),
+        "http2": _env_bool('ELASTIC_HTTP2'),
+        "connect_timeout": float(os.getenv('ELASTIC_CONNECT_TIMEOUT', '5')),
+        "read_timeout": float(os.getenv('ELASTIC_TIMEOUT', '30')),
+        "max_subquery_concurrency": int(os.getenv('ELASTIC_MAX_SUBQUERIES', '4')),
+        "cache_size": int(os.getenv('ELASTIC_CACHE_SIZE', '256')),
+        "cache_ttl": float(os.getenv('ELASTIC_CACHE_TTL', '30')),
+        "incremental": _env_bool('ELASTIC_INCREMENTAL'),
+        "incremental_max_minutes": int(os.getenv('ELASTIC_INCREMENTAL_MAX_MINUTES', '1440')),
+        "incremental_settle_minutes": int(os.getenv('ELASTIC_INCREMENTAL_SETTLE_MINUTES', '2')),
+        "quantile_sketches": _env_bool('ELASTIC_QUANTILE_SKETCHES', True),
+        "sketch_accuracy": float(os.getenv('ELASTIC_SKETCH_ACCURACY', '0.05')),
+        "sketch_max_buckets": int(os.getenv('ELASTIC_SKETCH_MAX_BUCKETS', '24')),
+        "result_format": os.getenv('ELASTIC_RESULT_FORMAT', 'json').lower(),
+        "compact_json": _env_bool('MCP_COMPACT_JSON'),
+        "json_backend": os.getenv('MCP_JSON_BACKEND', 'auto').lower(),
+        "result_top_k": int(os.getenv('MCP_RESULT_TOP_K', '0')) or None,
+        "result_max_bytes": int(os.getenv('MCP_RESULT_MAX_BYTES', '0')) or None,
+        "result_max_entries": int(os.getenv('MCP_RESULT_MAX_ENTRIES', '1000')) or None,
+        "otlp_endpoint": os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT'),
+        "max_retries": int(os.getenv('ELASTIC_MAX_RETRIES', '3')),
+        "retry_base_delay": float(os.getenv('ELASTIC_RETRY_BASE_DELAY', '0.2')),
+        "retry_max_delay": float(os.getenv('ELASTIC_RETRY_MAX_DELAY', '10')),
+        "adaptive_limit_initial": int(os.getenv('ELASTIC_ADAPTIVE_LIMIT_INITIAL', '8')),
+        "adaptive_limit_min": int(os.getenv('ELASTIC_ADAPTIVE_LIMIT_MIN', '1')),
+        "adaptive_limit_max": int(os.getenv('ELASTIC_ADAPTIVE_LIMIT_MAX', '64')),
+        "breaker_failure_threshold": int(os.getenv('ELASTIC_BREAKER_THRESHOLD', '5')),
+        "breaker_reset_timeout": float(os.getenv('ELASTIC_BREAKER_RESET', '30')),
+        "serve_stale": _env_bool('ELASTIC_SERVE_STALE', True),
+        "stale_max_age": float(os.getenv('ELASTIC_STALE_MAX_AGE', '600')),
+        "async_threshold": parse_time_range(os.getenv('ELASTIC_ASYNC_THRESHOLD', '1d')) or 0,
+        "async_wait": float(os.getenv('ELASTIC_ASYNC_WAIT', '2')),
+        "async_keep_alive": os.getenv('ELASTIC_ASYNC_KEEP_ALIVE', '5m'),
+        "async_max_duration": float(os.getenv('ELASTIC_ASYNC_MAX_DURATION', '600')),
+        "anomaly_detection": _env_bool('ELASTIC_ANOMALY_DETECTION'),
+        "baseline_window": parse_time_range(os.getenv('ELASTIC_BASELINE_WINDOW', '1d')) or 86400,
+        "baseline_buckets": int(os.getenv('ELASTIC_BASELINE_BUCKETS', '96')),
+        "baseline_max_rows": int(os.getenv('ELASTIC_BASELINE_MAX_ROWS', '10000')),
+        "zscore_warning": float(os.getenv('ELASTIC_ZSCORE_WARNING', '2')),
+        "zscore_critical": float(os.getenv('ELASTIC_ZSCORE_CRITICAL', '3')),
+        "resolution_routing": _env_bool('ELASTIC_RESOLUTION_ROUTING'),
+        "sample_base_window": parse_time_range(os.getenv('ELASTIC_SAMPLE_BASE_WINDOW', '1h')) or 0,
+        "sample_min_rate": float(os.getenv('ELASTIC_SAMPLE_MIN_RATE', '0.01')),
+        "downsampled_metrics": json.loads(os.getenv('ELASTIC_DOWNSAMPLED_METRICS') or '{}'),
+        "prefetch": _env_bool('MCP_PREFETCH'),
+        "prefetch_targets": parse_prefetch_targets(os.getenv('MCP_PREFETCH_TARGETS')),
+        "prefetch_interval": float(os.getenv('MCP_PREFETCH_INTERVAL', '60')),
+        "prefetch_jitter": float(os.getenv('MCP_PREFETCH_JITTER', '0.1')),
+        "prefetch_max_age": float(os.getenv('MCP_PREFETCH_MAX_AGE', '0')) or None,
+        "log_templates": _env_bool('ELASTIC_LOG_TEMPLATES', False),
+        "log_sample_size": int(os.getenv('ELASTIC_LOG_SAMPLE_SIZE', '5000')),
+        "log_page_size": int(os.getenv('ELASTIC_LOG_PAGE_SIZE', '1000')),
+        "log_max_templates": int(os.getenv('ELASTIC_LOG_MAX_TEMPLATES', '1000')),
+        "log_similarity": float(os.getenv('ELASTIC_LOG_SIMILARITY', '0.5')),
+        "store_path": os.getenv('ELASTIC_STORE_PATH') or None,
+        "store_ttl": float(os.getenv('ELASTIC_STORE_TTL', '300')),
+        "store_max_bytes": int(float(os.getenv('ELASTIC_STORE_MAX_MB', '64')) * 1024 * 1024),
+        "endpoints": load_endpoints(os.getenv('ELASTIC_ENDPOINTS_FILE')),
+        "federation_timeout": float(os.getenv('ELASTIC_FEDERATION_TIMEOUT', '10')),
+        "warmup": _env_bool('MCP_WARMUP'),
+    }
+
+TIME_RANGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+TIME_RANGE_PATTERN = re.compile(
+    r"\s*(\d+)\s*(s|secs?|seconds?|m|mins?|minutes?|h|hrs?|hours?|d|days?)\s*", re.IGNORECASE
+)
+
+def parse_time_range(time_range: str) -> Optional[int]:
+    """Convert a time range such as '15m', '1d' or '2 hours' to seconds"""
+    match = TIME_RANGE_PATTERN.fullmatch(time_range or "")
+    if not match:
+        return None
+    return int(match.group(1)) * TIME_RANGE_UNITS[match.group(2)[0].lower()]
+
+# Largest unit first, so equal windows get the same text ('60m' -> '1 hour')
+ESQL_INTERVAL_UNITS = (("day", 86400), ("hour", 3600), ("minute", 60), ("second", 1))
+
+def esql_interval(time_range: str) -> str:
+    """Validate a time range and normalize it to a canonical ES|QL interval literal"""
+    seconds = parse_time_range(time_range)
+    if not seconds:
+        raise ValueError(f"Invalid time_range: {time_range!r} (expected e.g. '15m', '1h' or '7d')")
+    for unit, size in ESQL_INTERVAL_UNITS:
+        if seconds % size == 0:
+            count = seconds // size
+            return f"{count} {unit}{'' if count == 1 else 's'}"
+
+ESQL_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+RESULT_FORMATS = ("json", "columnar", "arrow")
+
+def decode_arrow_response(content: bytes) -> Dict[str, Any]:
+    """Decode an Arrow IPC stream from ES|QL into a columnar response dict"""
+    import pyarrow.ipc
+    
+    table = pyarrow.ipc.open_stream(content).read_all()
+    return {
+        "columns": [{"name": field.name, "type": str(field.type)} for field in table.schema],
+        "values": [column.to_pylist() for column in table.columns],
+        "columnar": True
+    }
+
+class EsqlQuery:
+    """A template bound to values: query text plus its ES|QL ``params``"""
+    
+    __slots__ = ("template", "query", "data_view", "params", "window")
+    
+    def __init__(
+        self,
+        template: str,
+        query: str,
+        data_view: str,
+        params: List[Dict[str, Any]],
+        window: Optional[int] = None,
+    ):
+        self.template = template
+        self.query = query
+        self.data_view = data_view
+        self.params = params
+        # Seconds of data scanned, used to pick the async API for long windows
+        self.window = window
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# Per-edge call counts plus mergeable latency partials (cumulative bucket counts)
+DEPENDENCY_AGGREGATES = {
+    "call_count": "COUNT(*)",
+    "duration_sum": "SUM(span.duration.us)",
+    "max_duration": "MAX(span.duration.us)",
+    **{
+        f"le_{bound}ms": f"SUM(CASE WHEN span.duration.us <= {bound * 1000} THEN 1 ELSE 0 END)"
+        for bound in LATENCY_BUCKETS_MS
+    }
+}
+DEPENDENCY_STATS = ",\n            ".join(f"{name} = {expression}" for name, expression in DEPENDENCY_AGGREGATES.items())
+
+class EsqlTemplate:
+    """An ES|QL query shape defined once, with values bound as ``params``
+    
+    Only validated structure is formatted into the text: the canonical
+    ``{window}`` interval, ``{name}`` placeholder lists for list values and
+    identifiers checked against ``ESQL_IDENTIFIER``. Every user-supplied value
+    travels in ``params`` and is never spliced into the query.
+    """
+    
+    __slots__ = ("name", "data_view", "text")
+    
+    def __init__(self, name: str, data_view: str, text: str):
+        self.name = name
+        self.data_view = data_view
+        # Precompiled once: dedented, one clause per line
+        self.text = "\n".join(line.strip() for line in text.strip().splitlines())
+    
+    def bind(
+        self,
+        time_range: Optional[str] = None,
+        identifiers: Optional[Dict[str, str]] = None,
+        source: Optional[str] = None,
+        sample: float = 1.0,
+        bucket: Optional[str] = None,
+        limit: Optional[int] = None,
+        **values: Any,
+    ) -> EsqlQuery:
+        """Bind values to the template, raising ValueError on invalid input"""
+        source = source or f"{self.data_view}-*"
+        if not ESQL_INDEX_PATTERN.fullmatch(source):
+            raise ValueError(f"Invalid source: {source!r}")
+        if not 0 < sample <= 1:
+            raise ValueError(f"Invalid sample rate: {sample!r}")
+        structure: Dict[str, str] = {"source": source, "sample": f"| SAMPLE {sample:g}" if sample < 1 else ""}
+        params: List[Dict[str, Any]] = []
+        if time_range is not None:
+            structure["window"] = esql_interval(time_range)
+        if bucket is not None:
+            structure["bucket"] = esql_interval(bucket)
+        if limit is not None:
+            structure["limit"] = str(max(1, int(limit)))
+        for name, identifier in (identifiers or {}).items():
+            if not ESQL_IDENTIFIER.fullmatch(identifier or ""):
+                raise ValueError(f"Invalid {name}: {identifier!r}")
+            structure[name] = identifier
+        for name, value in values.items():
+            if isinstance(value, (list, tuple)):
+                if not value:
+                    raise ValueError(f"{name} must not be empty")
+                placeholders = [f"{name}_{i}" for i in range(len(value))]
+                structure[name] = ", ".join(f"?{placeholder}" for placeholder in placeholders)
+                params.extend({placeholder: item} for placeholder, item in zip(placeholders, value))
+            else:
+                params.append({name: value})
+        window = parse_time_range(time_range) if time_range is not None else None
+        query = "\n".join(line for line in self.text.format(**structure).split("\n") if line)
+        return EsqlQuery(self.name, query, self.data_view, params, window)
+
+# Most edges a full dependency scan returns
+DEPENDENCY_EDGE_LIMIT = 10000
+# Most rounds a service-filtered dependency walk takes in each direction
+DEPENDENCY_WALK_DEPTH = 10
+# Most hosts a direct utilization query returns, the highest utilization first
+HOST_ROW_LIMIT = 10000
+# Rows per incremental refresh page; ES|QL otherwise stops at 1000 rows
+SERIES_ROW_LIMIT = 10000
+# How long a series whose bucket overflowed SERIES_ROW_LIMIT is not refreshed
+SERIES_OVERFLOW_RETRY_SECONDS = 900
+# Latency series scoped to a set of services kept at once
+SCOPED_SERIES_LIMIT = 64
+# Slow operations get_performance_issues lists, as the slow_operations query does
+SLOW_OPERATION_LIMIT = 20
+
+# Every query the tools send, keyed by template name
+ESQL_TEMPLATES: Dict[str, EsqlTemplate] = {template.name: template for template in (
+    EsqlTemplate("health_error_rates", "traces", """
+        FROM traces-*
+        | WHERE @timestamp >= NOW() - {window}
+        {sample}
+        | STATS 
+            error_rate = AVG(CASE WHEN transaction.result = "error" THEN 1 ELSE 0 END),
+            count = COUNT(*)
+        BY service.name
+        | SORT error_rate DESC
+    """),
+    EsqlTemplate("health_response_times", "traces", """
+        FROM traces-*
+        | WHERE @timestamp >= NOW() - {window}
+        {sample}
+        | STATS 
+            avg_response_time = AVG(transaction.duration.us),
+            duration_count = COUNT(transaction.duration.us)
+        BY service.name
+        | SORT avg_response_time DESC
+    """),
+    EsqlTemplate("service_percentiles", "traces", """
+        FROM traces-*
+        | WHERE @timestamp >= NOW() - {window} AND service.name IN ({services})
+        | STATS 
+            p95_duration = PERCENTILE(transaction.duration.us, 95),
+            p99_duration = PERCENTILE(transaction.duration.us, 99),
+            duration_count = COUNT(transaction.duration.us)
+        BY service.name
+    """),
+    EsqlTemplate("service_transactions", "traces", """
+        FROM traces-*
+        | WHERE @timestamp >= NOW() - {window} AND service.name IN ({services})
+        | STATS 
+            transaction_count = COUNT(*),
+            error_count = COUNT(CASE WHEN transaction.result = "error" THEN 1 END),
+            avg_duration = AVG(transaction.duration.us),
+            p95_duration = PERCENTILE(transaction.duration.us, 95),
+            p99_duration = PERCENTILE(transaction.duration.us, 99)
+        BY service.name
+    """),
+    EsqlTemplate("service_resources", "metrics", """
+        FROM metrics-*
+        | WHERE @timestamp >= NOW() - {window} AND service.name IN ({services})
+        | STATS 
+            avg_cpu = AVG(system.cpu.utilization),
+            cpu_count = COUNT(system.cpu.utilization),
+            avg_memory = AVG(system.memory.utilization),
+            memory_count = COUNT(system.memory.utilization)
+        BY service.name
+    """),
+    EsqlTemplate("error_logs", "logs", """
+        FROM logs-*
+        | WHERE @timestamp >= NOW() - {window} AND log.level = ?severity
+        | STATS error_count = COUNT(*) BY service.name, message
+        | SORT error_count DESC
+        | LIMIT 20
+    """),
+    EsqlTemplate("error_counts", "logs", """
+        FROM logs-*
+        | WHERE @timestamp >= NOW() - {window} AND log.level = ?severity
+        | STATS error_count = COUNT(*) BY service.name
+        | SORT error_count DESC
+        | LIMIT 1000
+    """),
+    EsqlTemplate("error_log_samples", "logs", """
+        FROM logs-*
+        | WHERE @timestamp >= NOW() - {window} AND log.level = ?severity
+        | SORT @timestamp DESC
+        | LIMIT {limit}
+        | KEEP @timestamp, service.name, message
+    """),
+    EsqlTemplate("error_log_samples_before", "logs", """
+        FROM logs-*
+        | WHERE @timestamp >= NOW() - {window} AND log.level = ?severity AND @timestamp <= TO_DATETIME(?before)
+        | SORT @timestamp DESC
+        | LIMIT {limit}
+        | KEEP @timestamp, service.name, message
+    """),
+    EsqlTemplate("slow_operations", "traces", """
+        FROM traces-*
+        | WHERE @timestamp >= NOW() - {window} AND transaction.duration.us > ?threshold_us
+        | STATS 
+            count = COUNT(*),
+            avg_duration = AVG(transaction.duration.us),
+            max_duration = MAX(transaction.duration.us)
+        BY service.name, transaction.name
+        | SORT avg_duration DESC
+        | LIMIT 20
+    """),
+    EsqlTemplate("host_utilization", "metrics", """
+        FROM {source}
+        | WHERE @timestamp >= NOW() - {window}
+        | STATS 
+            avg_utilization = AVG(system.{resource_type}.utilization),
+            sample_count = COUNT(system.{resource_type}.utilization)
+        BY host.name
+        | SORT avg_utilization DESC
+        | LIMIT {limit}
+    """),
+    EsqlTemplate("service_error_series", "traces", """
+        FROM traces-*
+        | WHERE @timestamp >= NOW() - {window}
+        | STATS 
+            count = COUNT(*),
+            error_count = SUM(CASE WHEN transaction.result = "error" THEN 1 ELSE 0 END)
+        BY bucket = BUCKET(@timestamp, {bucket}), service.name
+        | SORT bucket DESC
+        | LIMIT {limit}
+    """),
+    EsqlTemplate("host_utilization_series", "metrics", """
+        FROM metrics-*
+        | WHERE @timestamp >= NOW() - {window}
+        | STATS 
+            avg_utilization = AVG(system.{resource_type}.utilization),
+            sample_count = COUNT(system.{resource_type}.utilization)
+        BY bucket = BUCKET(@timestamp, {bucket}), host.name
+        | SORT bucket DESC
+        | LIMIT {limit}
+    """),
+    EsqlTemplate("service_dependencies", "traces", f"""
+        FROM traces-*
+        | WHERE @timestamp >= NOW() - {{window}} AND service.target.name IS NOT NULL
+        | STATS 
+            {DEPENDENCY_STATS}
+        BY service.name, service.target.name
+        | SORT call_count DESC
+        | LIMIT {{limit}}
+    """),
+    EsqlTemplate("service_dependencies_downstream", "traces", f"""
+        FROM traces-*
+        | WHERE @timestamp >= NOW() - {{window}} AND service.name IN ({{services}}) AND service.target.name IS NOT NULL
+        | STATS 
+            {DEPENDENCY_STATS}
+        BY service.name, service.target.name
+        | SORT call_count DESC
+        | LIMIT {{limit}}
+    """),
+    EsqlTemplate("service_dependencies_upstream", "traces", f"""
+        FROM traces-*
+        | WHERE @timestamp >= NOW() - {{window}} AND service.target.name IN ({{services}})
+        | STATS 
+            {DEPENDENCY_STATS}
+        BY service.name, service.target.name
+        | SORT call_count DESC
+        | LIMIT {{limit}}
+    """),
+)}
+
+class EsqlColumns:
+    """Column-oriented view of an ES|QL response, addressed by column name
+    
+    Accepts the default row-major JSON response (transposed once), a
+    ``columnar: true`` JSON response, or a decoded Arrow response, so tools read
+    values by name instead of by row position.
+    """
+    
+    __slots__ = ("columns", "num_rows")
+    
+    def __init__(self, columns: Dict[str, Sequence[Any]], num_rows: Optional[int] = None):
+        self.columns = columns
+        if num_rows is None:
+            num_rows = len(next(iter(columns.values()))) if columns else 0
+        self.num_rows = num_rows
+    
+    @classmethod
+    def from_response(cls, response: Dict[str, Any]) -> "EsqlColumns":
+        """Build from an execute_esql_query result (errors decode as empty)"""
+        names = [column["name"] for column in response.get("columns") or []]
+        values = response.get("values") or []
+        if not names:
+            return cls({}, 0)
+        if response.get("columnar"):
+            return cls(dict(zip(names, values)))
+        if not values:
+            return cls({name: [] for name in names}, 0)
+        return cls(dict(zip(names, zip(*values))), len(values))
+    
+    def __len__(self) -> int:
+        return self.num_rows
+    
+    def column(self, name: str) -> Sequence[Any]:
+        """Values of a column, or all None if the response lacks it"""
+        values = self.columns.get(name)
+        return values if values is not None else [None] * self.num_rows
+    
+    def rows(self, *names: str) -> Iterator[Tuple[Any, ...]]:
+        """Iterate tuples of the named columns without materializing rows"""
+        return zip(*(self.column(name) for name in names))
+    
+    def first(self, *names: str) -> Optional[Tuple[Any, ...]]:
+        """The first row of the named columns, or None if there are no rows"""
+        return next(self.rows(*names), None)
+
+# How each ES|QL aggregate function combines across federated endpoints
+MERGE_FUNCTIONS = {
+    "COUNT": "sum",
+    "SUM": "sum",
+    "MAX": "max",
+    "MIN": "min",
+    "AVG": "weighted",
+    "PERCENTILE": "weighted",
+    "MEDIAN": "weighted",
+}
+
+ESQL_AGGREGATE = re.compile(r"([\w.@]+)\s*=\s*([A-Za-z_]+)\s*\((.*)\)", re.S)
+
+def split_top_level(text: str, separator: str = ",") -> List[str]:
+    """Split on separator outside parentheses and string literals"""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(text):
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and text.startswith(separator, i):
+            parts.append(text[start:i])
+            start = i + len(separator)
+    parts.append(text[start:])
+    return [part.strip() for part in parts if part.strip()]
+
+class EsqlResultMerger:
+    """Combine one query's results from several Elastic endpoints
+    
+    The merge is derived from the query text. Rows of a ``STATS`` are regrouped
+    by their ``BY`` columns: counts and sums are added, max/min kept, and
+    averages weighted by the matching ``COUNT`` column of the same field (or
+    ``COUNT(*)``). Percentiles are count-weighted too, and like any average
+    without a count they are reported as approximate. Queries without
+    ``STATS`` are concatenated. ``SORT`` and ``LIMIT`` after the aggregation
+    are then applied again to the merged rows.
+    """
+    
+    def __init__(self, query: str):
+        clauses = [clause.strip() for clause in re.split(r"\n\s*\|", query)]
+        stats_index = next((i for i, clause in enumerate(clauses) if clause.upper().startswith("STATS")), None)
+        self.groups: List[str] = []
+        self.aggregates: Dict[str, Tuple[str, Optional[str]]] = {}
+        self.approximate: List[str] = []
+        if stats_index is not None:
+            self._parse_stats(clauses[stats_index][len("STATS"):])
+        self.post_clauses = clauses[stats_index + 1:] if stats_index is not None else clauses[1:]
+    
+    def _parse_stats(self, body: str):
+        aggregates, *groups = re.split(r"\s+BY\s+", body, 1)
+        for group in split_top_level(groups[0] if groups else ""):
+            self.groups.append(group.split("=", 1)[0].strip() if "=" in group else group)
+        
+        counts: Dict[str, str] = {}
+        parsed = []
+        for aggregate in split_top_level(aggregates):
+            match = ESQL_AGGREGATE.fullmatch(aggregate)
+            if match is None:
+                continue
+            name, function, argument = match.group(1), match.group(2).upper(), split_top_level(match.group(3))
+            parsed.append((name, function, argument[0] if argument else "*"))
+            if function == "COUNT":
+                counts.setdefault(argument[0] if argument else "*", name)
+        
+        for name, function, argument in parsed:
+            rule = MERGE_FUNCTIONS.get(function)
+            weight = None
+            if rule == "weighted":
+                weight = counts.get(argument) or counts.get("*")
+                if weight is None or function != "AVG":
+                    self.approximate.append(name)
+            elif rule is None:
+                rule = "first"
+                self.approximate.append(name)
+            self.aggregates[name] = (rule, weight)
+    
+    def merge(self, results: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+        """Merged columnar response of successful per-endpoint responses"""
+        tables = [EsqlColumns.from_response(result) for result in results]
+        columns: List[Dict[str, Any]] = next((result["columns"] for result in results if result.get("columns")), [])
+        names = [column["name"] for column in columns]
+        
+        if self.aggregates:
+            rows = self._merge_groups(tables, names)
+        else:
+            rows = [row for table in tables for row in table.rows(*names)]
+        
+        for clause in self.post_clauses:
+            keyword, _, rest = clause.partition(" ")
+            keyword = keyword.upper()
+            if keyword == "SORT":
+                for key in reversed(split_top_level(rest)):
+                    field, *order = key.split()
+                    if field not in names:
+                        continue
+                    index = names.index(field)
+                    descending = bool(order) and order[0].upper() == "DESC"
+                    # Stable passes from the last key to the first; nulls always sort last
+                    present = [row for row in rows if row[index] is not None]
+                    present.sort(key=lambda row: row[index], reverse=descending)
+                    rows = present + [row for row in rows if row[index] is None]
+            elif keyword == "LIMIT" and rest.strip().isdigit():
+                rows = rows[:int(rest)]
+        
+        return {
+            "columns": columns,
+            "values": [list(column) for column in zip(*rows)] if rows else [[] for _ in names],
+            "columnar": True
+        }
+    
+    def _merge_groups(self, tables: Sequence[EsqlColumns], names: List[str]) -> List[List[Any]]:
+        merged: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+        weights: Dict[Tuple[Any, ...], Dict[str, float]] = {}
+        for table in tables:
+            for row in table.rows(*names):
+                values = dict(zip(names, row))
+                key = tuple(values.get(group) for group in self.groups)
+                current = merged.get(key)
+                if current is None:
+                    merged[key] = current = dict(values)
+                    weights[key] = totals = {}
+                    for name, (rule, weight) in self.aggregates.items():
+                        if rule == "weighted" and values.get(name) is not None:
+                            w = (values.get(weight) or 0) if weight else 1
+                            current[name] = values[name] * w
+                            totals[name] = w
+                    continue
+                
+                totals = weights[key]
+                for name, (rule, weight) in self.aggregates.items():
+                    value = values.get(name)
+                    if value is None:
+                        continue
+                    existing = current.get(name)
+                    if rule == "weighted":
+                        w = (values.get(weight) or 0) if weight else 1
+                        current[name] = (existing or 0) + value * w
+                        totals[name] = totals.get(name, 0) + w
+                    elif existing is None:
+                        current[name] = value
+                    elif rule == "sum":
+                        current[name] = existing + value
+                    elif rule == "max":
+                        current[name] = max(existing, value)
+                    elif rule == "min":
+                        current[name] = min(existing, value)
+        
+        rows = []
+        for key, current in merged.items():
+            totals = weights[key]
+            for name, (rule, _) in self.aggregates.items():
+                if rule == "weighted" and current.get(name) is not None:
+                    current[name] = current[name] / totals[name] if totals.get(name) else None
+            rows.append([current.get(name) for name in names])
+        return rows
+
+class ElasticEndpoint:
+    """One federated Elastic project with its own client pool, breaker and deadline"""
+    
+    def __init__(self, name: str, endpoint: str, api_key: str, timeout: float, breaker: "CircuitBreaker"):
+        self.name = name
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.timeout = timeout
+        self.breaker = breaker
+        self.client: Optional[httpx.AsyncClient] = None
+        self.queries = 0
+        self.failures = 0
+        self.timeouts = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "endpoint": self.endpoint,
+            "timeout_seconds": self.timeout,
+            "queries": self.queries,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "breaker": self.breaker.stats()
+        }
+
+def load_endpoints(path: Optional[str]) -> List[Dict[str, Any]]:
+    """Read federated endpoints from a JSON file
+    
+    The file holds a list (or ``{"endpoints": [...]}``) of objects with
+    ``name``, ``endpoint``, ``api_key`` or ``api_key_env``, and an optional
+    per-endpoint ``timeout`` in seconds.
+    """
+    if not path:
+        return []
+    with open(path) as f:
+        config = json.load(f)
+    if isinstance(config, dict):
+        config = config.get("endpoints", [])
+    endpoints = []
+    for i, entry in enumerate(config):
+        api_key = entry.get("api_key") or os.getenv(entry.get("api_key_env") or "")
+        if not entry.get("endpoint") or not api_key:
+            raise ValueError(f"Endpoint {i} in {path} needs 'endpoint' and 'api_key' or 'api_key_env'")
+        endpoints.append({
+            "name": entry.get("name") or entry["endpoint"],
+            "endpoint": entry["endpoint"],
+            "api_key": api_key,
+            "timeout": entry.get("timeout")
+        })
+    return endpoints
+
+def _service_severity(entry: Dict[str, Any]) -> float:
+    """Error rate of a health or service-metrics entry, for ranking"""
+    if "error_rate" in entry:
+        return entry["error_rate"] or 0
+    return entry.get("metrics", {}).get("transactions", {}).get("error_rate") or 0
+
+SERVICE_STATUSES = ("healthy", "degraded", "critical")
+
+def _overall_status(services: Dict[str, Dict[str, Any]]) -> str:
+    """Worst status among health entries, or unknown when none has one"""
+    statuses = [entry["status"] for entry in services.values() if entry.get("status") in SERVICE_STATUSES]
+    return max(statuses, key=SERVICE_STATUSES.index) if statuses else "unknown"
+
+class TopK:
+    """Streaming selection of the ``limit`` highest-ranked items
+    
+    Items are offered one at a time while rows are decoded. Only the current
+    best ``limit`` stay in a min-heap, so memory is bounded by ``limit`` however
+    many rows arrive; ``total`` counts every item offered. Equal ranks keep
+    the earlier item. Without a limit every item is kept.
+    """
+    
+    __slots__ = ("limit", "total", "_heap")
+    
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit if limit and limit > 0 else None
+        self.total = 0
+        self._heap: List[Tuple[Any, int, Any]] = []
+    
+    def offer(self, rank: Any, item: Any):
+        entry = (rank, -self.total, item)
+        self.total += 1
+        if self.limit is None or len(self._heap) < self.limit:
+            heapq.heappush(self._heap, entry)
+        elif entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+    
+    def items(self) -> List[Any]:
+        """Kept items, best first"""
+        return [item for _, _, item in sorted(self._heap, key=lambda entry: entry[:2], reverse=True)]
+
+class RankedEntries(dict):
+    """A result collection cut down by TopK, remembering how many entries it was cut from
+    
+    ``row_limit`` is set when the query feeding it hit that LIMIT, so
+    ``total`` is only a lower bound.
+    """
+    
+    __slots__ = ("total", "row_limit")
+    
+    def __init__(self, total: int = 0, row_limit: Optional[int] = None):
+        super().__init__()
+        self.total = total
+        self.row_limit = row_limit
+
+HOST_STATUSES = ("healthy", "warning", "critical")
+
+class HostUtilization:
+    """One host's entry in a get_resource_utilization result"""
+    
+    __slots__ = ("value", "status", "baseline")
+    
+    def __init__(self, value: float, status: str, baseline: Optional[Dict[str, Any]] = None):
+        self.value = value
+        self.status = status
+        self.baseline = baseline
+    
+    @property
+    def rank(self) -> Tuple[int, float]:
+        """Worst first: by status, then by utilization"""
+        return HOST_STATUSES.index(self.status), self.value
+    
+    def as_json(self) -> Dict[str, Any]:
+        entry = {"value": self.value, "unit": "percent", "status": self.status}
+        if self.baseline is not None:
+            entry["baseline"] = self.baseline
+        return entry
+
+# Result fields that a budget may cut down. Dict entries are ranked worst-first
+# with the given key; lists are already ranked by their query and are sliced.
+TRUNCATABLE_RESULT_FIELDS: Dict[str, Optional[Callable[[Any], Any]]] = {
+    "utilization": lambda entry: entry.rank,
+    "services": _service_severity,
+    "service_dependencies": None,
+    "bottlenecks": None,
+    "errors": None,
+    "slow_operations": None,
+    "recommendations": None,
+    "alerts": None,
+}
+
+class ResultSerializer:
+    """Serialize tool results, optionally compact and cut to a size budget
+    
+    ``top_k`` keeps the N worst entries of each unbounded collection and
+    ``max_bytes`` shrinks that N until the payload fits. Truncated results
+    carry a ``truncated`` marker with a cursor for the next page.
+    """
+    
+    def __init__(self, compact: bool = False, backend: str = "auto"):
+        self.compact = compact
+        # orjson is imported on the first result, not at startup
+        self._orjson = None
+        use_orjson = False
+        if backend in ("auto", "orjson"):
+            use_orjson = module_available("orjson")
+            if backend == "orjson" and not use_orjson:
+                logger.warning("MCP_JSON_BACKEND=orjson requested but orjson is not installed; using json")
+        elif backend != "json":
+            raise ValueError(f"Unknown JSON backend: {backend}")
+        self.backend = "orjson" if use_orjson else "json"
+    
+    @property
+    def orjson(self):
+        if self._orjson is None:
+            self._orjson = importlib.import_module("orjson")
+        return self._orjson
+    
+    def dumps(self, result: Any, compact: Optional[bool] = None) -> str:
+        """Serialize to JSON text"""
+        compact = self.compact if compact is None else compact
+        if self.backend == "orjson":
+            orjson = self.orjson
+            option = orjson.OPT_NON_STR_KEYS
+            if not compact:
+                option |= orjson.OPT_INDENT_2
+            return orjson.dumps(result, default=self.encode_record, option=option).decode()
+        if compact:
+            return json.dumps(result, separators=(",", ":"), default=self.encode_record)
+        return json.dumps(result, indent=2, default=self.encode_record)
+    
+    @staticmethod
+    def encode_record(value: Any) -> Any:
+        """JSON form of a compact result record, built only while it is written out"""
+        as_json = getattr(value, "as_json", None)
+        return as_json() if as_json is not None else str(value)
+    
+    @staticmethod
+    def encode_cursor(offset: int, top_k: int) -> str:
+        """Opaque continuation cursor for the page starting at offset"""
+        return base64.urlsafe_b64encode(json.dumps({"offset": offset, "top_k": top_k}).encode()).decode()
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[int, int]:
+        """Return (offset, top_k) from a continuation cursor"""
+        try:
+            page = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            offset, top_k = page["offset"], page["top_k"]
+        except Exception:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        if not isinstance(offset, int) or not isinstance(top_k, int) or offset < 0 or top_k < 1:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        return offset, top_k
+    
+    @staticmethod
+    def collection_size(result: Dict[str, Any], field: str) -> int:
+        """Number of rankable entries in a truncatable field"""
+        value = result.get(field)
+        if not isinstance(value, (dict, list)):
+            return 0
+        if field == "service_dependencies":
+            return sum(len(targets) for targets in value.values())
+        return len(value)
+    
+    @staticmethod
+    def kept_size(result: Dict[str, Any]) -> Optional[int]:
+        """Size of the largest collection a tool cut down while decoding, or None if none was"""
+        sizes = [
+            ResultSerializer.collection_size(result, field) for field in TRUNCATABLE_RESULT_FIELDS
+            if getattr(result.get(field), "total", 0) > ResultSerializer.collection_size(result, field)
+            or getattr(result.get(field), "row_limit", None)
+        ]
+        return max(sizes) if sizes else None
+    
+    @staticmethod
+    def truncate(result: Dict[str, Any], top_k: int, offset: int = 0) -> Dict[str, Any]:
+        """Keep entries [offset, offset + top_k) of every truncatable collection"""
+        shaped = dict(result)
+        truncated = {}
+        end = offset + top_k
+        
+        for field, rank in TRUNCATABLE_RESULT_FIELDS.items():
+            value = result.get(field)
+            if not value:
+                continue
+            
+            if field == "service_dependencies":
+                # Rank individual edges, then regroup by source service
+                edges = sorted(
+                    ((source, edge) for source, targets in value.items() for edge in targets),
+                    key=lambda item: item[1].call_count, reverse=True
+                )
+                total = getattr(value, "total", len(edges))
+                regrouped: Dict[str, List[Dict[str, Any]]] = {}
+                for source, edge in edges[offset:end]:
+                    regrouped.setdefault(source, []).append(edge)
+                shaped[field] = regrouped
+            elif isinstance(value, dict):
+                items = sorted(value.items(), key=lambda item: rank(item[1]), reverse=True) if rank else list(value.items())
+                total = getattr(value, "total", len(items))
+                shaped[field] = dict(items[offset:end])
+            elif isinstance(value, list):
+                total = len(value)
+                shaped[field] = value[offset:end]
+            else:
+                continue
+            
+            row_limit = getattr(value, "row_limit", None)
+            if offset > 0 or total > end or row_limit:
+                truncated[field] = {"total": total, "returned": max(0, min(total, end) - offset)}
+                if row_limit:
+                    # The source query stopped at its LIMIT; more entries may exist
+                    truncated[field]["row_limit"] = row_limit
+        
+        if truncated:
+            shaped["truncated"] = {
+                "fields": truncated,
+                "offset": offset,
+                "top_k": top_k,
+                "next_cursor": (
+                    ResultSerializer.encode_cursor(end, top_k)
+                    if any(info["total"] > end for info in truncated.values()) else None
+                )
+            }
+        return shaped
+    
+    def render(
+        self,
+        result: Any,
+        compact: Optional[bool] = None,
+        top_k: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> str:
+        """Serialize a tool result within the top_k/max_bytes budget"""
+        if not isinstance(result, dict):
+            return self.dumps(result, compact)
+        if top_k is None and cursor is None:
+            # Collections the tool already cut down still get a truncated marker
+            top_k = self.kept_size(result)
+            if top_k is None and max_bytes is None:
+                return self.dumps(result, compact)
+        
+        offset = 0
+        if cursor:
+            offset, cursor_top_k = self.decode_cursor(cursor)
+            top_k = top_k or cursor_top_k
+        
+        limit = top_k
+        while True:
+            shaped = self.truncate(result, limit, offset) if limit is not None else result
+            text = self.dumps(shaped, compact)
+            if max_bytes is None or len(text.encode()) <= max_bytes:
+                return text
+            
+            # Halve the page until the payload fits or nothing is left to cut
+            largest = max(self.collection_size(shaped, field) for field in TRUNCATABLE_RESULT_FIELDS)
+            if largest <= 1:
+                return text
+            limit = largest // 2
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with approximate quantiles"""
+    
+    __slots__ = ("buckets", "count", "total_ms", "max_ms")
+    
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+    
+    def record(self, elapsed_ms: float):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+    
+    @classmethod
+    def from_cumulative(cls, at_most: Sequence[float], count: float, total_ms: float, max_ms: float) -> "LatencyHistogram":
+        """Rebuild from cumulative counts at or below each LATENCY_BUCKETS_MS bound"""
+        histogram = cls()
+        previous = 0
+        for i, cumulative in enumerate(at_most):
+            histogram.buckets[i] = max(0, int(cumulative) - previous)
+            previous = max(previous, int(cumulative))
+        histogram.buckets[-1] = max(0, int(count) - previous)
+        histogram.count = int(count)
+        histogram.total_ms = total_ms
+        histogram.max_ms = max_ms
+        return histogram
+    
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (max for the open bucket)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank:
+                return min(float(LATENCY_BUCKETS_MS[i]), self.max_ms) if i < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets_ms": dict(zip([str(b) for b in LATENCY_BUCKETS_MS] + ["+Inf"], self.buckets))
+        }
+
+class QuantileSketch:
+    """Mergeable relative-error quantile sketch (DDSketch layout)
+    
+    Positive values land in logarithmic bins ``ceil(log_gamma(value))`` with
+    ``gamma = (1 + accuracy) / (1 - accuracy)``, so every quantile comes back
+    within ``accuracy`` relative error. Sketches with the same accuracy merge by
+    adding bin counts, which lets per-bucket bins pulled from Elastic answer
+    any window or roll-up in memory. Non-positive values are counted apart.
+    """
+    
+    __slots__ = ("accuracy", "gamma", "bins", "zero_count", "count")
+    
+    def __init__(self, accuracy: float = 0.02):
+        self.accuracy = min(max(accuracy, 0.0001), 0.5)
+        self.gamma = (1 + self.accuracy) / (1 - self.accuracy)
+        self.bins: Dict[int, float] = {}
+        self.zero_count = 0.0
+        self.count = 0.0
+    
+    @staticmethod
+    def index_expression(field: str, accuracy: float) -> str:
+        """ES|QL expression for the bin of field (null for values that are not positive)"""
+        accuracy = min(max(accuracy, 0.0001), 0.5)
+        scale = 1 / math.log10((1 + accuracy) / (1 - accuracy))
+        return f"CEIL(LOG10({field}) * {scale:.12g})"
+    
+    def add(self, value: float, count: float = 1):
+        self.add_bin(math.ceil(math.log(value, self.gamma)) if value > 0 else None, count)
+    
+    def add_bin(self, index: Optional[float], count: float):
+        """Add count values to bin index (None for values that are not positive)"""
+        if not count:
+            return
+        if index is None:
+            self.zero_count += count
+        else:
+            index = int(index)
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+    
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+    
+    def bin_value(self, index: int) -> float:
+        """Representative value of a bin, within accuracy of everything in it"""
+        return 2 * self.gamma ** index / (self.gamma + 1)
+    
+    def quantile(self, q: float) -> float:
+        """Estimate of the q-quantile, within the sketch's relative accuracy"""
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return self.bin_value(index)
+        return self.bin_value(max(self.bins))
+
+# Per-bin aggregates of the binned latency series
+LATENCY_BIN_AGGREGATES = {
+    "count": "COUNT(*)",
+    "error_count": 'SUM(CASE WHEN transaction.result = "error" THEN 1 ELSE 0 END)',
+    "duration_sum": "SUM(transaction.duration.us)",
+    "duration_count": "COUNT(transaction.duration.us)",
+    "max_duration": "MAX(transaction.duration.us)"
+}
+
+class GroupLatency:
+    """Transaction totals and latency sketch of one group, summed over its bins
+    
+    With a ``slow_threshold`` (microseconds), bins whose representative value
+    lies above it are also totalled as the group's slow transactions.
+    """
+    
+    __slots__ = ("sketch", "count", "error_count", "duration_sum", "duration_count",
+                 "slow_threshold", "slow_count", "slow_duration_sum", "slow_max_duration")
+    
+    def __init__(self, accuracy: float, slow_threshold: Optional[float] = None):
+        self.sketch = QuantileSketch(accuracy)
+        self.count = self.error_count = self.duration_sum = self.duration_count = 0.0
+        self.slow_threshold = slow_threshold
+        self.slow_count = self.slow_duration_sum = self.slow_max_duration = 0.0
+    
+    def add_bin(self, index: Optional[float], values: Dict[str, float]):
+        self.sketch.add_bin(index, values["duration_count"])
+        self.count += values["count"]
+        self.error_count += values["error_count"]
+        self.duration_sum += values["duration_sum"]
+        self.duration_count += values["duration_count"]
+        if (
+            self.slow_threshold is not None and index is not None and values["duration_count"]
+            and self.sketch.bin_value(int(index)) > self.slow_threshold
+        ):
+            self.slow_count += values["duration_count"]
+            self.slow_duration_sum += values["duration_sum"]
+            self.slow_max_duration = max(self.slow_max_duration, values["max_duration"])
+
+class OTLPExporter:
+    """Export tool and query spans and metrics over OTLP/HTTP
+    
+    Requires opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http; the
+    providers are private to this server so they never replace global ones.
+    """
+    
+    def __init__(self, endpoint: str, service_name: str = "elastic-otel-mcp"):
+        from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        
+        endpoint = endpoint.rstrip("/")
+        resource = Resource.create({"service.name": service_name})
+        
+        self.tracer_provider = TracerProvider(resource=resource)
+        self.tracer_provider.add_span_processor(
+            BatchSpanProcessor(OTLPSpanExporter(endpoint=f"{endpoint}/v1/traces"))
+        )
+        self.tracer = self.tracer_provider.get_tracer(service_name)
+        
+        self.meter_provider = MeterProvider(
+            resource=resource,
+            metric_readers=[PeriodicExportingMetricReader(OTLPMetricExporter(endpoint=f"{endpoint}/v1/metrics"))]
+        )
+        meter = self.meter_provider.get_meter(service_name)
+        self.tool_duration = meter.create_histogram("mcp.tool.duration", unit="ms")
+        self.tool_errors = meter.create_counter("mcp.tool.errors")
+        self.tool_bytes_out = meter.create_counter("mcp.tool.response.size", unit="By")
+        self.query_duration = meter.create_histogram("esql.query.duration", unit="ms")
+        self.query_errors = meter.create_counter("esql.query.errors")
+        self.query_bytes_in = meter.create_counter("esql.query.response.size", unit="By")
+        self.query_rows = meter.create_counter("esql.query.rows")
+    
+    def shutdown(self):
+        self.tracer_provider.shutdown()
+        self.meter_provider.shutdown()
+
+class ServerStats:
+    """Hot-path counters and latency histograms per tool and per data view"""
+    
+    def __init__(self, exporter: Optional[OTLPExporter] = None):
+        self.started_at = time.time()
+        self.exporter = exporter
+        self.tools: Dict[str, Dict[str, Any]] = {}
+        self.queries: Dict[str, Dict[str, Any]] = {}
+        self.templates: Dict[str, Dict[str, Any]] = {}
+        self.queries_in_flight = 0
+    
+    @staticmethod
+    def _entry() -> Dict[str, Any]:
+        return {"latency": LatencyHistogram(), "errors": 0, "bytes": 0, "rows": 0}
+    
+    def span(self, name: str, **attributes: Any):
+        """Context manager for an OTLP span, or a no-op when export is off"""
+        if self.exporter is None:
+            return contextlib.nullcontext()
+        return self.exporter.tracer.start_as_current_span(name, attributes=attributes)
+    
+    def record_tool(self, name: str, elapsed_ms: float, bytes_out: int, error: bool):
+        entry = self.tools.setdefault(name, self._entry())
+        entry["latency"].record(elapsed_ms)
+        entry["bytes"] += bytes_out
+        entry["errors"] += int(error)
+        
+        if self.exporter is not None:
+            attributes = {"tool": name}
+            self.exporter.tool_duration.record(elapsed_ms, attributes)
+            self.exporter.tool_bytes_out.add(bytes_out, attributes)
+            if error:
+                self.exporter.tool_errors.add(1, attributes)
+    
+    def record_query(
+        self,
+        data_view: str,
+        elapsed_ms: float,
+        bytes_in: int,
+        rows: int,
+        error: bool,
+        template: Optional[str] = None,
+    ):
+        entries = [self.queries.setdefault(data_view, self._entry())]
+        if template is not None:
+            entries.append(self.templates.setdefault(template, self._entry()))
+        for entry in entries:
+            entry["latency"].record(elapsed_ms)
+            entry["bytes"] += bytes_in
+            entry["rows"] += rows
+            entry["errors"] += int(error)
+        
+        if self.exporter is not None:
+            attributes = {"data_view": data_view}
+            if template is not None:
+                attributes["template"] = template
+            self.exporter.query_duration.record(elapsed_ms, attributes)
+            self.exporter.query_bytes_in.add(bytes_in, attributes)
+            self.exporter.query_rows.add(rows, attributes)
+            if error:
+                self.exporter.query_errors.add(1, attributes)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+            "otlp_export": self.exporter is not None,
+            "tools": {
+                name: {
+                    "calls": entry["latency"].count,
+                    "errors": entry["errors"],
+                    "bytes_out": entry["bytes"],
+                    "latency": entry["latency"].snapshot()
+                }
+                for name, entry in self.tools.items()
+            },
+            "queries": {
+                data_view: {
+                    "queries": entry["latency"].count,
+                    "errors": entry["errors"],
+                    "bytes_in": entry["bytes"],
+                    "rows": entry["rows"],
+                    "latency": entry["latency"].snapshot()
+                }
+                for data_view, entry in self.queries.items()
+            },
+            "templates": {
+                template: {
+                    "queries": entry["latency"].count,
+                    "errors": entry["errors"],
+                    "bytes_in": entry["bytes"],
+                    "rows": entry["rows"],
+                    "latency": entry["latency"].snapshot()
+                }
+                for template, entry in self.templates.items()
+            },
+            "queries_in_flight": self.queries_in_flight
+        }
+
+# Responses that signal an overloaded or briefly unavailable cluster
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+# Error types a cluster without ES|QL SAMPLE answers a sampled query with
+SAMPLE_UNSUPPORTED_ERRORS = {"verification_exception", "parsing_exception"}
+
+def esql_error_type(error: Exception) -> Optional[str]:
+    """Elasticsearch's error type for a rejected request, such as verification_exception"""
+    if not isinstance(error, httpx.HTTPStatusError):
+        return None
+    with contextlib.suppress(ValueError, KeyError, TypeError):
+        return error.response.json()["error"]["type"]
+    return None
+
+class CircuitOpenError(Exception):
+    """Raised instead of querying Elastic while the circuit breaker is open"""
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD limit on concurrently outgoing ES|QL requests
+    
+    The limit grows by roughly one per window of successful requests and is
+    cut multiplicatively (at most once per cooldown) when Elastic throttles or
+    times out, so bursts queue locally instead of piling onto the cluster.
+    """
+    
+    def __init__(
+        self,
+        initial: int = 8,
+        minimum: int = 1,
+        maximum: int = 64,
+        backoff_ratio: float = 0.5,
+        cooldown: float = 1.0,
+    ):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.backoff_ratio = backoff_ratio
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.overloads = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+    
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+    
+    async def on_success(self):
+        """Additive increase, waking waiting requests when it opens a slot"""
+        slots = int(self.limit)
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        if int(self.limit) > slots:
+            async with self._condition:
+                self._condition.notify_all()
+    
+    def on_overload(self):
+        """Multiplicative decrease, at most once per cooldown"""
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.backoff_ratio)
+        self.overloads += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "min": self.minimum,
+            "max": self.maximum,
+            "overloads": self.overloads
+        }
+
+class CircuitBreaker:
+    """Fail fast after repeated Elastic failures, probing again after a timeout"""
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probe_started: Optional[float] = None
+    
+    def allow_request(self) -> bool:
+        """Whether a request may be sent now (one probe at a time when half-open)"""
+        now = time.monotonic()
+        if self.state == "open" and now - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+        if self.state == "closed":
+            return True
+        # A probe that never reported back (e.g. cancelled) does not block forever
+        if self.state == "half_open" and (
+            self._probe_started is None or now - self._probe_started >= self.reset_timeout
+        ):
+            self._probe_started = now
+            return True
+        self.rejected += 1
+        return False
+    
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_started = None
+    
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe_started = None
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"Elastic circuit breaker opened after {self.consecutive_failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout_seconds": self.reset_timeout,
+            "rejected": self.rejected
+        }
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class QueryPlan:
+    """A set of independent ES|QL sub-queries executed concurrently"""
+    
+    def __init__(self, max_concurrency: int = 4, data_views: Optional[Dict[str, str]] = None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.data_views = data_views or {}
+        self.queries: Dict[str, EsqlQuery] = {}
+    
+    def add(self, key: str, query: EsqlQuery) -> "QueryPlan":
+        """Add a named, bound sub-query to the plan"""
+        self.queries[key] = query
+        return self
+    
+    async def execute(
+        self, executor: Callable[..., Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """Run all sub-queries, at most max_concurrency at a time, keyed by name"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def run(query: EsqlQuery) -> Dict[str, Any]:
+            async with semaphore:
+                return await executor(
+                    query.query,
+                    self.data_views.get(query.data_view, query.data_view),
+                    params=query.params,
+                    template=query.template,
+                    window=query.window
+                )
+        
+        results = await asyncio.gather(*(run(query) for query in self.queries.values()))
+        return dict(zip(self.queries.keys(), results))
+
+# Rows a merged scan asks for; a full page is re-run as the separate queries
+SHARED_SCAN_ROW_LIMIT = 10000
+
+class SharedScanPlanner:
+    """Combine the ES|QL queries that concurrently running sub-tools issue
+    
+    Queries submitted within a few event-loop turns of each other form one
+    batch. Identical queries run once. ``STATS`` queries that differ only in
+    their aggregates (same source, filters, params and ``BY``, and nothing
+    but ``SORT`` and ``LIMIT`` after the aggregation) are merged into one
+    scan, with clashing aggregate names aliased. Each caller gets back only
+    its own columns under its own names, sorted and limited as it asked.
+    A merged scan that fills ``SHARED_SCAN_ROW_LIMIT`` may be missing groups
+    some caller would have kept, so its queries are then run separately.
+    """
+    
+    def __init__(
+        self,
+        executor: Callable[..., Awaitable[Dict[str, Any]]],
+        max_concurrency: int = 4,
+        settle_turns: int = 3,
+    ):
+        self.executor = executor
+        self.max_concurrency = max(1, max_concurrency)
+        self.settle_turns = settle_turns
+        self.pending: List[Tuple[str, str, Optional[List[Dict[str, Any]]], Optional[str], Optional[int], asyncio.Future]] = []
+        self._flush: Optional[asyncio.Task] = None
+        self.requested = 0
+        self.executed = 0
+        self.deduplicated = 0
+        self.merged = 0
+    
+    async def submit(
+        self,
+        query: str,
+        data_view: str,
+        params: Optional[List[Dict[str, Any]]] = None,
+        template: Optional[str] = None,
+        window: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Queue a query for the next batch and wait for its own result"""
+        self.requested += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((query, data_view, params, template, window, future))
+        if self._flush is None:
+            self._flush = asyncio.ensure_future(self._flush_soon())
+        return await future
+    
+    @staticmethod
+    def shape(query: str) -> Optional[Tuple[str, List[Tuple[str, str]], str]]:
+        """(clauses before STATS, aggregates, BY) of a mergeable query, else None"""
+        clauses = [clause.strip() for clause in re.split(r"\n\s*\|", query.strip())]
+        stats = [i for i, clause in enumerate(clauses) if clause.upper().startswith("STATS")]
+        if len(stats) != 1 or any(
+            not clause.upper().startswith(("SORT", "LIMIT")) for clause in clauses[stats[0] + 1:]
+        ):
+            return None
+        aggregates, *by = re.split(r"\s+BY\s+", clauses[stats[0]][len("STATS"):], 1)
+        if not by:
+            return None
+        named = []
+        for aggregate in split_top_level(aggregates):
+            name, _, expression = aggregate.partition("=")
+            named.append((name.strip(), expression.strip()))
+        return "\n| ".join(clauses[:stats[0]]), named, " ".join(by[0].split())
+    
+    async def _flush_soon(self):
+        # Let every sub-tool started alongside reach its first query
+        for _ in range(self.settle_turns):
+            await asyncio.sleep(0)
+        batch, self.pending, self._flush = self.pending, [], None
+        try:
+            await self._run(batch)
+        except BaseException as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+    
+    async def _run(self, batch):
+        # Identical queries share one entry
+        unique: Dict[Tuple[str, str, str, Optional[int]], List[Any]] = {}
+        for query, data_view, params, template, window, future in batch:
+            key = (" ".join(query.split()), data_view, json.dumps(params, sort_keys=True, default=str), window)
+            if key in unique:
+                self.deduplicated += 1
+                unique[key][-1].append(future)
+            else:
+                unique[key] = [query, data_view, params, template, window, [future]]
+        
+        # Then queries over the same scan are merged, unless an aggregate name clashes
+        scans: List[Dict[str, Any]] = []
+        groups: Dict[Tuple[Any, ...], List[Dict[str, Any]]] = {}
+        for key, (query, data_view, params, template, window, futures) in unique.items():
+            member = {"query": query, "template": template, "futures": futures}
+            shape = self.shape(query)
+            if shape is None:
+                scans.append({"query": query, "data_view": data_view, "params": params, "template": template,
+                              "window": window, "members": [member]})
+                continue
+            prefix, aggregates, by = shape
+            group_key = (prefix, by, key[1], key[2], window)
+            if group_key not in groups:
+                groups[group_key] = {"query": query, "prefix": prefix, "by": by, "aggregates": {}, "data_view": data_view,
+                                     "params": params, "template": template, "window": window, "members": []}
+                scans.append(groups[group_key])
+            scan = groups[group_key]
+            
+            # Reuse an identical aggregate; alias one whose name is taken by another expression
+            member["columns"] = {}
+            for name, expression in aggregates:
+                alias = next((a for a, e in scan["aggregates"].items() if e == expression), None)
+                if alias is None:
+                    alias, suffix = name, 1
+                    while alias in scan["aggregates"]:
+                        alias, suffix = f"{name}_{suffix}", suffix + 1
+                    scan["aggregates"][alias] = expression
+                member["columns"][alias] = name
+            scan["members"].append(member)
+        
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def run(scan: Dict[str, Any]):
+            shared = len(scan["members"]) > 1
+            if shared:
+                self.merged += len(scan["members"]) - 1
+                stats = ",\n    ".join(f"{name} = {expression}" for name, expression in scan["aggregates"].items())
+                scan["query"] = f"{scan['prefix']}\n| STATS\n    {stats}\nBY {scan['by']}\n| LIMIT {SHARED_SCAN_ROW_LIMIT}"
+                scan["template"] = "shared_scan"
+            async with semaphore:
+                self.executed += 1
+                result = await self.executor(
+                    scan["query"], scan["data_view"], params=scan["params"], template=scan["template"], window=scan["window"]
+                )
+            if shared and "error" not in result and len(EsqlColumns.from_response(result)) >= SHARED_SCAN_ROW_LIMIT:
+                self.merged -= len(scan["members"]) - 1
+                await asyncio.gather(*(
+                    run({**scan, "query": member["query"], "template": member["template"], "members": [member]})
+                    for member in scan["members"]
+                ))
+                return
+            for member in scan["members"]:
+                own = result if len(scan["members"]) == 1 or "error" in result else self.project(result, member)
+                for future in member["futures"]:
+                    if not future.done():
+                        future.set_result(own)
+        
+        await asyncio.gather(*(run(scan) for scan in scans))
+    
+    @staticmethod
+    def project(result: Dict[str, Any], member: Dict[str, Any]) -> Dict[str, Any]:
+        """A member's own columns of a shared scan, sorted as its query asked"""
+        merger = EsqlResultMerger(member["query"])
+        names = {**member["columns"], **{group: group for group in merger.groups}}
+        columns = [column for column in result.get("columns") or [] if column["name"] in names]
+        table = EsqlColumns.from_response(result)
+        projected = {
+            "columns": [{**column, "name": names[column["name"]]} for column in columns],
+            "values": [list(table.column(column["name"])) for column in columns],
+            "columnar": True
+        }
+        own = merger.merge([projected])
+        for field in ("federation", "partial"):
+            if field in result:
+                own[field] = result[field]
+        return own
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queries_requested": self.requested,
+            "scans_executed": self.executed,
+            "deduplicated": self.deduplicated,
+            "merged": self.merged
+        }
+
+class PersistentStore:
+    """SQLite store of ES|QL results and incremental aggregates across restarts
+    
+    Several server processes may share one file: WAL mode lets readers run
+    alongside a writer, and writers wait up to ``busy_timeout`` for the lock.
+    Every 32 writes, results older than ``ttl`` seconds are evicted and the
+    oldest results go first while their total size exceeds ``max_bytes``. Series that have not
+    been saved for a day are dropped. Store errors are logged and treated as
+    misses, never surfaced to tools.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY, data_view TEXT, stored_at REAL, size INTEGER, value TEXT
+        );
+        CREATE INDEX IF NOT EXISTS results_stored_at ON results (stored_at);
+        CREATE TABLE IF NOT EXISTS series (
+            name TEXT PRIMARY KEY, signature TEXT, covered_from INTEGER, settled_through INTEGER,
+            retention_minutes INTEGER, saved_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS buckets (
+            name TEXT, minute INTEGER, grp TEXT, value TEXT, PRIMARY KEY (name, minute, grp)
+        );
+    """
+    
+    def __init__(self, path: str, ttl: float = 300.0, max_bytes: int = 64 * 1024 * 1024, busy_timeout: float = 5.0):
+        import sqlite3
+        import threading
+        
+        self.sqlite3 = sqlite3
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(self.SCHEMA)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+        self._puts_since_trim = 0
+    
+    @staticmethod
+    def result_key(key: Tuple[str, str]) -> str:
+        query, data_view = key
+        return hashlib.sha256(f"{data_view}\n{query}".encode()).hexdigest()
+    
+    def _run(self, operation: Callable[[Any], Any], default: Any = None) -> Any:
+        """Run operation on the connection inside a transaction, logging store errors"""
+        try:
+            with self._lock:
+                connection = self._connection
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    value = operation(connection)
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+                connection.execute("COMMIT")
+                return value
+        except self.sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Persistent store {self.path}: {e}")
+            return default
+    
+    def get_result(self, key: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+        """A stored result younger than the TTL, or None"""
+        row = self._run(lambda connection: connection.execute(
+            "SELECT value FROM results WHERE key = ? AND stored_at >= ?",
+            (self.result_key(key), time.time() - self.ttl)
+        ).fetchone())
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+    
+    def put_result(self, key: Tuple[str, str], result: Dict[str, Any]):
+        value = json.dumps(result, separators=(",", ":"), default=str)
+        now = time.time()
+        self._puts_since_trim += 1
+        trim = self._puts_since_trim >= 32
+        if trim:
+            self._puts_since_trim = 0
+        
+        def put(connection):
+            connection.execute(
+                "INSERT OR REPLACE INTO results (key, data_view, stored_at, size, value) VALUES (?, ?, ?, ?, ?)",
+                (self.result_key(key), key[1], now, len(value), value)
+            )
+            if trim:
+                self._trim(connection, now)
+        
+        self._run(put)
+        self.writes += 1
+    
+    def _trim(self, connection, now: float):
+        """Evict expired results, then the oldest until under the size cap"""
+        self.evictions += connection.execute("DELETE FROM results WHERE stored_at < ?", (now - self.ttl,)).rowcount
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        for rowid, size in connection.execute("SELECT rowid, size FROM results ORDER BY stored_at, rowid").fetchall():
+            if total <= self.max_bytes:
+                break
+            total -= size
+            self.evictions += connection.execute("DELETE FROM results WHERE rowid = ?", (rowid,)).rowcount
+        stale = [row[0] for row in connection.execute("SELECT name FROM series WHERE saved_at < ?", (now - 86400,))]
+        for name in stale:
+            connection.execute("DELETE FROM buckets WHERE name = ?", (name,))
+            connection.execute("DELETE FROM series WHERE name = ?", (name,))
+    
+    def load_series(self, name: str, signature: str) -> Optional[Tuple[Dict[int, Dict[Any, List[float]]], int, int, int]]:
+        """(buckets, covered_from, settled_through, retention_minutes) of a saved series"""
+        def load(connection):
+            state = connection.execute(
+                "SELECT covered_from, settled_through, retention_minutes FROM series WHERE name = ? AND signature = ?",
+                (name, signature)
+            ).fetchone()
+            if state is None:
+                return None
+            buckets: Dict[int, Dict[Any, List[float]]] = {}
+            for minute, group, value in connection.execute(
+                "SELECT minute, grp, value FROM buckets WHERE name = ? AND minute >= ?", (name, state[0])
+            ):
+                group = json.loads(group)
+                buckets.setdefault(minute, {})[tuple(group) if isinstance(group, list) else group] = json.loads(value)
+            return buckets, *state
+        return self._run(load)
+    
+    def save_series(
+        self,
+        name: str,
+        signature: str,
+        buckets: Dict[int, Dict[Any, List[float]]],
+        fetch_from: int,
+        covered_from: int,
+        settled_through: int,
+        retention_minutes: int,
+    ):
+        """Replace minutes from fetch_from onwards and drop those before covered_from"""
+        def save(connection):
+            connection.execute(
+                "DELETE FROM buckets WHERE name = ? AND (minute >= ? OR minute < ?)", (name, fetch_from, covered_from)
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO buckets (name, minute, grp, value) VALUES (?, ?, ?, ?)",
+                [
+                    (name, minute, json.dumps(group, default=str), json.dumps(values))
+                    for minute, groups in buckets.items() if minute >= fetch_from
+                    for group, values in groups.items()
+                ]
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?, ?)",
+                (name, signature, covered_from, settled_through, retention_minutes, time.time())
+            )
+        self._run(save)
+    
+    def close(self):
+        with self._lock:
+            self._connection.close()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "ttl_seconds": self.ttl,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "errors": self.errors
+        }
+
+class QueryResultCache:
+    """Bounded LRU cache of ES|QL results with time-bucket aligned expiry
+    
+    Entries expire at the end of the ``ttl``-second wall-clock bucket in which
+    their query started, so every caller inside one bucket sees the same answer
+    for a relative window such as ``NOW() - 15m``. Concurrent misses for the
+    same key share a single in-flight query. With a ``store``, a key this
+    process has not cached yet (e.g. after a restart) is looked up on disk
+    before Elastic is queried.
+    """
+    
+    def __init__(self, max_entries: int = 256, ttl: float = 30.0, store: Optional[PersistentStore] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.store = store
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str], "asyncio.Future[Dict[str, Any]]"] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.stale_served = 0
+    
+    @staticmethod
+    def make_key(query: str, data_view: str, params: Optional[List[Dict[str, Any]]] = None) -> Tuple[str, str]:
+        """Normalize whitespace so formatting differences share an entry"""
+        key = " ".join(query.split())
+        if params:
+            key = f"{key} {json.dumps(params, sort_keys=True, default=str)}"
+        return key, data_view
+    
+    def bucket_end(self, timestamp: float) -> float:
+        """End of the TTL bucket containing timestamp"""
+        return (math.floor(timestamp / self.ttl) + 1) * self.ttl
+    
+    def get(self, key: Tuple[str, str], max_stale: float = 0.0) -> Optional[Dict[str, Any]]:
+        """Return a cached result no more than max_stale seconds past expiry, or None
+        
+        Expired entries stay in the LRU so they can still be served stale while
+        Elastic is unavailable.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if time.time() >= expires_at + max_stale:
+            return None
+        self._entries.move_to_end(key)
+        return result
+    
+    def get_stale(self, key: Tuple[str, str], max_age: float) -> Optional[Dict[str, Any]]:
+        """Return an expired result as a fallback when a fresh query failed"""
+        result = self.get(key, max_stale=max_age)
+        if result is not None:
+            self.stale_served += 1
+        return result
+    
+    def put(self, key: Tuple[str, str], result: Dict[str, Any], started_at: float):
+        """Store a result until the end of the bucket its query started in"""
+        self._entries[key] = (self.bucket_end(started_at), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    async def get_or_fetch(
+        self, key: Tuple[str, str], fetch: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """Return the cached result or run fetch once for all concurrent callers"""
+        cached = self.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch_and_store(key, fetch))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        
+        # Shield so one cancelled caller does not cancel the shared query
+        return await asyncio.shield(task)
+    
+    async def _fetch_and_store(
+        self, key: Tuple[str, str], fetch: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        started_at = time.time()
+        try:
+            if self.store is not None and key not in self._entries:
+                stored = await asyncio.to_thread(self.store.get_result, key)
+                if stored is not None:
+                    self.put(key, stored, started_at)
+                    return stored
+            result = await fetch()
+            if "error" not in result and not result.get("partial"):
+                self.put(key, result, started_at)
+                if self.store is not None:
+                    await asyncio.to_thread(self.store.put_result, key, result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+    
+    def clear(self):
+        """Drop all cached results"""
+        self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "stale_served": self.stale_served,
+            "in_flight": len(self._inflight),
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "store": self.store.stats() if self.store is not None else {"enabled": False}
+        }
+
+class SlidingWindowAggregator:
+    """Per-minute partial aggregates for one grouped ES|QL series
+    
+    Partials (counts and sums) are fetched with ``BUCKET(@timestamp, 1 minute)``
+    and kept in memory. Each refresh only re-queries the minutes after the last
+    settled one, so any window up to ``max_minutes`` is answered by summing
+    buckets locally. The newest ``settle_minutes`` are always re-fetched to pick
+    up late-arriving documents.
+    
+    With ``bucket_minutes`` above one, buckets are that many minutes wide and
+    a window is widened to start on a bucket boundary. ``group_field`` may list
+    several comma-separated fields, in which case groups are tuples. Aggregates
+    named ``max_*`` are merged with ``max`` instead of summed. ``eval`` adds
+    computed group fields.
+    
+    Every refresh page carries an explicit ``LIMIT``. A page that comes back
+    full may have lost rows, so its time range is split in half and fetched
+    again; only when a single bucket overflows does the refresh fail, and
+    then nothing is marked as covered and the series is not queried again for
+    ``SERIES_OVERFLOW_RETRY_SECONDS``. A partial federated page fails the
+    refresh the same way an error does. ``params`` binds placeholders in
+    ``where``.
+    """
+    
+    def __init__(
+        self,
+        source: str,
+        group_field: str,
+        aggregates: Dict[str, str],
+        settle_minutes: int = 2,
+        max_minutes: int = 1440,
+        name: str = "sliding_window",
+        bucket_minutes: int = 1,
+        where: Optional[str] = None,
+        store: Optional[PersistentStore] = None,
+        eval: Optional[str] = None,
+        limit: int = SERIES_ROW_LIMIT,
+        params: Optional[List[Dict[str, Any]]] = None,
+    ):
+        self.name = name
+        self.bucket_minutes = max(1, bucket_minutes)
+        self.source = source
+        self.group_field = group_field
+        self.group_fields = [field.strip() for field in group_field.split(",")]
+        self.where = where
+        self.eval = eval
+        self.limit = limit
+        self.params = params or []
+        self.overflowed_until = 0.0
+        self.aggregates = aggregates
+        self.max_merged = [name.startswith("max_") for name in aggregates]
+        self.settle_minutes = max(1, settle_minutes)
+        self.max_minutes = max_minutes
+        self.buckets: Dict[int, Dict[str, List[float]]] = {}
+        self.covered_from: Optional[int] = None
+        self.settled_through: Optional[int] = None
+        self.retention_minutes = 0
+        self._lock = asyncio.Lock()
+        # Saved partials are only reused by a series with the same definition
+        self.store = store
+        self.signature = hashlib.sha256(
+            json.dumps([source, group_field, aggregates, where, self.params, self.bucket_minutes, eval]).encode()
+        ).hexdigest()
+        self._loaded = store is None
+    
+    @staticmethod
+    def minute_timestamp(minute: int) -> str:
+        return datetime.fromtimestamp(minute * 60, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+    
+    def build_query(self, start_minute: int, end_minute: Optional[int] = None) -> Tuple[str, List[Dict[str, Any]]]:
+        """ES|QL for per-minute partials from start_minute (up to end_minute, exclusive), with its params"""
+        params = [{"start": self.minute_timestamp(start_minute)}, *self.params]
+        conditions = ["@timestamp >= TO_DATETIME(?start)"]
+        if end_minute is not None:
+            params.append({"end": self.minute_timestamp(end_minute)})
+            conditions.append("@timestamp < TO_DATETIME(?end)")
+        if self.where:
+            conditions.append(self.where)
+        stats = ",\n            ".join(f"{name} = {expression}" for name, expression in self.aggregates.items())
+        evaluate = f"\n        | EVAL {self.eval}" if self.eval else ""
+        query = f"""
+        FROM {self.source}
+        | WHERE {" AND ".join(conditions)}{evaluate}
+        | STATS 
+            {stats}
+        BY minute = BUCKET(@timestamp, {self.bucket_interval}), {self.group_field}
+        | LIMIT {self.limit}
+        """
+        return query, params
+    
+    @property
+    def bucket_interval(self) -> str:
+        return esql_interval(f"{self.bucket_minutes}m")
+    
+    def align(self, minute: int) -> int:
+        """Start of the bucket containing minute"""
+        return minute - minute % self.bucket_minutes
+    
+    @staticmethod
+    def bucket_minute(value: Any) -> int:
+        """Minute index of a BUCKET value (ISO string, datetime or epoch millis)"""
+        if isinstance(value, (int, float)):
+            return int(value // 60000)
+        if isinstance(value, datetime):
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=timezone.utc)
+            return int(value.timestamp() // 60)
+        return int(datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp() // 60)
+    
+    async def window(
+        self,
+        minutes: int,
+        executor: Callable[..., Awaitable[Dict[str, Any]]],
+        data_view: str,
+    ) -> Optional[Dict[str, Dict[str, float]]]:
+        """Totals per group over the last ``minutes`` minutes, or None on query failure"""
+        if time.time() < self.overflowed_until:
+            return None
+        async with self._lock:
+            if not self._loaded:
+                # Resume from partials saved by an earlier or concurrent process
+                saved = await asyncio.to_thread(self.store.load_series, self.name, self.signature)
+                if saved is not None:
+                    self.buckets, self.covered_from, self.settled_through, self.retention_minutes = saved
+                self._loaded = True
+            
+            now_minute = int(time.time() // 60)
+            window_start = self.align(now_minute - minutes)
+            self.retention_minutes = min(max(self.retention_minutes, minutes), self.max_minutes)
+            
+            if self.covered_from is None or window_start < self.covered_from:
+                fetch_from = window_start
+            else:
+                fetch_from = max(window_start, self.align(self.settled_through - self.settle_minutes + 1))
+            
+            pages = await self.fetch(fetch_from, None, now_minute, executor, data_view)
+            if pages is None:
+                return None
+            
+            # Replace everything from fetch_from onwards with the fresh partials
+            for minute in [m for m in self.buckets if m >= fetch_from]:
+                del self.buckets[minute]
+            width = len(self.group_fields)
+            for columns in pages:
+                for minute, *row in columns.rows("minute", *self.group_fields, *self.aggregates):
+                    group = tuple(row[:width]) if width > 1 else row[0]
+                    self.buckets.setdefault(self.bucket_minute(minute), {})[group] = [value or 0 for value in row[width:]]
+            
+            self.covered_from = fetch_from if self.covered_from is None else min(self.covered_from, fetch_from)
+            self.settled_through = self.align(now_minute) - 1
+            
+            # Roll the retained range forward
+            oldest = self.align(now_minute - self.retention_minutes)
+            for minute in [m for m in self.buckets if m < oldest]:
+                del self.buckets[minute]
+            self.covered_from = max(self.covered_from, oldest)
+            if self.store is not None:
+                await asyncio.to_thread(
+                    self.store.save_series, self.name, self.signature, self.buckets, fetch_from,
+                    self.covered_from, self.settled_through, self.retention_minutes
+                )
+            
+            totals: Dict[str, List[float]] = {}
+            for minute, groups in self.buckets.items():
+                if minute < window_start:
+                    continue
+                for group, values in groups.items():
+                    accumulated = totals.get(group)
+                    if accumulated is None:
+                        totals[group] = list(values)
+                    else:
+                        for i, value in enumerate(values):
+                            accumulated[i] = max(accumulated[i], value) if self.max_merged[i] else accumulated[i] + value
+        
+        names = list(self.aggregates)
+        return {group: dict(zip(names, values)) for group, values in totals.items()}
+    
+    async def fetch(
+        self,
+        start_minute: int,
+        end_minute: Optional[int],
+        now_minute: int,
+        executor: Callable[..., Awaitable[Dict[str, Any]]],
+        data_view: str,
+    ) -> Optional[List[EsqlColumns]]:
+        """Partials for [start_minute, end_minute), halving the range while a page comes back full"""
+        query, params = self.build_query(start_minute, end_minute)
+        # The series is its own cache; a cached page would hide newly settled data
+        result = await executor(
+            query, data_view, no_cache=True, params=params, template=self.name, window=(now_minute - start_minute) * 60
+        )
+        if "error" in result or result.get("partial"):
+            # A federated endpoint failed; its share must not be saved as settled
+            return None
+        columns = EsqlColumns.from_response(result)
+        if len(columns) < self.limit:
+            return [columns]
+        
+        stop = end_minute if end_minute is not None else self.align(now_minute) + self.bucket_minutes
+        middle = self.align((start_minute + stop) // 2)
+        if middle <= start_minute:
+            logger.warning(
+                f"Series {self.name}: one bucket exceeds {self.limit} rows; "
+                f"not querying it for {SERIES_OVERFLOW_RETRY_SECONDS}s"
+            )
+            self.overflowed_until = time.time() + SERIES_OVERFLOW_RETRY_SECONDS
+            return None
+        first = await self.fetch(start_minute, middle, now_minute, executor, data_view)
+        if first is None:
+            return None
+        rest = await self.fetch(middle, end_minute, now_minute, executor, data_view)
+        return None if rest is None else first + rest
+
+class DependencyEdge:
+    """Calls from one service to another, with their latency histogram"""
+    
+    __slots__ = ("source", "target", "call_count", "latency")
+    
+    def __init__(self, source: str, target: str, call_count: int, latency: LatencyHistogram):
+        self.source = source
+        self.target = target
+        self.call_count = call_count
+        self.latency = latency
+    
+    @property
+    def avg_ms(self) -> float:
+        return self.latency.total_ms / self.latency.count if self.latency.count else 0.0
+    
+    def as_json(self) -> Dict[str, Any]:
+        return {
+            "target": self.target,
+            "call_count": self.call_count,
+            "avg_latency_ms": round(self.avg_ms, 3),
+            "p95_latency_ms": self.latency.quantile(0.95)
+        }
+
+class DependencyGraph:
+    """Adjacency-indexed service call graph
+    
+    Edges are indexed both ways, so blast radius in either direction and the
+    latency-weighted critical path are O(V+E) traversals. Cycles are tolerated:
+    the critical path ignores back edges.
+    """
+    
+    def __init__(self):
+        self.downstream: Dict[str, Dict[str, DependencyEdge]] = {}
+        self.upstream: Dict[str, Dict[str, DependencyEdge]] = {}
+    
+    @classmethod
+    def from_totals(cls, totals: Dict[Tuple[str, str], Dict[str, float]]) -> "DependencyGraph":
+        """Build from DEPENDENCY_AGGREGATES totals keyed by (source, target)
+        
+        Missing or null aggregates, as a direct query returns for edges
+        without span durations, count as zero.
+        """
+        graph = cls()
+        for (source, target), values in totals.items():
+            if source is None or target is None or source == target:
+                continue
+            values = {name: values.get(name) or 0 for name in DEPENDENCY_AGGREGATES}
+            latency = LatencyHistogram.from_cumulative(
+                [values[f"le_{bound}ms"] for bound in LATENCY_BUCKETS_MS],
+                values["call_count"], values["duration_sum"] / 1000, values["max_duration"] / 1000
+            )
+            graph.add_edge(DependencyEdge(source, target, int(values["call_count"]), latency))
+        return graph
+    
+    def add_edge(self, edge: DependencyEdge):
+        self.downstream.setdefault(edge.source, {})[edge.target] = edge
+        self.upstream.setdefault(edge.target, {})[edge.source] = edge
+        self.downstream.setdefault(edge.target, {})
+        self.upstream.setdefault(edge.source, {})
+    
+    @property
+    def services(self) -> List[str]:
+        return list(self.downstream)
+    
+    def edges(self) -> Iterator[DependencyEdge]:
+        for targets in self.downstream.values():
+            yield from targets.values()
+    
+    def blast_radius(self, service: str, direction: str = "downstream") -> List[Dict[str, Any]]:
+        """Services reachable from service, with their hop distance, nearest first"""
+        adjacency = self.downstream if direction == "downstream" else self.upstream
+        depths = {service: 0}
+        frontier = [service]
+        while frontier:
+            next_frontier = []
+            for current in frontier:
+                for neighbor in adjacency.get(current, ()):
+                    if neighbor not in depths:
+                        depths[neighbor] = depths[current] + 1
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+        del depths[service]
+        return [{"service": name, "depth": depth} for name, depth in depths.items()]
+    
+    def critical_path(self, start: Optional[str] = None) -> Dict[str, Any]:
+        """Call chain with the highest summed average edge latency"""
+        roots = [start] if start is not None else self.services
+        cost: Dict[str, float] = {}
+        best_next: Dict[str, Optional[str]] = {}
+        in_progress = set()
+        for root in roots:
+            if root in cost or root not in self.downstream:
+                continue
+            # Iterative post-order DFS; edges back to an unfinished node are skipped
+            stack = [(root, iter(self.downstream[root]))]
+            in_progress.add(root)
+            while stack:
+                node, children = stack[-1]
+                child = next(children, None)
+                if child is not None:
+                    if child not in cost and child not in in_progress:
+                        in_progress.add(child)
+                        stack.append((child, iter(self.downstream[child])))
+                    continue
+                stack.pop()
+                in_progress.discard(node)
+                cost[node], best_next[node] = 0.0, None
+                for target, edge in self.downstream[node].items():
+                    if target in cost and edge.avg_ms + cost[target] > cost[node]:
+                        cost[node], best_next[node] = edge.avg_ms + cost[target], target
+        
+        candidates = [root for root in roots if root in cost]
+        if not candidates:
+            return {"services": [], "latency_ms": 0.0}
+        node = max(candidates, key=cost.__getitem__)
+        path = [node]
+        while best_next[node] is not None:
+            node = best_next[node]
+            path.append(node)
+        return {"services": path, "latency_ms": round(cost[path[0]], 3)}
+    
+    def bottlenecks(
+        self,
+        top: int = 10,
+        critical_path: Optional[List[str]] = None,
+        services: Optional[set] = None,
+    ) -> List[Dict[str, Any]]:
+        """Edges ranked by total time spent in them"""
+        on_path = set(zip(critical_path, critical_path[1:])) if critical_path else set()
+        edges = [edge for edge in self.edges() if services is None or edge.source in services]
+        edges.sort(key=lambda edge: edge.latency.total_ms, reverse=True)
+        return [{
+            "source": edge.source,
+            "target": edge.target,
+            "call_count": edge.call_count,
+            "total_time_ms": round(edge.latency.total_ms, 3),
+            "avg_latency_ms": round(edge.avg_ms, 3),
+            "p95_latency_ms": edge.latency.quantile(0.95),
+            "on_critical_path": (edge.source, edge.target) in on_path
+        } for edge in edges[:top]]
+
+# Placeholder for a variable token in a log template
+LOG_WILDCARD = "<*>"
+
+class LogTemplate:
+    """One mined log template with its count and a few parameter samples"""
+    
+    __slots__ = ("id", "key", "service", "tokens", "count", "samples", "example")
+    
+    def __init__(self, template_id: int, key: Tuple[Any, ...], service: Optional[str], tokens: List[str], example: str):
+        self.id = template_id
+        self.key = key
+        self.service = service
+        self.tokens = tokens
+        self.count = 0
+        self.samples: List[List[str]] = []
+        self.example = example
+    
+    @property
+    def text(self) -> str:
+        return " ".join(self.tokens)
+
+class LogTemplateMiner:
+    """Streaming log template miner in the style of Drain
+    
+    Tokens containing digits are masked as parameters. Messages are routed by
+    service, token count and their first ``prefix_depth`` tokens to a short
+    list of candidate templates. A message joins the most similar candidate
+    at or above ``similarity``, which then generalizes differing tokens to
+    wildcards; otherwise it starts a new template. At most ``max_templates``
+    are kept, evicting the least recently matched.
+    """
+    
+    def __init__(
+        self,
+        max_templates: int = 1000,
+        similarity: float = 0.5,
+        prefix_depth: int = 2,
+        max_tokens: int = 64,
+        max_samples: int = 3,
+    ):
+        self.max_templates = max(1, max_templates)
+        self.similarity = similarity
+        self.prefix_depth = prefix_depth
+        self.max_tokens = max_tokens
+        self.max_samples = max_samples
+        self.templates: "OrderedDict[int, LogTemplate]" = OrderedDict()
+        self.leaves: Dict[Tuple[Any, ...], List[int]] = {}
+        self.next_id = 0
+        self.messages = 0
+        self.evicted = 0
+    
+    def add(self, service: Optional[str], message: Optional[str]) -> LogTemplate:
+        """Fold one message into its template and return it"""
+        self.messages += 1
+        # Only the first line matters for stack traces; long lines are capped
+        raw = (message or "").split("\n", 1)[0].split()[:self.max_tokens]
+        masked = [LOG_WILDCARD if any(ch.isdigit() for ch in token) else token for token in raw]
+        key = (service, len(masked), *masked[:self.prefix_depth])
+        
+        leaf = self.leaves.setdefault(key, [])
+        best, best_score = None, -1.0
+        for template_id in leaf:
+            candidate = self.templates[template_id]
+            matches = sum(1 for a, b in zip(candidate.tokens, masked) if a == b)
+            score = matches / len(masked) if masked else 1.0
+            if score > best_score:
+                best, best_score = candidate, score
+        
+        if best is None or best_score < self.similarity:
+            best = LogTemplate(self.next_id, key, service, masked, " ".join(raw)[:500])
+            self.next_id += 1
+            self.templates[best.id] = best
+            leaf.append(best.id)
+            if len(self.templates) > self.max_templates:
+                self._evict()
+        else:
+            best.tokens = [a if a == b else LOG_WILDCARD for a, b in zip(best.tokens, masked)]
+            self.templates.move_to_end(best.id)
+        
+        best.count += 1
+        if len(best.samples) < self.max_samples:
+            parameters = [token for token, slot in zip(raw, best.tokens) if slot == LOG_WILDCARD]
+            if parameters and parameters not in best.samples:
+                best.samples.append(parameters)
+        return best
+    
+    def _evict(self):
+        _, template = self.templates.popitem(last=False)
+        leaf = self.leaves[template.key]
+        leaf.remove(template.id)
+        if not leaf:
+            del self.leaves[template.key]
+        self.evicted += 1
+    
+    def top(self, n: int) -> List[LogTemplate]:
+        return sorted(self.templates.values(), key=lambda template: template.count, reverse=True)[:n]
+
+# Bucket widths and sampling probabilities the router picks from
+BUCKET_MINUTES = (1, 5, 15, 60, 240, 1440)
+SAMPLE_RATES = (1.0, 0.5, 0.25, 0.1, 0.05, 0.025, 0.01, 0.005, 0.0025, 0.001)
+
+ESQL_INDEX_PATTERN = re.compile(r"[A-Za-z0-9_.*:,-]+")
+
+class ResolutionRouter:
+    """Choose the data resolution for a window so wide windows cost about as much as narrow ones
+    
+    Incremental series get coarser buckets once a window would need more than
+    ``max_buckets`` of them. Direct trace scans are sampled with ES|QL
+    ``SAMPLE`` so roughly ``sample_base_window`` seconds worth of documents are
+    read. Metrics switch to a downsampled data stream when one is configured
+    for the window and exists in the cluster.
+    """
+    
+    def __init__(
+        self,
+        max_buckets: int = 1440,
+        sample_base_window: int = 3600,
+        sample_min_rate: float = 0.01,
+        downsampled_metrics: Optional[Dict[str, str]] = None,
+        exists: Optional[Callable[[str], Awaitable[bool]]] = None,
+        probe_ttl: float = 300.0,
+    ):
+        self.max_buckets = max(1, max_buckets)
+        self.sample_base_window = sample_base_window
+        self.sample_min_rate = min(max(sample_min_rate, 0.0), 1.0)
+        # Minimum window in seconds -> downsampled index pattern, widest first
+        self.downsampled_metrics = sorted(
+            ((parse_time_range(window), pattern) for window, pattern in (downsampled_metrics or {}).items()
+             if parse_time_range(window) and ESQL_INDEX_PATTERN.fullmatch(pattern)),
+            reverse=True
+        )
+        self.exists = exists
+        self.probe_ttl = probe_ttl
+        self._probes: Dict[str, Tuple[bool, float]] = {}
+        # Cleared once the cluster rejects SAMPLE and an unsampled retry succeeds
+        self.sampling = True
+    
+    def bucket_minutes(self, minutes: int) -> int:
+        """Finest bucket that keeps a window within max_buckets"""
+        for size in BUCKET_MINUTES:
+            if math.ceil(minutes / size) <= self.max_buckets:
+                return size
+        return BUCKET_MINUTES[-1]
+    
+    def max_minutes(self) -> int:
+        return self.max_buckets * BUCKET_MINUTES[-1]
+    
+    def sample_rate(self, window_seconds: Optional[int]) -> float:
+        """Sampling probability for a raw trace scan over the window"""
+        if not self.sampling or not self.sample_base_window or not window_seconds or window_seconds <= self.sample_base_window:
+            return 1.0
+        target = max(self.sample_min_rate, self.sample_base_window / window_seconds)
+        # Snap to a fixed ladder so query texts stay stable
+        rate = next((rate for rate in SAMPLE_RATES if rate <= target), SAMPLE_RATES[-1])
+        return max(rate, self.sample_min_rate)
+    
+    async def metrics_source(self, window_seconds: Optional[int]) -> Optional[str]:
+        """Downsampled metrics pattern for the window, or None for raw metrics"""
+        for min_window, pattern in self.downsampled_metrics:
+            if window_seconds and window_seconds >= min_window and await self._pattern_exists(pattern):
+                return pattern
+        return None
+    
+    @staticmethod
+    def sampling_rejected(results: Sequence[Dict[str, Any]]) -> bool:
+        """Whether a sampled query failed the way clusters without SAMPLE fail it"""
+        return any(result.get("error_type") in SAMPLE_UNSUPPORTED_ERRORS for result in results)
+    
+    async def _pattern_exists(self, pattern: str) -> bool:
+        if self.exists is None:
+            return True
+        probe = self._probes.get(pattern)
+        now = time.monotonic()
+        if probe is None or now - probe[1] > self.probe_ttl:
+            probe = (await self.exists(pattern), now)
+            self._probes[pattern] = probe
+        return probe[0]
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_buckets": self.max_buckets,
+            "sample_base_window_seconds": self.sample_base_window,
+            "sample_min_rate": self.sample_min_rate,
+            "sampling": self.sampling,
+            "downsampled_metrics": {pattern: self._probes.get(pattern, (None,))[0] for _, pattern in self.downsampled_metrics}
+        }
+
+STATUS_LEVELS = ("normal", "elevated", "anomalous")
+
+class BaselineAnomalyEngine:
+    """Fleet-wide baselines, z-scores and change points with NumPy
+    
+    One bucketed series per entity (service or host) is laid out as an
+    entities x buckets matrix. Buckets older than the evaluated window form each
+    entity's baseline; the window itself is scored against it. A mean-shift
+    statistic over every split point finds the strongest change point. All of
+    it is array arithmetic, so cost grows with the matrix, not with Python
+    loops over rows.
+    """
+    
+    def __init__(
+        self,
+        baseline_window: int = 86400,
+        target_buckets: int = 96,
+        max_rows: int = 10000,
+        z_warning: float = 2.0,
+        z_critical: float = 3.0,
+        change_threshold: float = 4.0,
+    ):
+        # numpy itself is imported on the first scoring pass, not at startup
+        if not module_available("numpy"):
+            raise ImportError("numpy")
+        self._np = None
+        self.baseline_window = baseline_window
+        self.target_buckets = max(8, target_buckets)
+        self.max_rows = max(1, max_rows)
+        self.z_warning = z_warning
+        self.z_critical = z_critical
+        self.change_threshold = change_threshold
+        self.min_baseline_buckets = 4
+        # Entities seen per series, used to keep buckets x entities under max_rows
+        self.entity_counts: Dict[str, int] = {}
+    
+    @property
+    def np(self):
+        if self._np is None:
+            self._np = importlib.import_module("numpy")
+        return self._np
+    
+    def plan(self, kind: str, window_seconds: int) -> Tuple[int, int]:
+        """Lookback seconds and bucket minutes for a series covering the window"""
+        lookback = max(self.baseline_window, 4 * window_seconds)
+        buckets = min(self.target_buckets, max(8, self.max_rows // max(1, self.entity_counts.get(kind, 1))))
+        minutes = math.ceil(lookback / 60)
+        bucket = next((size for size in BUCKET_MINUTES if math.ceil(minutes / size) <= buckets), BUCKET_MINUTES[-1])
+        return lookback, bucket
+    
+    def analyze(
+        self,
+        kind: str,
+        columns: EsqlColumns,
+        group_field: str,
+        value_field: str,
+        recent_from: int,
+        weight_field: Optional[str] = None,
+        std_floor: float = 0.01,
+    ) -> Dict[str, Dict[str, Any]]:
+        """Score each entity's recent value against its own baseline
+        
+        ``recent_from`` is the first bucket (minute index) of the evaluated window. With a
+        ``weight_field`` the value is a ratio, ``value_field / weight_field``,
+        whose recent level is weighted by the denominator.
+        """
+        np = self.np
+        if not len(columns):
+            return {}
+        
+        entities, rows = self.factorize(columns.column(group_field))
+        bucket_keys, cols = self.factorize(columns.column("bucket"))
+        bucket_minutes = np.array([SlidingWindowAggregator.bucket_minute(key) for key in bucket_keys])
+        order = np.argsort(bucket_minutes)
+        position = np.empty_like(order)
+        position[order] = np.arange(len(order))
+        cols = position[cols]
+        bucket_minutes = bucket_minutes[order]
+        self.entity_counts[kind] = len(entities)
+        
+        shape = (len(entities), len(bucket_minutes))
+        numerator = np.full(shape, np.nan)
+        numerator[rows, cols] = np.asarray(columns.column(value_field), dtype=float)
+        if weight_field is not None:
+            denominator = np.full(shape, np.nan)
+            denominator[rows, cols] = np.asarray(columns.column(weight_field), dtype=float)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                series = np.where(denominator > 0, numerator / denominator, np.nan)
+        else:
+            denominator = None
+            series = numerator
+        
+        recent = bucket_minutes >= recent_from
+        if not recent.any():
+            recent[-1] = True
+        baseline = series[:, ~recent]
+        
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if denominator is not None:
+                current = np.nansum(numerator[:, recent], axis=1) / np.nansum(denominator[:, recent], axis=1)
+            else:
+                current = np.nansum(series[:, recent], axis=1) / np.sum(~np.isnan(series[:, recent]), axis=1)
+            baseline_count = np.sum(~np.isnan(baseline), axis=1)
+            mean = np.where(baseline_count > 0, np.nansum(baseline, axis=1) / np.maximum(baseline_count, 1), np.nan)
+            variance = np.nansum((baseline - mean[:, None]) ** 2, axis=1) / np.maximum(baseline_count, 1)
+            std = np.maximum(np.sqrt(variance), std_floor)
+            z = (current - mean) / std
+        
+        change_at, change_score = self.change_points(series, std)
+        
+        level = np.where(z >= self.z_critical, 2, np.where(z >= self.z_warning, 1, 0))
+        level = np.where(np.isnan(z), 0, level)
+        
+        def values(array: Any) -> List[Optional[float]]:
+            rounded = np.round(array, 6)
+            return np.where(np.isnan(rounded), None, rounded).tolist()
+        
+        levels = np.where(baseline_count >= self.min_baseline_buckets, level, -1).tolist()
+        columns_out = zip(
+            entities, values(current), values(mean), values(std), baseline_count.tolist(), values(z), levels
+        )
+        changed = set(np.flatnonzero(change_score >= self.change_threshold).tolist())
+        
+        result = {}
+        for i, (entity, current_value, mean_value, std_value, buckets, z_value, level_index) in enumerate(columns_out):
+            change = None
+            if i in changed:
+                change = {
+                    "at": datetime.fromtimestamp(int(bucket_minutes[change_at[i]]) * 60, timezone.utc).isoformat(),
+                    "score": round(float(change_score[i]), 2)
+                }
+            result[entity] = {
+                "current": current_value,
+                "baseline_mean": mean_value,
+                "baseline_std": std_value,
+                "baseline_buckets": buckets,
+                "z_score": z_value,
+                # Too little history to judge: callers keep their fixed thresholds
+                "level": STATUS_LEVELS[level_index] if level_index >= 0 else None,
+                "change_point": change
+            }
+        return result
+    
+    def factorize(self, values: Sequence[Any]) -> Tuple[List[Any], Any]:
+        """Distinct values in first-seen order and each row's index into them"""
+        codes = {value: code for code, value in enumerate(dict.fromkeys(values))}
+        return list(codes), self.np.fromiter(map(codes.__getitem__, values), dtype=self.np.intp, count=len(values))
+    
+    def change_points(self, series: Any, std: Any) -> Tuple[Any, Any]:
+        """Most likely mean-shift split per row and its standardized score"""
+        np = self.np
+        valid = ~np.isnan(series)
+        values = np.where(valid, series, 0.0)
+        counts = np.cumsum(valid, axis=1)
+        sums = np.cumsum(values, axis=1)
+        total_count = counts[:, -1:]
+        total_sum = sums[:, -1:]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            before = sums / counts
+            after = (total_sum - sums) / (total_count - counts)
+            score = np.abs(after - before) / std[:, None] * np.sqrt(counts * (total_count - counts) / total_count)
+        score = np.where((counts > 0) & (total_count - counts > 0), score, 0.0)
+        score = np.nan_to_num(score)
+        split = np.argmax(score, axis=1)
+        # The change starts in the bucket after the split
+        return np.minimum(split + 1, series.shape[1] - 1), score[np.arange(series.shape[0]), split]
+
+# Arguments accepted by every tool on top of its own schema
+COMMON_TOOL_PROPERTIES = {
+    "no_cache": {
+        "type": "boolean",
+        "description": "Bypass the result cache and query Elastic directly",
+        "default": False
+    },
+    "compact": {
+        "type": "boolean",
+        "description": "Return compact JSON without indentation"
+    },
+    "top_k": {
+        "type": "integer",
+        "minimum": 1,
+        "description": "Keep only the N worst entries of large collections (hosts, dependencies, errors)"
+    },
+    "max_bytes": {
+        "type": "integer",
+        "minimum": 1,
+        "description": "Cut large collections until the serialized result fits in this many bytes"
+    },
+    "cursor": {
+        "type": "string",
+        "description": "Continuation cursor from a previous truncated result"
+    }
+}
+
+# Arguments each tool falls back to, so equivalent calls share a prefetch slot
+TOOL_ARGUMENT_DEFAULTS = {
+    "get_application_health": {"time_range": "15m"},
+    "get_service_metrics": {"time_range": "15m"},
+    "get_error_analysis": {"time_range": "15m", "severity": "ERROR"},
+    "get_performance_issues": {"time_range": "15m", "threshold_ms": 1000},
+    "get_resource_utilization": {"time_range": "15m", "resource_type": "cpu"},
+    "get_trace_analysis": {"time_range": "15m"},
+    "get_code_recommendations": {"time_range": "15m"},
+    "get_incident_triage": {"time_range": "15m", "threshold_ms": 1000},
+}
+
+DEFAULT_PREFETCH_TARGETS = [
+    {"tool": "get_application_health", "arguments": {"time_range": "15m"}},
+    {"tool": "get_application_health", "arguments": {"time_range": "1h"}},
+    {"tool": "get_error_analysis", "arguments": {"time_range": "15m", "severity": "ERROR"}},
+    {"tool": "get_resource_utilization", "arguments": {"time_range": "15m", "resource_type": "cpu"}},
+    {"tool": "get_resource_utilization", "arguments": {"time_range": "15m", "resource_type": "memory"}},
+]
+
+def parse_prefetch_targets(value: Optional[str]) -> List[Dict[str, Any]]:
+    """Read prefetch targets from a JSON list of {"tool", "arguments"} objects"""
+    if not value:
+        return DEFAULT_PREFETCH_TARGETS
+    targets = json.loads(value)
+    return [{"tool": target["tool"], "arguments": target.get("arguments") or {}} for target in targets]
+
+class PrefetchScheduler:
+    """Refresh common tool calls in the background and answer them from memory
+    
+    Each target is refreshed on a jittered interval. Refreshes run one at a
+    time and wait while interactive queries fill the adaptive limiter, so
+    Elastic sees a flat trickle of queries instead of bursts.
+    """
+    
+    def __init__(
+        self,
+        refresh: Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        limiter: AdaptiveConcurrencyLimiter,
+        targets: Sequence[Dict[str, Any]],
+        interval: float = 60.0,
+        jitter: float = 0.1,
+        max_age: Optional[float] = None,
+    ):
+        self.refresh = refresh
+        self.limiter = limiter
+        self.targets = [(target["tool"], dict(target["arguments"])) for target in targets]
+        self.interval = max(1.0, interval)
+        self.jitter = min(max(jitter, 0.0), 1.0)
+        self.max_age = max_age if max_age is not None else 3 * self.interval
+        self.results: Dict[str, Tuple[Dict[str, Any], float, float]] = {}
+        self.hits = 0
+        self.refreshes = 0
+        self.failures = 0
+        self._tasks: List[asyncio.Task] = []
+        self._refresh_slot = asyncio.Semaphore(1)
+    
+    @staticmethod
+    def make_key(name: str, arguments: Dict[str, Any]) -> str:
+        """Canonical key for a tool call, ignoring output-shaping arguments"""
+        normalized = dict(TOOL_ARGUMENT_DEFAULTS.get(name, {}))
+        normalized.update({k: v for k, v in arguments.items() if k not in COMMON_TOOL_PROPERTIES})
+        if "time_range" in normalized:
+            with contextlib.suppress(ValueError):
+                normalized["time_range"] = esql_interval(normalized["time_range"])
+        return f"{name}:{json.dumps(normalized, sort_keys=True, default=str)}"
+    
+    def get(self, name: str, arguments: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Prefetched result with a freshness marker, or None if missing or too old"""
+        entry = self.results.get(self.make_key(name, arguments))
+        if entry is None:
+            return None
+        result, refreshed_at, monotonic_at = entry
+        age = time.monotonic() - monotonic_at
+        if age > self.max_age:
+            return None
+        self.hits += 1
+        answer = dict(result)
+        answer["freshness"] = {
+            "source": "prefetch",
+            "refreshed_at": datetime.fromtimestamp(refreshed_at, timezone.utc).isoformat(),
+            "age_seconds": round(age, 3)
+        }
+        return answer
+    
+    def start(self):
+        """Start one refresh loop per target (idempotent, needs a running loop)"""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._run(name, arguments), name=f"prefetch {name}")
+            for name, arguments in self.targets
+        ]
+    
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    async def _run(self, name: str, arguments: Dict[str, Any]):
+        while True:
+            await self.refresh_once(name, arguments)
+            await asyncio.sleep(self.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+    
+    async def refresh_once(self, name: str, arguments: Dict[str, Any]):
+        """Refresh one target, keeping the previous result if the refresh fails"""
+        async with self._refresh_slot:
+            # Interactive calls have priority over the outgoing concurrency budget
+            while self.limiter.in_flight >= int(self.limiter.limit):
+                await asyncio.sleep(0.05)
+            try:
+                result = await self.refresh(name, arguments)
+            except Exception as e:
+                logger.warning(f"Prefetch of {name} failed: {e}")
+                result = {"error": str(e)}
+        
+        if isinstance(result, dict) and "error" in result:
+            self.failures += 1
+            return
+        self.refreshes += 1
+        self.results[self.make_key(name, arguments)] = (result, time.time(), time.monotonic())
+    
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "targets": len(self.targets),
+            "interval_seconds": self.interval,
+            "jitter": self.jitter,
+            "max_age_seconds": self.max_age,
+            "running": bool(self._tasks),
+            "hits": self.hits,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "ages_seconds": {key: round(now - entry[2], 3) for key, entry in self.results.items()}
+        }
+
 class ElasticOTELMCPServer:
-    def __init__(self, elastic_endpoint: str, api_key: str):
+    def __init__(
+        self,
+        elastic_endpoint: str,
+        api_key: str,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        max_subquery_concurrency: int = 4,
+        cache_size: int = 256,
+        cache_ttl: float = 30.0,
+        incremental: bool = False,
+        incremental_max_minutes: int = 1440,
+        incremental_settle_minutes: int = 2,
+        quantile_sketches: bool = True,
+        sketch_accuracy: float = 0.05,
+        sketch_max_buckets: int = 24,
+        result_format: str = "json",
+        compact_json: bool = False,
+        json_backend: str = "auto",
+        result_top_k: Optional[int] = None,
+        result_max_bytes: Optional[int] = None,
+        result_max_entries: Optional[int] = 1000,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        otlp_endpoint: Optional[str] = None,
+        max_retries: int = 3,
+        retry_base_delay: float = 0.2,
+        retry_max_delay: float = 10.0,
+        adaptive_limit_initial: int = 8,
+        adaptive_limit_min: int = 1,
+        adaptive_limit_max: int = 64,
+        breaker_failure_threshold: int = 5,
+        breaker_reset_timeout: float = 30.0,
+        serve_stale: bool = True,
+        stale_max_age: float = 600.0,
+        async_threshold: int = 86400,
+        async_wait: float = 2.0,
+        async_keep_alive: str = "5m",
+        async_max_duration: float = 600.0,
+        anomaly_detection: bool = False,
+        baseline_window: int = 86400,
+        baseline_buckets: int = 96,
+        baseline_max_rows: int = 10000,
+        zscore_warning: float = 2.0,
+        zscore_critical: float = 3.0,
+        resolution_routing: bool = False,
+        sample_base_window: int = 3600,
+        sample_min_rate: float = 0.01,
+        downsampled_metrics: Optional[Dict[str, str]] = None,
+        prefetch: bool = False,
+        prefetch_targets: Optional[Sequence[Dict[str, Any]]] = None,
+        prefetch_interval: float = 60.0,
+        prefetch_jitter: float = 0.1,
+        prefetch_max_age: Optional[float] = None,
+        log_templates: bool = False,
+        log_sample_size: int = 5000,
+        log_page_size: int = 1000,
+        log_max_templates: int = 1000,
+        log_similarity: float = 0.5,
+        store_path: Optional[str] = None,
+        store_ttl: float = 300.0,
+        store_max_bytes: int = 64 * 1024 * 1024,
+        endpoints: Optional[Sequence[Dict[str, Any]]] = None,
+        federation_timeout: float = 10.0,
+        warmup: bool = False,
+    ):
         self.elastic_endpoint = elastic_endpoint
         self.api_key = api_key
         self.server = Server("elastic-otel-mcp")
         
+        # Shared HTTP client settings (the client itself is created lazily)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.http2 = http2
+        
+        # Optional eager connect while the MCP client is still initializing
+        self.warmup = warmup
+        self.warmup_ms: Optional[float] = None
+        self._warmup_task: Optional[asyncio.Task] = None
+        # Optional transport override, e.g. httpx.MockTransport for offline benchmarks
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        
+        # Per-tool cap on concurrently running sub-queries
+        self.max_subquery_concurrency = max_subquery_concurrency
+        
+        # Optional on-disk store shared by restarts and sibling processes
+        self.store: Optional[PersistentStore] = (
+            PersistentStore(store_path, store_ttl, store_max_bytes) if store_path else None
+        )
+        
+        # Result cache in front of execute_esql_query (disabled when size or TTL is 0)
+        self.cache: Optional[QueryResultCache] = (
+            QueryResultCache(cache_size, cache_ttl, self.store) if cache_size > 0 and cache_ttl > 0 else None
+        )
+        
+        # Incremental sliding-window aggregation
+        self.incremental = incremental
+        self.incremental_max_minutes = incremental_max_minutes
+        self.incremental_settle_minutes = incremental_settle_minutes
+        self.incremental_series: "OrderedDict[str, SlidingWindowAggregator]" = OrderedDict()
+        
+        # Latency percentiles merged from per-bucket quantile sketches
+        self.quantile_sketches = quantile_sketches
+        self.sketch_accuracy = sketch_accuracy
+        self.sketch_max_buckets = max(1, sketch_max_buckets)
+        
+        # Response format requested from ES|QL (json, columnar or arrow)
+        if result_format not in RESULT_FORMATS:
+            raise ValueError(f"Unknown result format: {result_format}")
+        if result_format == "arrow" and not module_available("pyarrow"):
+            logger.warning("ELASTIC_RESULT_FORMAT=arrow requires the 'pyarrow' package; using columnar JSON")
+            result_format = "columnar"
+        self.result_format = result_format
+        
+        # Tool result serialization and default size budget
+        self.serializer = ResultSerializer(compact_json, json_backend)
+        self.result_top_k = result_top_k
+        self.result_max_bytes = result_max_bytes
+        self.result_max_entries = result_max_entries
+        
+        # Self-instrumentation, optionally exported over OTLP
+        exporter = None
+        if otlp_endpoint:
+            try:
+                exporter = OTLPExporter(otlp_endpoint)
+            except ImportError:
+                logger.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but the OpenTelemetry SDK/OTLP exporter is not installed")
+        self.stats = ServerStats(exporter)
+        
+        # Protection for an overloaded cluster: adaptive concurrency, retries, circuit breaker
+        self.limiter = AdaptiveConcurrencyLimiter(
+            adaptive_limit_initial,
+            adaptive_limit_min,
+            min(adaptive_limit_max, max_connections)
+        )
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.retries = 0
+        self.breaker = CircuitBreaker(breaker_failure_threshold, breaker_reset_timeout)
+        
+        # Federated projects, each queried concurrently with its own pool and breaker
+        self.endpoints = [
+            ElasticEndpoint(
+                endpoint["name"],
+                endpoint["endpoint"],
+                endpoint["api_key"],
+                endpoint.get("timeout") or federation_timeout,
+                CircuitBreaker(breaker_failure_threshold, breaker_reset_timeout)
+            )
+            for endpoint in endpoints or []
+        ]
+        self.mergers: Dict[str, EsqlResultMerger] = {}
+        self.serve_stale = serve_stale
+        self.stale_max_age = stale_max_age
+        
+        # Long windows run through the async ES|QL API and are polled
+        self.async_threshold = async_threshold
+        self.async_wait = async_wait
+        self.async_keep_alive = async_keep_alive
+        self.async_max_duration = async_max_duration
+        self.async_queries = 0
+        
+        # Health classified against each entity's own baseline
+        self.anomaly_engine = None
+        if anomaly_detection:
+            try:
+                self.anomaly_engine = BaselineAnomalyEngine(
+                    baseline_window, baseline_buckets, baseline_max_rows, zscore_warning, zscore_critical
+                )
+            except ImportError:
+                logger.warning("ELASTIC_ANOMALY_DETECTION requires the 'numpy' package; using fixed thresholds")
+        
+        # Coarser buckets, sampling and downsampled streams for wide windows
+        self.router = ResolutionRouter(
+            incremental_max_minutes,
+            sample_base_window,
+            sample_min_rate,
+            downsampled_metrics,
+            self._index_pattern_exists
+        ) if resolution_routing else None
+        
+        # Background refresh of the most common tool calls
+        self.prefetcher = PrefetchScheduler(
+            self._prefetch_tool,
+            self.limiter,
+            prefetch_targets if prefetch_targets is not None else DEFAULT_PREFETCH_TARGETS,
+            prefetch_interval,
+            prefetch_jitter,
+            prefetch_max_age
+        ) if prefetch else None
+        
+        # Error logs mined into message templates from paginated samples
+        self.log_templates = log_templates
+        self.log_sample_size = max(1, log_sample_size)
+        self.log_page_size = max(1, log_page_size)
+        self.log_max_templates = log_max_templates
+        self.log_similarity = log_similarity
+        
         # Elastic data views
         self.data_views = {
             'metrics': 'metrics-*',
@@ -45,210 +2996,970 @@ class ElasticOTELMCPServer:
     def setup_tools(self):
         """Setup MCP tools for Elastic OTEL data"""
         
+        # Built once: tool name -> handler taking the call's arguments
+        self.tool_handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+            "get_application_health": lambda arguments: self.get_application_health(
+                arguments.get("time_range", "15m")
+            ),
+            "get_service_metrics": lambda arguments: self.get_service_metrics(
+                arguments["service_name"],
+                arguments.get("time_range", "15m")
+            ),
+            "get_error_analysis": lambda arguments: self.get_error_analysis(
+                arguments.get("time_range", "15m"),
+                arguments.get("severity", "ERROR")
+            ),
+            "get_performance_issues": lambda arguments: self.get_performance_issues(
+                arguments.get("time_range", "15m"),
+                arguments.get("threshold_ms", 1000)
+            ),
+            "get_resource_utilization": lambda arguments: self.get_resource_utilization(
+                arguments.get("time_range", "15m"),
+                arguments.get("resource_type", "cpu")
+            ),
+            "get_trace_analysis": lambda arguments: self.get_trace_analysis(
+                arguments.get("time_range", "15m"),
+                arguments.get("service_name")
+            ),
+            "get_code_recommendations": lambda arguments: self.get_code_recommendations(
+                arguments["analysis_type"],
+                arguments.get("time_range", "15m")
+            ),
+            "get_incident_triage": lambda arguments: self.get_incident_triage(
+                arguments.get("time_range", "15m"),
+                arguments.get("service_name"),
+                arguments.get("threshold_ms", 1000)
+            ),
+            "get_server_stats": lambda arguments: self.get_server_stats(),
+        }
+        self._tool_catalog: Optional[ListToolsResult] = None
+        self.tool_validators: Dict[str, Any] = {}
+        
         @self.server.list_tools()
         async def list_tools() -> ListToolsResult:
             """List available tools for Elastic OTEL data"""
-            return ListToolsResult(
-                tools=[
-                    Tool(
-                        name="get_application_health",
-                        description="Get overall application health status from OTEL data",
-                        inputSchema={
-                            "type": "object",
-                            "properties": {
-                                "time_range": {
-                                    "type": "string",
-                                    "description": "Time range for analysis (e.g., '15m', '1h', '1d')",
-                                    "default": "15m"
-                                }
-                            }
+            return self.tool_catalog()
+        
+        try:
+            register_call_tool = self.server.call_tool(validate_input=False)
+        except TypeError:
+            # Older mcp releases do not validate arguments themselves
+            register_call_tool = self.server.call_tool()
+        
+        @register_call_tool
+        async def call_tool(name: str, arguments: Dict[str, Any]) -> CallToolResult:
+            """Handle tool calls for Elastic OTEL data"""
+            bypass_token = bypass_cache.set(bool(arguments.get("no_cache", False)))
+            budget = self.entry_budget(arguments)
+            budget_token = result_budget.set(budget)
+            started = time.perf_counter()
+            text = ""
+            error = True
+            try:
+                problem = self.validate_arguments(name, arguments)
+                if problem is not None:
+                    text = f"Input validation error: {problem}"
+                    return CallToolResult(content=[{"type": "text", "text": text}], isError=True)
+                
+                with self.stats.span(f"tools/call {name}", tool=name):
+                    result = None
+                    # Prefetched results only hold the default number of ranked entries
+                    deeper = budget is not None and self.result_max_entries and budget > self.result_max_entries
+                    if self.prefetcher is not None and not bypass_cache.get() and not deeper:
+                        result = self.prefetcher.get(name, arguments)
+                    if result is None:
+                        result = await self.dispatch_tool(name, arguments)
+                
+                text = self.serializer.render(
+                    result,
+                    compact=arguments.get("compact"),
+                    top_k=arguments.get("top_k", self.result_top_k),
+                    max_bytes=arguments.get("max_bytes", self.result_max_bytes),
+                    cursor=arguments.get("cursor")
+                )
+                error = isinstance(result, dict) and "error" in result
+                return CallToolResult(content=[{"type": "text", "text": text}])
+                
+            except Exception as e:
+                logger.error(f"Error calling tool {name}: {e}")
+                text = f"Error: {str(e)}"
+                return CallToolResult(content=[{"type": "text", "text": text}], isError=True)
+            finally:
+                self.stats.record_tool(name, (time.perf_counter() - started) * 1000, len(text.encode()), error)
+                result_budget.reset(budget_token)
+                bypass_cache.reset(bypass_token)
+    
+    def entry_budget(self, arguments: Dict[str, Any]) -> Optional[int]:
+        """Ranked entries a call's top_k/cursor page needs, or None for the server default"""
+        top_k = arguments.get("top_k", self.result_top_k)
+        offset = 0
+        if arguments.get("cursor"):
+            with contextlib.suppress(ValueError):
+                offset, cursor_top_k = ResultSerializer.decode_cursor(arguments["cursor"])
+                top_k = top_k or cursor_top_k
+        return offset + top_k if top_k else None
+    
+    def entry_limit(self) -> Optional[int]:
+        """Entries each ranked collection keeps in the current tool call"""
+        return result_budget.get() or self.result_max_entries
+    
+    def tool_catalog(self) -> ListToolsResult:
+        """Tool definitions and their argument validators, built once and reused by every list_tools"""
+        if self._tool_catalog is not None:
+            return self._tool_catalog
+        
+        tools = [
+            Tool(
+                name="get_application_health",
+                description="Get overall application health status from OTEL data",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "time_range": {
+                            "type": "string",
+                            "description": "Time range for analysis (e.g., '15m', '1h', '1d')",
+                            "default": "15m"
                         }
-                    ),
-                    Tool(
-                        name="get_service_metrics",
-                        description="Get metrics for specific services (CPU, memory, response time, error rate)",
-                        inputSchema={
-                            "type": "object",
-                            "properties": {
-                                "service_name": {
-                                    "type": "string",
-                                    "description": "Name of the service to analyze"
-                                },
-                                "time_range": {
-                                    "type": "string",
-                                    "description": "Time range for analysis",
-                                    "default": "15m"
-                                }
-                            },
-                            "required": ["service_name"]
+                    }
+                }
+            ),
+            Tool(
+                name="get_service_metrics",
+                description="Get metrics for specific services (CPU, memory, response time, error rate)",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "service_name": {
+                            "type": ["string", "array"],
+                            "items": {"type": "string"},
+                            "description": "Name of the service to analyze, or a list of names to fetch in one batched query"
+                        },
+                        "time_range": {
+                            "type": "string",
+                            "description": "Time range for analysis",
+                            "default": "15m"
+                        }
+                    },
+                    "required": ["service_name"]
+                }
+            ),
+            Tool(
+                name="get_error_analysis",
+                description="Analyze errors and exceptions in your applications",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "time_range": {
+                            "type": "string",
+                            "description": "Time range for analysis",
+                            "default": "15m"
+                        },
+                        "severity": {
+                            "type": "string",
+                            "description": "Error severity level (ERROR, WARN, INFO)",
+                            "default": "ERROR"
                         }
-                    ),
-                    Tool(
-                        name="get_error_analysis",
-                        description="Analyze errors and exceptions in your applications",
-                        inputSchema={
-                            "type": "object",
-                            "properties": {
-                                "time_range": {
-                                    "type": "string",
-                                    "description": "Time range for analysis",
-                                    "default": "15m"
-                                },
-                                "severity": {
-                                    "type": "string",
-                                    "description": "Error severity level (ERROR, WARN, INFO)",
-                                    "default": "ERROR"
-                                }
-                            }
+                    }
+                }
+            ),
+            Tool(
+                name="get_performance_issues",
+                description="Identify performance bottlenecks and slow operations",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "time_range": {
+                            "type": "string",
+                            "description": "Time range for analysis",
+                            "default": "15m"
+                        },
+                        "threshold_ms": {
+                            "type": "number",
+                            "description": "Response time threshold in milliseconds",
+                            "default": 1000
                         }
-                    ),
-                    Tool(
-                        name="get_performance_issues",
-                        description="Identify performance bottlenecks and slow operations",
-                        inputSchema={
-                            "type": "object",
-                            "properties": {
-                                "time_range": {
-                                    "type": "string",
-                                    "description": "Time range for analysis",
-                                    "default": "15m"
-                                },
-                                "threshold_ms": {
-                                    "type": "number",
-                                    "description": "Response time threshold in milliseconds",
-                                    "default": 1000
-                                }
-                            }
+                    }
+                }
+            ),
+            Tool(
+                name="get_resource_utilization",
+                description="Get CPU, memory, and resource utilization across hosts",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "time_range": {
+                            "type": "string",
+                            "description": "Time range for analysis",
+                            "default": "15m"
+                        },
+                        "resource_type": {
+                            "type": "string",
+                            "description": "Resource type (cpu, memory, disk, network)",
+                            "default": "cpu"
                         }
-                    ),
-                    Tool(
-                        name="get_resource_utilization",
-                        description="Get CPU, memory, and resource utilization across hosts",
-                        inputSchema={
-                            "type": "object",
-                            "properties": {
-                                "time_range": {
-                                    "type": "string",
-                                    "description": "Time range for analysis",
-                                    "default": "15m"
-                                },
-                                "resource_type": {
-                                    "type": "string",
-                                    "description": "Resource type (cpu, memory, disk, network)",
-                                    "default": "cpu"
-                                }
-                            }
+                    }
+                }
+            ),
+            Tool(
+                name="get_trace_analysis",
+                description="Analyze distributed traces for service dependencies and bottlenecks",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "time_range": {
+                            "type": "string",
+                            "description": "Time range for analysis",
+                            "default": "15m"
+                        },
+                        "service_name": {
+                            "type": "string",
+                            "description": "Optional service name to filter traces"
                         }
-                    ),
-                    Tool(
-                        name="get_trace_analysis",
-                        description="Analyze distributed traces for service dependencies and bottlenecks",
-                        inputSchema={
-                            "type": "object",
-                            "properties": {
-                                "time_range": {
-                                    "type": "string",
-                                    "description": "Time range for analysis",
-                                    "default": "15m"
-                                },
-                                "service_name": {
-                                    "type": "string",
-                                    "description": "Optional service name to filter traces"
-                                }
-                            }
+                    }
+                }
+            ),
+            Tool(
+                name="get_code_recommendations",
+                description="Get specific code recommendations based on OTEL data analysis",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "analysis_type": {
+                            "type": "string",
+                            "description": "Type of analysis (performance, errors, resources, traces)",
+                            "enum": ["performance", "errors", "resources", "traces"]
+                        },
+                        "time_range": {
+                            "type": "string",
+                            "description": "Time range for analysis",
+                            "default": "15m"
                         }
-                    ),
-                    Tool(
-                        name="get_code_recommendations",
-                        description="Get specific code recommendations based on OTEL data analysis",
-                        inputSchema={
-                            "type": "object",
-                            "properties": {
-                                "analysis_type": {
-                                    "type": "string",
-                                    "description": "Type of analysis (performance, errors, resources, traces)",
-                                    "enum": ["performance", "errors", "resources", "traces"]
-                                },
-                                "time_range": {
-                                    "type": "string",
-                                    "description": "Time range for analysis",
-                                    "default": "15m"
-                                }
-                            },
-                            "required": ["analysis_type"]
+                    },
+                    "required": ["analysis_type"]
+                }
+            ),
+            Tool(
+                name="get_incident_triage",
+                description="Triage an incident in one call: health, errors, slow operations, resources, traces and recommendations from one shared, deduplicated query plan",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "time_range": {
+                            "type": "string",
+                            "description": "Time range for analysis",
+                            "default": "15m"
+                        },
+                        "service_name": {
+                            "type": "string",
+                            "description": "Optional service to focus on, together with everything it calls"
+                        },
+                        "threshold_ms": {
+                            "type": "number",
+                            "description": "Response time threshold in milliseconds",
+                            "default": 1000
                         }
-                    )
-                ]
+                    }
+                }
+            ),
+            Tool(
+                name="get_server_stats",
+                description="Get this MCP server's own latency, traffic, error, cache and connection pool statistics",
+                inputSchema={
+                    "type": "object",
+                    "properties": {}
+                }
             )
+        ]
         
-        @self.server.call_tool()
-        async def call_tool(name: str, arguments: Dict[str, Any]) -> CallToolResult:
-            """Handle tool calls for Elastic OTEL data"""
+        # Every tool accepts the cache escape hatch and output budget
+        for tool in tools:
+            tool.inputSchema["properties"].update(COMMON_TOOL_PROPERTIES)
+        
+        if module_available("jsonschema"):
+            import jsonschema
+            
+            # Compiled once instead of re-checking each schema on every call
+            self.tool_validators = {
+                tool.name: jsonschema.validators.validator_for(tool.inputSchema)(tool.inputSchema) for tool in tools
+            }
+        
+        self._tool_catalog = ListToolsResult(tools=tools)
+        return self._tool_catalog
+    
+    def validate_arguments(self, name: str, arguments: Dict[str, Any]) -> Optional[str]:
+        """Why arguments do not match the tool's input schema, or None if they do"""
+        self.tool_catalog()
+        validator = self.tool_validators.get(name)
+        if validator is None:
+            return None
+        import jsonschema
+        
+        error = jsonschema.exceptions.best_match(validator.iter_errors(arguments))
+        return error.message if error is not None else None
+    
+    async def dispatch_tool(self, name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Run the named tool, noting which federated endpoints its answer covers"""
+        if not self.endpoints or name == "get_server_stats":
+            return await self._dispatch_tool(name, arguments)
+        
+        report = {"failed": {}, "approximate": set()}
+        token = federation_report.set(report)
+        try:
+            result = await self._dispatch_tool(name, arguments)
+        finally:
+            federation_report.reset(token)
+        if isinstance(result, dict):
+            result["federation"] = {
+                "endpoints": [endpoint.name for endpoint in self.endpoints],
+                "partial": bool(report["failed"]),
+                "failed": report["failed"],
+                "approximate": sorted(report["approximate"])
+            }
+        return result
+    
+    async def _dispatch_tool(self, name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Run the named tool with its arguments"""
+        handler = self.tool_handlers.get(name)
+        if handler is None:
+            return {"error": f"Unknown tool: {name}"}
+        result = handler(arguments)
+        return await result if inspect.isawaitable(result) else result
+    
+    async def _prefetch_tool(self, name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a tool for the prefetcher against fresh data"""
+        token = bypass_cache.set(True)
+        try:
+            with self.stats.span(f"prefetch {name}", tool=name):
+                return await self.dispatch_tool(name, arguments)
+        finally:
+            bypass_cache.reset(token)
+    
+    def start_background_tasks(self):
+        """Start background work that needs a running event loop"""
+        if self.prefetcher is not None:
+            self.prefetcher.start()
+        if self.warmup and self._warmup_task is None:
+            self._warmup_task = asyncio.create_task(self.warm_up())
+    
+    async def warm_up(self):
+        """Open Elastic connections and load deferred modules before the first tool call"""
+        started = time.perf_counter()
+        self.tool_catalog()
+        modules = []
+        if self.anomaly_engine is not None:
+            modules.append("numpy")
+        if self.serializer.backend == "orjson":
+            modules.append("orjson")
+        if self.result_format == "arrow":
+            modules.append("pyarrow.ipc")
+        
+        async def connect(client: httpx.AsyncClient):
+            # Any answer leaves a TLS connection in the pool; failures only cost the first call
             try:
-                if name == "get_application_health":
-                    result = await self.get_application_health(arguments.get("time_range", "15m"))
-                elif name == "get_service_metrics":
-                    result = await self.get_service_metrics(
-                        arguments["service_name"], 
-                        arguments.get("time_range", "15m")
-                    )
-                elif name == "get_error_analysis":
-                    result = await self.get_error_analysis(
-                        arguments.get("time_range", "15m"),
-                        arguments.get("severity", "ERROR")
-                    )
-                elif name == "get_performance_issues":
-                    result = await self.get_performance_issues(
-                        arguments.get("time_range", "15m"),
-                        arguments.get("threshold_ms", 1000)
-                    )
-                elif name == "get_resource_utilization":
-                    result = await self.get_resource_utilization(
-                        arguments.get("time_range", "15m"),
-                        arguments.get("resource_type", "cpu")
-                    )
-                elif name == "get_trace_analysis":
-                    result = await self.get_trace_analysis(
-                        arguments.get("time_range", "15m"),
-                        arguments.get("service_name")
-                    )
-                elif name == "get_code_recommendations":
-                    result = await self.get_code_recommendations(
-                        arguments["analysis_type"],
-                        arguments.get("time_range", "15m")
+                await client.head("/")
+            except Exception as e:
+                logger.debug(f"Warm-up connection to {client.base_url} failed: {e}")
+        
+        clients = [self.get_client()] + [self.endpoint_client(endpoint) for endpoint in self.endpoints]
+        await asyncio.gather(
+            *(connect(client) for client in clients),
+            *(asyncio.to_thread(importlib.import_module, module) for module in modules)
+        )
+        self.warmup_ms = round((time.perf_counter() - started) * 1000, 3)
+    
+    def get_client(self) -> httpx.AsyncClient:
+        """Return the pooled HTTP client, creating it on first use"""
+        if self._client is None or self._client.is_closed:
+            self._client = self.create_client(self.elastic_endpoint, self.api_key)
+        return self._client
+    
+    def endpoint_client(self, endpoint: ElasticEndpoint) -> httpx.AsyncClient:
+        """Return a federated endpoint's own pooled client, creating it on first use"""
+        if endpoint.client is None or endpoint.client.is_closed:
+            endpoint.client = self.create_client(endpoint.endpoint, endpoint.api_key)
+        return endpoint.client
+    
+    def create_client(self, base_url: str, api_key: str) -> httpx.AsyncClient:
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("ELASTIC_HTTP2 requested but the 'h2' package is not installed; using HTTP/1.1")
+                http2 = False
+        
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers={
+                "Authorization": f"ApiKey {api_key}",
+                "Content-Type": "application/json",
+                "kbn-xsrf": "true"
+            },
+            limits=self.limits,
+            timeout=self.timeout,
+            http2=http2,
+            transport=self.transport
+        )
+    
+    async def close(self):
+        """Stop background work, close the pooled HTTP client and flush telemetry"""
+        if self._warmup_task is not None and not self._warmup_task.done():
+            self._warmup_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._warmup_task
+        if self.prefetcher is not None:
+            await self.prefetcher.stop()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        for endpoint in self.endpoints:
+            if endpoint.client is not None:
+                await endpoint.client.aclose()
+                endpoint.client = None
+        if self.store is not None:
+            self.store.close()
+        if self.stats.exporter is not None:
+            self.stats.exporter.shutdown()
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """Configured limits and, when available, live connection counts"""
+        stats = {
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "http2": self.http2,
+            "client_open": self._client is not None and not self._client.is_closed
+        }
+        
+        # httpcore exposes live connections on the pool behind the default transport
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            stats["connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for connection in connections if connection.is_idle())
+        return stats
+    
+    def get_server_stats(self) -> Dict[str, Any]:
+        """Per-tool and per-data-view latency, traffic and error statistics"""
+        stats = self.stats.snapshot()
+        stats["timestamp"] = datetime.now().isoformat()
+        stats["cache"] = self.cache.stats() if self.cache is not None else {"enabled": False}
+        stats["pool"] = self.pool_stats()
+        stats["limiter"] = self.limiter.stats()
+        stats["breaker"] = self.breaker.stats()
+        if self.endpoints:
+            stats["federation"] = {endpoint.name: endpoint.stats() for endpoint in self.endpoints}
+        stats["retries"] = self.retries
+        stats["async_queries"] = self.async_queries
+        stats["routing"] = self.router.stats() if self.router is not None else {"enabled": False}
+        stats["prefetch"] = self.prefetcher.stats() if self.prefetcher is not None else {"enabled": False}
+        stats["warmup"] = {"enabled": self.warmup, "duration_ms": self.warmup_ms}
+        return stats
+    
+    async def execute_esql_query(
+        self,
+        query: str,
+        data_view: str,
+        no_cache: bool = False,
+        params: Optional[List[Dict[str, Any]]] = None,
+        template: Optional[str] = None,
+        window: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Execute ESQL query against Elastic, served from the result cache when possible"""
+        planner = shared_scans.get()
+        if planner is not None and not no_cache:
+            return await planner.submit(query, data_view, params, template, window)
+        return await self._execute_esql_query(query, data_view, no_cache, params, template, window)
+    
+    async def _execute_esql_query(
+        self,
+        query: str,
+        data_view: str,
+        no_cache: bool = False,
+        params: Optional[List[Dict[str, Any]]] = None,
+        template: Optional[str] = None,
+        window: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        if self.cache is None or no_cache or bypass_cache.get():
+            result = await self._post_esql_query(query, data_view, params, template, window)
+        else:
+            key = QueryResultCache.make_key(query, data_view, params)
+            result = await self.cache.get_or_fetch(
+                key, lambda: self._post_esql_query(query, data_view, params, template, window)
+            )
+            
+            # While Elastic is failing, prefer a recently expired answer over an error
+            if "error" in result and self.serve_stale:
+                stale = self.cache.get_stale(key, self.stale_max_age)
+                if stale is not None:
+                    logger.warning(f"Serving stale result for {data_view} after query error: {result['error']}")
+                    result = stale
+        
+        report = federation_report.get()
+        if report is not None and "federation" in result:
+            report["failed"].update(result["federation"]["failed"])
+            report["approximate"].update(result["federation"]["approximate"])
+        return result
+    
+    def retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Full-jitter exponential backoff, or the server's Retry-After when given"""
+        requested = parse_retry_after(retry_after)
+        if requested is not None:
+            return min(requested, self.retry_max_delay)
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
+    
+    async def _send_with_retries(
+        self,
+        client: httpx.AsyncClient,
+        body: Optional[Dict[str, Any]],
+        method: str = "POST",
+        path: str = "/_query",
+        params: Optional[Dict[str, str]] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> httpx.Response:
+        """Send to the ES|QL API under the adaptive limit, retrying throttling and transport errors"""
+        breaker = breaker or self.breaker
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            async with self.limiter:
+                try:
+                    response = await client.request(method, path, params=params, json=body)
+                except httpx.TransportError:
+                    self.limiter.on_overload()
+                    if last_attempt:
+                        breaker.record_failure()
+                        raise
+                    delay = self.retry_delay(attempt)
+                else:
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        await self.limiter.on_success()
+                        if response.status_code >= 500:
+                            breaker.record_failure()
+                        else:
+                            breaker.record_success()
+                        return response
+                    
+                    self.limiter.on_overload()
+                    if last_attempt:
+                        breaker.record_failure()
+                        return response
+                    delay = self.retry_delay(attempt, response.headers.get("Retry-After"))
+            
+            self.retries += 1
+            logger.info(f"Retrying ES|QL query in {delay:.2f}s (attempt {attempt + 2}/{self.max_retries + 1})")
+            await asyncio.sleep(delay)
+    
+    async def _post_esql_query(
+        self,
+        query: str,
+        data_view: str,
+        params: Optional[List[Dict[str, Any]]] = None,
+        template: Optional[str] = None,
+        window: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Send an ESQL query to Elastic, or to every federated endpoint"""
+        if self.endpoints:
+            return await self._federated_query(query, data_view, params, template, window)
+        return await self._post_to_endpoint(self.get_client(), self.breaker, query, data_view, params, template, window)
+    
+    async def _federated_query(
+        self,
+        query: str,
+        data_view: str,
+        params: Optional[List[Dict[str, Any]]] = None,
+        template: Optional[str] = None,
+        window: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Fan a query out to every endpoint and merge what arrives before each deadline"""
+        use_async = bool(self.async_threshold and window and window >= self.async_threshold)
+        
+        async def query_endpoint(endpoint: ElasticEndpoint) -> Dict[str, Any]:
+            endpoint.queries += 1
+            request = self._post_to_endpoint(
+                self.endpoint_client(endpoint), endpoint.breaker, query, data_view, params, template, window
+            )
+            try:
+                # Async queries are bounded by ELASTIC_ASYNC_MAX_DURATION instead
+                result = await (request if use_async else asyncio.wait_for(request, endpoint.timeout))
+            except asyncio.TimeoutError:
+                endpoint.timeouts += 1
+                endpoint.breaker.record_failure()
+                result = {"error": f"timed out after {endpoint.timeout:g}s"}
+            if "error" in result:
+                endpoint.failures += 1
+            return result
+        
+        results = await asyncio.gather(*(query_endpoint(endpoint) for endpoint in self.endpoints))
+        failed = {endpoint.name: result["error"] for endpoint, result in zip(self.endpoints, results) if "error" in result}
+        succeeded = [result for result in results if "error" not in result]
+        federation = {"endpoints": [endpoint.name for endpoint in self.endpoints], "failed": failed, "approximate": []}
+        if not succeeded:
+            result = {"error": "; ".join(f"{name}: {error}" for name, error in failed.items()), "federation": federation}
+            # Keep the error type when every endpoint rejected the query the same way
+            error_types = {result.get("error_type") for result in results}
+            if len(error_types) == 1 and None not in error_types:
+                result["error_type"] = error_types.pop()
+            return result
+        
+        merger = self.mergers.get(query)
+        if merger is None:
+            if len(self.mergers) >= 256:
+                self.mergers.clear()
+            merger = self.mergers[query] = EsqlResultMerger(query)
+        merged = merger.merge(succeeded)
+        merged["federation"] = {**federation, "approximate": merger.approximate}
+        # Partial results are returned but never cached
+        merged["partial"] = bool(failed)
+        return merged
+    
+    async def _post_to_endpoint(
+        self,
+        client: httpx.AsyncClient,
+        breaker: CircuitBreaker,
+        query: str,
+        data_view: str,
+        params: Optional[List[Dict[str, Any]]] = None,
+        template: Optional[str] = None,
+        window: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Send an ESQL query to one Elastic endpoint"""
+        body = {
+            "query": query,
+            "index": data_view
+        }
+        if params:
+            body["params"] = params
+        if self.result_format != "json":
+            body["columnar"] = True
+        # Arrow is only used for synchronous queries; async polls return JSON
+        use_async = bool(self.async_threshold and window and window >= self.async_threshold)
+        arrow = self.result_format == "arrow" and not use_async
+        
+        started = time.perf_counter()
+        bytes_in = 0
+        rows = 0
+        error = True
+        self.stats.queries_in_flight += 1
+        try:
+            with self.stats.span("esql.query", data_view=data_view, template=template or ""):
+                if not breaker.allow_request():
+                    raise CircuitOpenError("Elastic circuit breaker is open; failing fast")
+                if use_async:
+                    response = await self._run_async_query(client, body, template or data_view, breaker)
+                else:
+                    response = await self._send_with_retries(
+                        client, body, params={"format": "arrow"} if arrow else None, breaker=breaker
                     )
+                bytes_in = len(response.content)
+                response.raise_for_status()
+                if arrow:
+                    result = decode_arrow_response(response.content)
                 else:
-                    result = {"error": f"Unknown tool: {name}"}
-                
-                return CallToolResult(content=[{"type": "text", "text": json.dumps(result, indent=2)}])
+                    result = response.json()
+                    if self.result_format != "json":
+                        result["columnar"] = True
+            rows = len(EsqlColumns.from_response(result))
+            error = False
+            return result
+        except Exception as e:
+            logger.error(f"ESQL query failed: {e}")
+            result = {"error": str(e)}
+            error_type = esql_error_type(e)
+            if error_type is not None:
+                result["error_type"] = error_type
+            return result
+        finally:
+            self.stats.queries_in_flight -= 1
+            self.stats.record_query(data_view, (time.perf_counter() - started) * 1000, bytes_in, rows, error, template)
+    
+    async def _run_async_query(
+        self,
+        client: httpx.AsyncClient,
+        body: Dict[str, Any],
+        label: str,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> httpx.Response:
+        """Run a query through the async ES|QL API, polling until it completes
+        
+        Each request waits at most ``async_wait`` seconds on the server, so the
+        connection and limiter slot are released between polls. Interim status
+        is sent to the client as MCP progress notifications. The query is
+        deleted on cancellation or when it exceeds ``async_max_duration``.
+        """
+        timing = {"wait_for_completion_timeout": f"{self.async_wait:g}s", "keep_alive": self.async_keep_alive}
+        self.async_queries += 1
+        started = time.monotonic()
+        response = await self._send_with_retries(
+            client, {**body, **timing, "keep_on_completion": False}, path="/_query/async", breaker=breaker
+        )
+        query_id = None
+        polls = 0
+        try:
+            while response.status_code == 200:
+                status = response.json()
+                query_id = status.get("id") or query_id
+                if not status.get("is_running"):
+                    if polls and query_id is not None:
+                        # The finished result is stored until keep_alive; release it now
+                        with contextlib.suppress(httpx.HTTPError):
+                            await client.delete(f"/_query/async/{query_id}")
+                    return response
                 
-            except Exception as e:
-                logger.error(f"Error calling tool {name}: {e}")
-                return CallToolResult(content=[{"type": "text", "text": f"Error: {str(e)}"}])
-    
-    async def execute_esql_query(self, query: str, data_view: str) -> Dict[str, Any]:
-        """Execute ESQL query against Elastic"""
-        headers = {
-            "Authorization": f"ApiKey {self.api_key}",
-            "Content-Type": "application/json",
-            "kbn-xsrf": "true"
+                elapsed = time.monotonic() - started
+                if elapsed > self.async_max_duration:
+                    raise TimeoutError(f"Async ES|QL query ran longer than {self.async_max_duration:g}s")
+                polls += 1
+                await self.report_progress(polls, message=f"ES|QL {label} still running after {elapsed:.0f}s")
+                response = await self._send_with_retries(
+                    client, None, method="GET", path=f"/_query/async/{query_id}", params=timing, breaker=breaker
+                )
+            return response
+        except BaseException:
+            if query_id is not None:
+                # Free the search on the cluster; never let cleanup mask the original error
+                with contextlib.suppress(Exception):
+                    await asyncio.shield(client.delete(f"/_query/async/{query_id}"))
+            raise
+    
+    async def report_progress(self, progress: float, total: Optional[float] = None, message: Optional[str] = None):
+        """Send an MCP progress notification if the current request asked for them"""
+        try:
+            context = self.server.request_context
+        except LookupError:
+            return
+        token = context.meta.progressToken if context.meta else None
+        if token is None:
+            return
+        with contextlib.suppress(Exception):
+            await context.session.send_progress_notification(token, progress, total, message)
+    
+    async def execute_query(self, query: EsqlQuery) -> Dict[str, Any]:
+        """Execute a bound template against its data view"""
+        return await self.execute_esql_query(
+            query.query,
+            self.data_views[query.data_view],
+            params=query.params,
+            template=query.template,
+            window=query.window
+        )
+    
+    def query_plan(self) -> QueryPlan:
+        """Create an empty query plan bounded by the per-tool concurrency cap"""
+        return QueryPlan(self.max_subquery_concurrency, self.data_views)
+    
+    def incremental_minutes(self, time_range: str) -> Optional[int]:
+        """Window length in minutes if this time range can be served incrementally"""
+        if not self.incremental:
+            return None
+        seconds = parse_time_range(time_range)
+        if seconds is None:
+            return None
+        minutes = max(1, math.ceil(seconds / 60))
+        limit = self.router.max_minutes() if self.router is not None else self.incremental_max_minutes
+        return minutes if minutes <= limit else None
+    
+    def incremental_bucket(self, minutes: int) -> int:
+        """Bucket width in minutes for an incremental window"""
+        return self.router.bucket_minutes(minutes) if self.router is not None else 1
+    
+    def resolution(
+        self,
+        source: str,
+        bucket_minutes: Optional[int] = None,
+        sample_rate: float = 1.0,
+        downsampled: bool = False,
+    ) -> Dict[str, Any]:
+        """Describe the data resolution a result was computed from"""
+        if bucket_minutes is not None:
+            mode = "incremental"
+        elif downsampled:
+            mode = "downsampled"
+        elif sample_rate < 1:
+            mode = "sampled"
+        else:
+            mode = "raw"
+        return {
+            "mode": mode,
+            "source": source,
+            "bucket": esql_interval(f"{bucket_minutes}m") if bucket_minutes else None,
+            "sample_rate": sample_rate
         }
+    
+    async def _index_pattern_exists(self, pattern: str) -> bool:
+        """Whether an index pattern resolves to any index, alias or data stream"""
+        try:
+            response = await self._send_with_retries(self.get_client(), None, method="GET", path=f"/_resolve/index/{pattern}")
+            if response.status_code != 200:
+                return False
+            resolved = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning(f"Could not resolve {pattern}: {e}")
+            return False
+        return any(resolved.get(kind) for kind in ("indices", "aliases", "data_streams"))
+    
+    def series(
+        self, key: str, bucket_minutes: int = 1, services: Optional[List[str]] = None
+    ) -> SlidingWindowAggregator:
+        """Get or create the aggregate series for key at the given bucket width
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    f"{self.elastic_endpoint}/_query",
-                    headers=headers,
-                    json={
-                        "query": query,
-                        "index": data_view
-                    }
+        Latency series can be scoped to ``services``; each distinct set is its
+        own series and only the ``SCOPED_SERIES_LIMIT`` most recently used are
+        kept.
+        """
+        series_key = key if bucket_minutes == 1 else f"{key}@{bucket_minutes}m"
+        if services:
+            services = sorted(set(services))
+            series_key += "[" + hashlib.sha256(json.dumps(services).encode()).hexdigest()[:16] + "]"
+        aggregator = self.incremental_series.get(series_key)
+        if aggregator is not None and services:
+            self.incremental_series.move_to_end(series_key)
+        if aggregator is None:
+            if key == "traces_by_service":
+                aggregator = SlidingWindowAggregator(
+                    "traces-*", "service.name", {
+                        "count": "COUNT(*)",
+                        "error_count": 'SUM(CASE WHEN transaction.result = "error" THEN 1 ELSE 0 END)',
+                        "duration_sum": "SUM(transaction.duration.us)",
+                        "duration_count": "COUNT(transaction.duration.us)"
+                    },
+                    self.incremental_settle_minutes, self.incremental_max_minutes * bucket_minutes,
+                    series_key, bucket_minutes, store=self.store
                 )
-                response.raise_for_status()
-                return response.json()
-            except Exception as e:
-                logger.error(f"ESQL query failed: {e}")
-                return {"error": str(e)}
+            elif key == "metrics_by_service":
+                aggregator = SlidingWindowAggregator(
+                    "metrics-*", "service.name", {
+                        "cpu_sum": "SUM(system.cpu.utilization)",
+                        "cpu_count": "COUNT(system.cpu.utilization)",
+                        "memory_sum": "SUM(system.memory.utilization)",
+                        "memory_count": "COUNT(system.memory.utilization)"
+                    },
+                    self.incremental_settle_minutes, self.incremental_max_minutes * bucket_minutes,
+                    series_key, bucket_minutes, store=self.store
+                )
+            elif key == "dependencies":
+                aggregator = SlidingWindowAggregator(
+                    "traces-*", "service.name, service.target.name", DEPENDENCY_AGGREGATES,
+                    self.incremental_settle_minutes, self.incremental_max_minutes * bucket_minutes,
+                    series_key, bucket_minutes, where="service.target.name IS NOT NULL", store=self.store
+                )
+            elif key in ("latency_by_service", "latency_by_operation"):
+                group_field = "service.name" if key == "latency_by_service" else "service.name, transaction.name"
+                where, params = None, []
+                if services:
+                    placeholders = [f"service_{i}" for i in range(len(services))]
+                    where = f"service.name IN ({', '.join(f'?{name}' for name in placeholders)})"
+                    params = [{name: service} for name, service in zip(placeholders, services)]
+                aggregator = SlidingWindowAggregator(
+                    "traces-*", f"{group_field}, duration_bin", LATENCY_BIN_AGGREGATES,
+                    self.incremental_settle_minutes, self.incremental_max_minutes * bucket_minutes,
+                    series_key, bucket_minutes, where=where, store=self.store,
+                    eval=f"duration_bin = {QuantileSketch.index_expression('transaction.duration.us', self.sketch_accuracy)}",
+                    params=params
+                )
+                if services:
+                    # Evict the least recently used scoped series
+                    scoped = [name for name in self.incremental_series if name.endswith("]")]
+                    for name in scoped[:max(0, len(scoped) - SCOPED_SERIES_LIMIT + 1)]:
+                        del self.incremental_series[name]
+            elif key.startswith("metrics_by_host:"):
+                resource_type = key.split(":", 1)[1]
+                if not ESQL_IDENTIFIER.fullmatch(resource_type):
+                    raise ValueError(f"Invalid resource_type: {resource_type!r}")
+                aggregator = SlidingWindowAggregator(
+                    "metrics-*", "host.name", {
+                        "utilization_sum": f"SUM(system.{resource_type}.utilization)",
+                        "utilization_count": f"COUNT(system.{resource_type}.utilization)"
+                    },
+                    self.incremental_settle_minutes, self.incremental_max_minutes * bucket_minutes,
+                    series_key, bucket_minutes, store=self.store
+                )
+            else:
+                raise ValueError(f"Unknown incremental series: {key}")
+            self.incremental_series[series_key] = aggregator
+        return aggregator
+    
+    async def series_window(self, key: str, data_view: str, minutes: int) -> Optional[Dict[str, Dict[str, float]]]:
+        """Per-group totals of an incremental series over the last minutes"""
+        series = self.series(key, self.incremental_bucket(minutes))
+        return await series.window(minutes, self.execute_esql_query, self.data_views[data_view])
+    
+    def sketch_minutes(self, time_range: str) -> Optional[int]:
+        """Window length in minutes if latency sketches can answer this time range"""
+        if not self.quantile_sketches:
+            return None
+        seconds = parse_time_range(time_range)
+        if seconds is None:
+            return None
+        minutes = max(1, math.ceil(seconds / 60))
+        return minutes if minutes <= self.sketch_max_buckets * BUCKET_MINUTES[-1] else None
+    
+    def sketch_bucket(self, minutes: int) -> int:
+        """Bucket width for latency sketches, coarse enough to keep a window within sketch_max_buckets"""
+        finest = self.incremental_bucket(minutes)
+        for size in BUCKET_MINUTES:
+            if size >= finest and math.ceil(minutes / size) <= self.sketch_max_buckets:
+                return size
+        return BUCKET_MINUTES[-1]
+    
+    async def latency_sketches(
+        self,
+        key: str,
+        minutes: Optional[int],
+        services: Optional[List[str]] = None,
+        slow_threshold: Optional[float] = None,
+    ) -> Optional[Dict[Any, GroupLatency]]:
+        """Transaction totals and latency sketches (microseconds) per group of a binned series"""
+        if not minutes:
+            return None
+        series = self.series(key, self.sketch_bucket(minutes), services)
+        totals = await series.window(minutes, self.execute_esql_query, self.data_views["traces"])
+        if totals is None:
+            return None
+        groups: Dict[Any, GroupLatency] = {}
+        for (*group, index), values in totals.items():
+            group = group[0] if len(group) == 1 else tuple(group)
+            if group not in groups:
+                groups[group] = GroupLatency(self.sketch_accuracy, slow_threshold)
+            groups[group].add_bin(index, values)
+        return groups
+    
+    async def entity_baselines(
+        self,
+        kind: str,
+        template: str,
+        time_range: str,
+        group_field: str,
+        value_field: str,
+        weight_field: Optional[str] = None,
+        std_floor: float = 0.01,
+        identifiers: Optional[Dict[str, str]] = None,
+    ) -> Optional[Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]]:
+        """Baseline scores per entity from one bucketed series query, plus how they were computed"""
+        window = parse_time_range(time_range)
+        if self.anomaly_engine is None or not window:
+            return None
+        
+        lookback, bucket = self.anomaly_engine.plan(kind, window)
+        query = ESQL_TEMPLATES[template].bind(
+            f"{lookback}s", identifiers=identifiers, bucket=f"{bucket}m", limit=self.anomaly_engine.max_rows
+        )
+        data = await self.execute_query(query)
+        if "error" in data:
+            return None
+        
+        columns = EsqlColumns.from_response(data)
+        recent_from = int(time.time() // 60) - math.ceil(window / 60)
+        scores = self.anomaly_engine.analyze(
+            kind, columns, group_field, value_field, recent_from - recent_from % bucket, weight_field, std_floor
+        )
+        return scores, {
+            "method": "zscore",
+            "lookback": esql_interval(f"{lookback}s"),
+            "bucket": esql_interval(f"{bucket}m"),
+            "entities": len(scores),
+            # Oldest buckets were cut by the row limit; baselines are shorter
+            "truncated": len(columns) >= self.anomaly_engine.max_rows
+        }
     
     async def get_application_health(self, time_range: str) -> Dict[str, Any]:
         """Get overall application health status"""
@@ -260,94 +3971,242 @@ class ElasticOTELMCPServer:
             "alerts": []
         }
         
-        # Get error rates
-        error_query = f"""
-        FROM traces-*
-        | WHERE @timestamp >= NOW() - {time_range}
-        | STATS error_rate = AVG(CASE WHEN transaction.result = "error" THEN 1 ELSE 0 END) BY service.name
-        | SORT error_rate DESC
-        """
+        minutes = self.incremental_minutes(time_range)
+        totals = await self.series_window("traces_by_service", "traces", minutes) if minutes else None
         
-        error_data = await self.execute_esql_query(error_query, self.data_views['traces'])
+        if totals is not None:
+            # Derive both rates from the rolled-up per-minute partials
+            services = sorted(
+                totals, key=lambda service: totals[service]["error_count"] / (totals[service]["count"] or 1),
+                reverse=True
+            )
+            error_columns = EsqlColumns({
+                "service.name": services,
+                "error_rate": [
+                    totals[service]["error_count"] / totals[service]["count"] if totals[service]["count"] else 0
+                    for service in services
+                ]
+            })
+            response_columns = EsqlColumns({
+                "service.name": services,
+                "avg_response_time": [
+                    totals[service]["duration_sum"] / totals[service]["duration_count"]
+                    if totals[service]["duration_count"] else None
+                    for service in services
+                ]
+            })
+            health_data["resolution"] = self.resolution(self.data_views['traces'], self.incremental_bucket(minutes))
+        else:
+            async def scans(sample: float) -> Dict[str, Dict[str, Any]]:
+                # Get error rates and response times
+                plan = self.query_plan()
+                plan.add("errors", ESQL_TEMPLATES["health_error_rates"].bind(time_range, sample=sample))
+                plan.add("response_times", ESQL_TEMPLATES["health_response_times"].bind(time_range, sample=sample))
+                return await plan.execute(self.execute_esql_query)
+            
+            # Wide windows read a sample of the traces; rates and averages stay unbiased
+            sample = self.router.sample_rate(parse_time_range(time_range)) if self.router is not None else 1.0
+            results = await scans(sample)
+            if sample < 1 and self.router.sampling_rejected(list(results.values())):
+                unsampled = await scans(1.0)
+                if not self.router.sampling_rejected(list(unsampled.values())):
+                    # The cluster has no SAMPLE; scan unsampled from now on
+                    logger.warning("Elastic rejected ES|QL SAMPLE; trace scans are no longer sampled")
+                    self.router.sampling = False
+                    sample, results = 1.0, unsampled
+            health_data["resolution"] = self.resolution(self.data_views['traces'], sample_rate=sample)
+            error_columns = EsqlColumns.from_response(results["errors"])
+            response_columns = EsqlColumns.from_response(results["response_times"])
         
-        # Get response times
-        response_query = f"""
-        FROM traces-*
-        | WHERE @timestamp >= NOW() - {time_range}
-        | STATS avg_response_time = AVG(transaction.duration.us) BY service.name
-        | SORT avg_response_time DESC
-        """
+        # Analyze health
+        for service, error_rate in error_columns.rows("service.name", "error_rate"):
+            health_data["services"][service] = {
+                "error_rate": error_rate,
+                "status": "healthy" if error_rate < 0.05 else "degraded" if error_rate < 0.2 else "critical"
+            }
+            
+            if error_rate > 0.2:
+                health_data["alerts"].append({
+                    "service": service,
+                    "message": f"High error rate for {service}: {error_rate:.2%}"
+                })
         
-        response_data = await self.execute_esql_query(response_query, self.data_views['traces'])
+        for service, avg_response_time in response_columns.rows("service.name", "avg_response_time"):
+            health_data["services"].setdefault(service, {})["avg_response_time_ms"] = (
+                avg_response_time / 1000 if avg_response_time else 0
+            )
         
-        # Analyze health
-        if error_data.get("rows"):
-            for row in error_data["rows"]:
-                service = row[0]
-                error_rate = row[1]
-                health_data["services"][service] = {
-                    "error_rate": error_rate,
-                    "status": "healthy" if error_rate < 0.05 else "degraded" if error_rate < 0.2 else "critical"
-                }
-                
-                if error_rate > 0.2:
-                    health_data["alerts"].append(f"High error rate for {service}: {error_rate:.2%}")
+        # Reclassify against each service's own error-rate baseline
+        baselines = await self.entity_baselines(
+            "services", "service_error_series", time_range, "service.name", "error_count", "count"
+        )
+        if baselines is not None:
+            scores, health_data["baseline"] = baselines
+            for service, score in scores.items():
+                entry = health_data["services"].setdefault(service, {})
+                entry["baseline"] = score
+                if score["level"] is None:
+                    continue
+                # Baselines only raise a status; the fixed error-rate thresholds stay the floor
+                status = SERVICE_STATUSES[STATUS_LEVELS.index(score["level"])]
+                entry["status"] = max(status, entry.get("status", "healthy"), key=SERVICE_STATUSES.index)
+                if score["level"] == "anomalous" and (entry.get("error_rate") or 0) <= 0.2:
+                    health_data["alerts"].append({
+                        "service": service,
+                        "message": f"Anomalous error rate for {service}: {score['current']:.2%} "
+                                   f"vs baseline {score['baseline_mean']:.2%} (z={score['z_score']:.1f})"
+                    })
         
+        health_data["overall_status"] = _overall_status(health_data["services"])
         return health_data
     
-    async def get_service_metrics(self, service_name: str, time_range: str) -> Dict[str, Any]:
-        """Get detailed metrics for a specific service"""
-        metrics = {
-            "service": service_name,
-            "timestamp": datetime.now().isoformat(),
+    async def get_service_metrics(self, service_name: Union[str, List[str]], time_range: str) -> Dict[str, Any]:
+        """Get detailed metrics for a specific service, or for a list of services in one batch"""
+        if isinstance(service_name, list):
+            return await self.get_services_metrics(service_name, time_range)
+        
+        batch = await self.get_services_metrics([service_name], time_range)
+        return batch["services"][service_name]
+    
+    async def get_services_metrics(self, service_names: List[str], time_range: str) -> Dict[str, Any]:
+        """Get detailed metrics for several services with one grouped query per data view"""
+        timestamp = datetime.now().isoformat()
+        service_names = list(dict.fromkeys(service_names))
+        batch = {
+            "timestamp": timestamp,
             "time_range": time_range,
-            "metrics": {}
+            "services": {
+                name: {
+                    "service": name,
+                    "timestamp": timestamp,
+                    "time_range": time_range,
+                    "metrics": {}
+                }
+                for name in service_names
+            }
         }
+        if not service_names:
+            return batch
         
-        # Get transaction metrics
-        transaction_query = f"""
-        FROM traces-*
-        | WHERE @timestamp >= NOW() - {time_range} AND service.name = "{service_name}"
-        | STATS 
-            transaction_count = COUNT(*),
-            error_count = COUNT(CASE WHEN transaction.result = "error" THEN 1 END),
-            avg_duration = AVG(transaction.duration.us),
-            p95_duration = PERCENTILE(transaction.duration.us, 95),
-            p99_duration = PERCENTILE(transaction.duration.us, 99)
-        """
+        minutes = self.incremental_minutes(time_range)
         
-        transaction_data = await self.execute_esql_query(transaction_query, self.data_views['traces'])
-        
-        if transaction_data.get("rows"):
-            row = transaction_data["rows"][0]
-            metrics["metrics"]["transactions"] = {
-                "count": row[0],
-                "errors": row[1],
-                "error_rate": row[1] / row[0] if row[0] > 0 else 0,
-                "avg_duration_ms": row[2] / 1000 if row[2] else 0,
-                "p95_duration_ms": row[3] / 1000 if row[3] else 0,
-                "p99_duration_ms": row[4] / 1000 if row[4] else 0
+        async def transactions() -> Optional[EsqlColumns]:
+            # Counts, averages and percentiles from one binned scan of these services
+            latency = await self.latency_sketches(
+                "latency_by_service", self.sketch_minutes(time_range), service_names
+            )
+            if latency is not None:
+                rollup = QuantileSketch(self.sketch_accuracy)
+                for name in service_names:
+                    if name in latency:
+                        rollup.merge(latency[name].sketch)
+                batch["latency"] = {
+                    "count": int(rollup.count),
+                    "p50_duration_ms": rollup.quantile(0.5) / 1000,
+                    "p95_duration_ms": rollup.quantile(0.95) / 1000,
+                    "p99_duration_ms": rollup.quantile(0.99) / 1000,
+                    "relative_accuracy": rollup.accuracy
+                }
+                traced = [name for name in service_names if name in latency and latency[name].count]
+                return EsqlColumns({
+                    "service.name": traced,
+                    "transaction_count": [latency[name].count for name in traced],
+                    "error_count": [latency[name].error_count for name in traced],
+                    "avg_duration": [
+                        latency[name].duration_sum / latency[name].duration_count
+                        if latency[name].duration_count else None
+                        for name in traced
+                    ],
+                    "p95_duration": [latency[name].sketch.quantile(0.95) for name in traced],
+                    "p99_duration": [latency[name].sketch.quantile(0.99) for name in traced]
+                }, len(traced))
+            
+            trace_totals = await self.series_window("traces_by_service", "traces", minutes) if minutes else None
+            if trace_totals is None:
+                return None
+            # Without sketches, percentiles are not mergeable and are queried directly
+            percentile_data = await self.execute_query(
+                ESQL_TEMPLATES["service_percentiles"].bind(time_range, services=service_names)
+            )
+            percentiles = {
+                name: (p95, p99)
+                for name, p95, p99 in EsqlColumns.from_response(percentile_data).rows(
+                    "service.name", "p95_duration", "p99_duration"
+                )
             }
+            traced = [name for name in service_names if trace_totals.get(name)]
+            return EsqlColumns({
+                "service.name": traced,
+                "transaction_count": [trace_totals[name]["count"] for name in traced],
+                "error_count": [trace_totals[name]["error_count"] for name in traced],
+                "avg_duration": [
+                    trace_totals[name]["duration_sum"] / trace_totals[name]["duration_count"]
+                    if trace_totals[name]["duration_count"] else None
+                    for name in traced
+                ],
+                "p95_duration": [percentiles.get(name, (None, None))[0] for name in traced],
+                "p99_duration": [percentiles.get(name, (None, None))[1] for name in traced]
+            }, len(traced))
         
-        # Get resource metrics
-        resource_query = f"""
-        FROM metrics-*
-        | WHERE @timestamp >= NOW() - {time_range} AND service.name = "{service_name}"
-        | STATS 
-            avg_cpu = AVG(system.cpu.utilization),
-            avg_memory = AVG(system.memory.utilization)
-        """
+        async def resources() -> Optional[EsqlColumns]:
+            resource_totals = await self.series_window("metrics_by_service", "metrics", minutes) if minutes else None
+            if resource_totals is None:
+                return None
+            measured = [name for name in service_names if resource_totals.get(name)]
+            return EsqlColumns({
+                "service.name": measured,
+                "avg_cpu": [
+                    resource_totals[name]["cpu_sum"] / resource_totals[name]["cpu_count"]
+                    if resource_totals[name]["cpu_count"] else None
+                    for name in measured
+                ],
+                "avg_memory": [
+                    resource_totals[name]["memory_sum"] / resource_totals[name]["memory_count"]
+                    if resource_totals[name]["memory_count"] else None
+                    for name in measured
+                ]
+            }, len(measured))
+        
+        transaction_columns, resource_columns = await asyncio.gather(transactions(), resources())
         
-        resource_data = await self.execute_esql_query(resource_query, self.data_views['metrics'])
+        if transaction_columns is None or resource_columns is None:
+            plan = self.query_plan()
+            
+            # Query whatever the series could not answer
+            if transaction_columns is None:
+                plan.add("transactions", ESQL_TEMPLATES["service_transactions"].bind(time_range, services=service_names))
+            if resource_columns is None:
+                plan.add("resources", ESQL_TEMPLATES["service_resources"].bind(time_range, services=service_names))
+            
+            results = await plan.execute(self.execute_esql_query)
+            if transaction_columns is None:
+                transaction_columns = EsqlColumns.from_response(results["transactions"])
+            if resource_columns is None:
+                resource_columns = EsqlColumns.from_response(results["resources"])
+        
+        for name, count, errors, avg_duration, p95_duration, p99_duration in transaction_columns.rows(
+            "service.name", "transaction_count", "error_count", "avg_duration", "p95_duration", "p99_duration"
+        ):
+            if name not in batch["services"]:
+                continue
+            batch["services"][name]["metrics"]["transactions"] = {
+                "count": count,
+                "errors": errors,
+                "error_rate": errors / count if count > 0 else 0,
+                "avg_duration_ms": avg_duration / 1000 if avg_duration else 0,
+                "p95_duration_ms": p95_duration / 1000 if p95_duration else 0,
+                "p99_duration_ms": p99_duration / 1000 if p99_duration else 0
+            }
         
-        if resource_data.get("rows"):
-            row = resource_data["rows"][0]
-            metrics["metrics"]["resources"] = {
-                "avg_cpu_percent": row[0] * 100 if row[0] else 0,
-                "avg_memory_percent": row[1] * 100 if row[1] else 0
+        for name, avg_cpu, avg_memory in resource_columns.rows("service.name", "avg_cpu", "avg_memory"):
+            if name not in batch["services"]:
+                continue
+            batch["services"][name]["metrics"]["resources"] = {
+                "avg_cpu_percent": avg_cpu * 100 if avg_cpu else 0,
+                "avg_memory_percent": avg_memory * 100 if avg_memory else 0
             }
         
-        return metrics
+        return batch
     
     async def get_error_analysis(self, time_range: str, severity: str = "ERROR") -> Dict[str, Any]:
         """Analyze errors and exceptions"""
@@ -358,25 +4217,92 @@ class ElasticOTELMCPServer:
             "errors": []
         }
         
+        if self.log_templates:
+            return await self.mine_error_templates(error_analysis, time_range, severity)
+        
         # Get error logs
-        error_query = f"""
-        FROM logs-*
-        | WHERE @timestamp >= NOW() - {time_range} AND log.level = "{severity}"
-        | STATS error_count = COUNT(*) BY service.name, message
-        | SORT error_count DESC
-        | LIMIT 20
-        """
+        error_data = await self.execute_query(ESQL_TEMPLATES["error_logs"].bind(time_range, severity=severity))
         
-        error_data = await self.execute_esql_query(error_query, self.data_views['logs'])
+        for service, message, count in EsqlColumns.from_response(error_data).rows(
+            "service.name", "message", "error_count"
+        ):
+            error_analysis["errors"].append({
+                "service": service,
+                "message": message,
+                "count": count
+            })
         
-        if error_data.get("rows"):
-            for row in error_data["rows"]:
-                error_analysis["errors"].append({
-                    "service": row[0],
-                    "message": row[1],
-                    "count": row[2]
-                })
+        return error_analysis
+    
+    async def mine_error_templates(self, error_analysis: Dict[str, Any], time_range: str, severity: str) -> Dict[str, Any]:
+        """Top error templates mined from the newest log samples, page by page"""
+        count_query = ESQL_TEMPLATES["error_counts"].bind(time_range, severity=severity)
+        counts_task = asyncio.ensure_future(self.execute_query(count_query))
+        
+        miner = LogTemplateMiner(self.log_max_templates, self.log_similarity)
+        sampled: Dict[str, int] = {}
+        pages = 0
+        complete = False
+        # Oldest timestamp sampled so far and how many sampled rows carry it;
+        # the next page starts at that timestamp and skips those rows again
+        before = None
+        seen_at_before = 0
+        try:
+            while miner.messages < self.log_sample_size:
+                size = min(self.log_page_size, self.log_sample_size - miner.messages)
+                limit = size + seen_at_before
+                if before is None:
+                    page_query = ESQL_TEMPLATES["error_log_samples"].bind(time_range, limit=limit, severity=severity)
+                else:
+                    page_query = ESQL_TEMPLATES["error_log_samples_before"].bind(
+                        time_range, limit=limit, severity=severity,
+                        before=before.isoformat() if isinstance(before, datetime) else before
+                    )
+                page = await self.execute_query(page_query)
+                if "error" in page:
+                    break
+                
+                columns = EsqlColumns.from_response(page)
+                boundary, skip = before, seen_at_before
+                for timestamp, service, message in columns.rows("@timestamp", "service.name", "message"):
+                    if skip and timestamp == boundary:
+                        skip -= 1
+                        continue
+                    miner.add(service, message)
+                    sampled[service] = sampled.get(service, 0) + 1
+                    if timestamp == before:
+                        seen_at_before += 1
+                    else:
+                        before, seen_at_before = timestamp, 1
+                pages += 1
+                if len(columns) < limit:
+                    complete = True
+                    break
+        except BaseException:
+            counts_task.cancel()
+            raise
+        count_data = await counts_task
+        
+        totals = dict(EsqlColumns.from_response(count_data).rows("service.name", "error_count"))
+        for template in miner.top(20):
+            # Scale sampled counts up to the service's exact total
+            scale = (totals.get(template.service) or 0) / sampled[template.service] if not complete else 1
+            error_analysis["errors"].append({
+                "service": template.service,
+                "message": template.text,
+                "count": round(template.count * scale) if scale else template.count,
+                "sampled_count": template.count,
+                "sample_parameters": template.samples,
+                "example": template.example
+            })
         
+        error_analysis["templates"] = {
+            "messages": miner.messages,
+            "pages": pages,
+            "complete": complete,
+            "templates": len(miner.templates),
+            "evicted": miner.evicted
+        }
         return error_analysis
     
     async def get_performance_issues(self, time_range: str, threshold_ms: int = 1000) -> Dict[str, Any]:
@@ -388,30 +4314,46 @@ class ElasticOTELMCPServer:
             "slow_operations": []
         }
         
-        # Get slow operations
-        slow_query = f"""
-        FROM traces-*
-        | WHERE @timestamp >= NOW() - {time_range} AND transaction.duration.us > {threshold_ms * 1000}
-        | STATS 
-            count = COUNT(*),
-            avg_duration = AVG(transaction.duration.us),
-            max_duration = MAX(transaction.duration.us)
-        BY service.name, transaction.name
-        | SORT avg_duration DESC
-        | LIMIT 20
-        """
-        
-        slow_data = await self.execute_esql_query(slow_query, self.data_views['traces'])
-        
-        if slow_data.get("rows"):
-            for row in slow_data["rows"]:
+        # Slow operations and each operation's overall percentiles come from
+        # one shared binned series; without it, slow operations are queried
+        threshold_us = float(threshold_ms) * 1000
+        latency = await self.latency_sketches(
+            "latency_by_operation", self.sketch_minutes(time_range), slow_threshold=threshold_us
+        )
+        if latency is not None:
+            slowest = heapq.nlargest(
+                SLOW_OPERATION_LIMIT,
+                ((group, entry) for group, entry in latency.items() if entry.slow_count),
+                key=lambda item: item[1].slow_duration_sum / item[1].slow_count
+            )
+            for (service, operation), entry in slowest:
                 performance_issues["slow_operations"].append({
-                    "service": row[0],
-                    "operation": row[1],
-                    "count": row[2],
-                    "avg_duration_ms": row[3] / 1000 if row[3] else 0,
-                    "max_duration_ms": row[4] / 1000 if row[4] else 0
+                    "service": service,
+                    "operation": operation,
+                    "count": int(entry.slow_count),
+                    "avg_duration_ms": entry.slow_duration_sum / entry.slow_count / 1000,
+                    "max_duration_ms": entry.slow_max_duration / 1000,
+                    "p50_duration_ms": entry.sketch.quantile(0.5) / 1000,
+                    "p95_duration_ms": entry.sketch.quantile(0.95) / 1000,
+                    "p99_duration_ms": entry.sketch.quantile(0.99) / 1000
                 })
+            # Slow counts are binned, so they are within the sketch accuracy of the threshold
+            performance_issues["relative_accuracy"] = self.sketch_accuracy
+            return performance_issues
+        
+        slow_data = await self.execute_query(
+            ESQL_TEMPLATES["slow_operations"].bind(time_range, threshold_us=threshold_us)
+        )
+        for service, operation, count, avg_duration, max_duration in EsqlColumns.from_response(slow_data).rows(
+            "service.name", "transaction.name", "count", "avg_duration", "max_duration"
+        ):
+            performance_issues["slow_operations"].append({
+                "service": service,
+                "operation": operation,
+                "count": count,
+                "avg_duration_ms": avg_duration / 1000 if avg_duration else 0,
+                "max_duration_ms": max_duration / 1000 if max_duration else 0
+            })
         
         return performance_issues
     
@@ -424,40 +4366,64 @@ class ElasticOTELMCPServer:
             "utilization": {}
         }
         
-        # Get resource metrics
-        if resource_type == "cpu":
-            query = f"""
-            FROM metrics-*
-            | WHERE @timestamp >= NOW() - {time_range}
-            | STATS avg_cpu = AVG(system.cpu.utilization) BY host.name
-            | SORT avg_cpu DESC
-            """
-        elif resource_type == "memory":
-            query = f"""
-            FROM metrics-*
-            | WHERE @timestamp >= NOW() - {time_range}
-            | STATS avg_memory = AVG(system.memory.utilization) BY host.name
-            | SORT avg_memory DESC
-            """
-        else:
-            query = f"""
-            FROM metrics-*
-            | WHERE @timestamp >= NOW() - {time_range}
-            | STATS avg_utilization = AVG(system.{resource_type}.utilization) BY host.name
-            | SORT avg_utilization DESC
-            """
-        
-        utilization_data = await self.execute_esql_query(query, self.data_views['metrics'])
-        
-        if utilization_data.get("rows"):
-            for row in utilization_data["rows"]:
-                host = row[0]
-                utilization = row[1]
-                resource_data["utilization"][host] = {
-                    "value": utilization * 100 if utilization else 0,
-                    "unit": "percent",
-                    "status": "critical" if utilization > 0.9 else "warning" if utilization > 0.8 else "healthy"
-                }
+        # Validate before the field name reaches a query
+        query = ESQL_TEMPLATES["host_utilization"].bind(
+            time_range, identifiers={"resource_type": resource_type}, limit=HOST_ROW_LIMIT
+        )
+        value_column = "avg_utilization"
+        minutes = self.incremental_minutes(time_range)
+        row_limit = None
+        
+        async def utilization_rows() -> Iterator[Tuple[str, float]]:
+            nonlocal row_limit
+            totals = await self.series_window(f"metrics_by_host:{resource_type}", "metrics", minutes) if minutes else None
+            if totals is not None:
+                resource_data["resolution"] = self.resolution(self.data_views['metrics'], self.incremental_bucket(minutes))
+                return (
+                    (host, t["utilization_sum"] / t["utilization_count"])
+                    for host, t in totals.items() if t["utilization_count"]
+                )
+            
+            source = await self.router.metrics_source(query.window) if self.router is not None else None
+            host_query = query if source is None else ESQL_TEMPLATES["host_utilization"].bind(
+                time_range, identifiers={"resource_type": resource_type}, source=source, limit=HOST_ROW_LIMIT
+            )
+            resource_data["resolution"] = self.resolution(
+                source or self.data_views['metrics'], downsampled=source is not None
+            )
+            utilization_data = await self.execute_query(host_query)
+            columns = EsqlColumns.from_response(utilization_data)
+            if len(columns) >= HOST_ROW_LIMIT:
+                row_limit = HOST_ROW_LIMIT
+            return columns.rows("host.name", value_column)
+        
+        # Get resource metrics, and each host's own utilization baseline alongside
+        rows, baselines = await asyncio.gather(
+            utilization_rows(),
+            self.entity_baselines(
+                f"hosts:{resource_type}", "host_utilization_series", time_range, "host.name", "avg_utilization",
+                std_floor=0.02, identifiers={"resource_type": resource_type}
+            )
+        )
+        scores: Dict[str, Dict[str, Any]] = {}
+        if baselines is not None:
+            scores, resource_data["baseline"] = baselines
+        
+        # Only the worst hosts are kept while rows are decoded
+        worst = TopK(self.entry_limit())
+        for host, utilization in rows:
+            utilization = utilization or 0
+            value = utilization * 100
+            status = "critical" if utilization > 0.9 else "warning" if utilization > 0.8 else "healthy"
+            score = scores.get(host)
+            if score is not None and score["level"] is not None:
+                # Baselines only raise a status; the fixed utilization thresholds stay the floor
+                status = max(status, HOST_STATUSES[STATUS_LEVELS.index(score["level"])], key=HOST_STATUSES.index)
+            entry = HostUtilization(value, status, score)
+            worst.offer(entry.rank, (host, entry))
+        
+        resource_data["utilization"] = RankedEntries(worst.total, row_limit)
+        resource_data["utilization"].update(worst.items())
         
         return resource_data
     
@@ -471,34 +4437,101 @@ class ElasticOTELMCPServer:
             "bottlenecks": []
         }
         
-        # Get service dependencies
-        dependency_query = f"""
-        FROM traces-*
-        | WHERE @timestamp >= NOW() - {time_range}
-        {f'AND service.name = "{service_name}"' if service_name else ''}
-        | STATS call_count = COUNT(*) BY service.name, service.target.name
-        | WHERE service.target.name IS NOT NULL
-        | SORT call_count DESC
-        """
+        # Per-edge totals, from the incremental partials when the window allows
+        minutes = self.incremental_minutes(time_range)
+        totals = await self.series_window("dependencies", "traces", minutes) if minutes else None
+        source = "incremental"
+        row_limit = None
         
-        dependency_data = await self.execute_esql_query(dependency_query, self.data_views['traces'])
+        if totals is None and service_name:
+            source = "query"
+            totals, row_limit = await self.dependency_neighbourhood(time_range, service_name)
+        elif totals is None:
+            source = "query"
+            dependency_data = await self.execute_query(
+                ESQL_TEMPLATES["service_dependencies"].bind(time_range, limit=DEPENDENCY_EDGE_LIMIT)
+            )
+            columns = EsqlColumns.from_response(dependency_data)
+            if len(columns) >= DEPENDENCY_EDGE_LIMIT:
+                row_limit = DEPENDENCY_EDGE_LIMIT
+            totals = dict(self.dependency_totals(columns))
         
-        if dependency_data.get("rows"):
-            for row in dependency_data["rows"]:
-                source_service = row[0]
-                target_service = row[1]
-                call_count = row[2]
-                
-                if source_service not in trace_analysis["service_dependencies"]:
-                    trace_analysis["service_dependencies"][source_service] = []
-                
-                trace_analysis["service_dependencies"][source_service].append({
-                    "target": target_service,
-                    "call_count": call_count
-                })
+        graph = DependencyGraph.from_totals(totals)
+        trace_analysis["graph"] = {
+            "services": len(graph.services),
+            "edges": sum(len(targets) for targets in graph.downstream.values()),
+            "source": source
+        }
+        
+        # The busiest edges are listed as the graph's own records, serialized as written out
+        busiest = TopK(self.entry_limit())
+        for edge in graph.edges():
+            if not service_name or edge.source == service_name:
+                busiest.offer(edge.call_count, edge)
+        dependencies = trace_analysis["service_dependencies"] = RankedEntries(busiest.total, row_limit)
+        for edge in busiest.items():
+            dependencies.setdefault(edge.source, []).append(edge)
+        
+        critical_path = graph.critical_path(service_name if service_name in graph.downstream else None)
+        trace_analysis["critical_path"] = critical_path
+        
+        scope = None
+        if service_name:
+            downstream = graph.blast_radius(service_name, "downstream")
+            trace_analysis["blast_radius"] = {
+                "upstream": graph.blast_radius(service_name, "upstream"),
+                "downstream": downstream
+            }
+            scope = {service_name, *(entry["service"] for entry in downstream)}
+        
+        trace_analysis["bottlenecks"] = graph.bottlenecks(critical_path=critical_path["services"], services=scope)
         
         return trace_analysis
     
+    @staticmethod
+    def dependency_totals(columns: EsqlColumns) -> Iterator[Tuple[Tuple[Any, Any], Dict[str, Any]]]:
+        """(source, target) keys and DEPENDENCY_AGGREGATES values of dependency rows"""
+        names = list(DEPENDENCY_AGGREGATES)
+        for source_service, target_service, *values in columns.rows("service.name", "service.target.name", *names):
+            yield (source_service, target_service), dict(zip(names, values))
+    
+    async def dependency_neighbourhood(
+        self, time_range: str, service_name: str
+    ) -> Tuple[Dict[Tuple[Any, Any], Dict[str, Any]], Optional[int]]:
+        """Edge totals of everything a service calls and everything calling it, plus the row limit hit
+        
+        Walks outwards from the service one round at a time, filtering each
+        round's query to the services reached in the previous one, so the
+        cluster never aggregates edges outside the service's blast radius.
+        """
+        totals: Dict[Tuple[Any, Any], Dict[str, Any]] = {}
+        row_limit = None
+        seen = {"downstream": {service_name}, "upstream": {service_name}}
+        frontier = {"downstream": [service_name], "upstream": [service_name]}
+        for _ in range(DEPENDENCY_WALK_DEPTH):
+            directions = [direction for direction, services in frontier.items() if services]
+            if not directions:
+                break
+            pages = await asyncio.gather(*(
+                self.execute_query(ESQL_TEMPLATES[f"service_dependencies_{direction}"].bind(
+                    time_range, limit=DEPENDENCY_EDGE_LIMIT, services=frontier[direction]
+                ))
+                for direction in directions
+            ))
+            for direction, page in zip(directions, pages):
+                columns = EsqlColumns.from_response(page)
+                if len(columns) >= DEPENDENCY_EDGE_LIMIT:
+                    row_limit = DEPENDENCY_EDGE_LIMIT
+                reached = []
+                for edge, values in self.dependency_totals(columns):
+                    totals[edge] = values
+                    neighbour = edge[1] if direction == "downstream" else edge[0]
+                    if neighbour is not None and neighbour not in seen[direction]:
+                        seen[direction].add(neighbour)
+                        reached.append(neighbour)
+                frontier[direction] = reached
+        return totals, row_limit
+    
     async def get_code_recommendations(self, analysis_type: str, time_range: str) -> Dict[str, Any]:
         """Get specific code recommendations based on OTEL data"""
         recommendations = {
@@ -511,107 +4544,365 @@ class ElasticOTELMCPServer:
         if analysis_type == "performance":
             # Get performance recommendations
             performance_data = await self.get_performance_issues(time_range, 500)
-            for slow_op in performance_data.get("slow_operations", []):
-                recommendations["recommendations"].append({
-                    "type": "performance",
-                    "priority": "high" if slow_op["avg_duration_ms"] > 2000 else "medium",
-                    "service": slow_op["service"],
-                    "operation": slow_op["operation"],
-                    "issue": f"Slow operation: {slow_op['operation']} averaging {slow_op['avg_duration_ms']:.0f}ms",
-                    "suggestion": "Consider optimizing this operation, adding caching, or using async processing"
-                })
+            recommendations["recommendations"].extend(self.performance_recommendations(performance_data))
         
         elif analysis_type == "errors":
             # Get error recommendations
             error_data = await self.get_error_analysis(time_range)
-            for error in error_data.get("errors", [])[:5]:
-                recommendations["recommendations"].append({
-                    "type": "error",
-                    "priority": "high",
-                    "service": error["service"],
-                    "issue": f"Frequent error: {error['message']} ({error['count']} occurrences)",
-                    "suggestion": "Add proper error handling, validation, or fix the root cause"
-                })
+            recommendations["recommendations"].extend(self.error_recommendations(error_data))
         
         elif analysis_type == "resources":
             # Get resource recommendations
-            cpu_data = await self.get_resource_utilization(time_range, "cpu")
-            memory_data = await self.get_resource_utilization(time_range, "memory")
-            
-            for host, metrics in cpu_data.get("utilization", {}).items():
-                if metrics["status"] == "critical":
-                    recommendations["recommendations"].append({
-                        "type": "resource",
-                        "priority": "high",
-                        "host": host,
-                        "resource": "CPU",
-                        "issue": f"High CPU usage: {metrics['value']:.1f}%",
-                        "suggestion": "Consider scaling horizontally, optimizing CPU-intensive operations, or upgrading resources"
-                    })
-            
-            for host, metrics in memory_data.get("utilization", {}).items():
-                if metrics["status"] == "critical":
-                    recommendations["recommendations"].append({
-                        "type": "resource",
-                        "priority": "high",
-                        "host": host,
-                        "resource": "Memory",
-                        "issue": f"High memory usage: {metrics['value']:.1f}%",
-                        "suggestion": "Check for memory leaks, optimize memory usage, or increase available memory"
-                    })
+            cpu_data, memory_data = await asyncio.gather(
+                self.get_resource_utilization(time_range, "cpu"),
+                self.get_resource_utilization(time_range, "memory")
+            )
+            recommendations["recommendations"].extend(self.resource_recommendations(cpu_data, memory_data))
+        
+        return recommendations
+    
+    @staticmethod
+    def performance_recommendations(performance_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Recommendations for the slow operations of get_performance_issues"""
+        return [{
+            "type": "performance",
+            "priority": "high" if slow_op["avg_duration_ms"] > 2000 else "medium",
+            "service": slow_op["service"],
+            "operation": slow_op["operation"],
+            "issue": f"Slow operation: {slow_op['operation']} averaging {slow_op['avg_duration_ms']:.0f}ms",
+            "suggestion": "Consider optimizing this operation, adding caching, or using async processing"
+        } for slow_op in performance_data.get("slow_operations", [])]
+    
+    @staticmethod
+    def error_recommendations(error_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Recommendations for the most frequent errors of get_error_analysis"""
+        return [{
+            "type": "error",
+            "priority": "high",
+            "service": error["service"],
+            "issue": f"Frequent error: {error['message']} ({error['count']} occurrences)",
+            "suggestion": "Add proper error handling, validation, or fix the root cause"
+        } for error in error_data.get("errors", [])[:5]]
+    
+    @staticmethod
+    def resource_recommendations(cpu_data: Dict[str, Any], memory_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Recommendations for hosts whose CPU or memory utilization is critical"""
+        recommendations = []
+        for host, metrics in cpu_data.get("utilization", {}).items():
+            if metrics.status == "critical":
+                recommendations.append({
+                    "type": "resource",
+                    "priority": "high",
+                    "host": host,
+                    "resource": "CPU",
+                    "issue": f"High CPU usage: {metrics.value:.1f}%",
+                    "suggestion": "Consider scaling horizontally, optimizing CPU-intensive operations, or upgrading resources"
+                })
         
+        for host, metrics in memory_data.get("utilization", {}).items():
+            if metrics.status == "critical":
+                recommendations.append({
+                    "type": "resource",
+                    "priority": "high",
+                    "host": host,
+                    "resource": "Memory",
+                    "issue": f"High memory usage: {metrics.value:.1f}%",
+                    "suggestion": "Check for memory leaks, optimize memory usage, or increase available memory"
+                })
         return recommendations
     
+    async def get_incident_triage(
+        self,
+        time_range: str,
+        service_name: Optional[str] = None,
+        threshold_ms: int = 1000,
+    ) -> Dict[str, Any]:
+        """Health, errors, slow operations, resources and traces from one shared query plan"""
+        planner = SharedScanPlanner(self._execute_esql_query, self.max_subquery_concurrency)
+        token = shared_scans.set(planner)
+        try:
+            health, errors, performance, cpu, memory, traces = await asyncio.gather(
+                self.get_application_health(time_range),
+                self.get_error_analysis(time_range),
+                self.get_performance_issues(time_range, threshold_ms),
+                self.get_resource_utilization(time_range, "cpu"),
+                self.get_resource_utilization(time_range, "memory"),
+                self.get_trace_analysis(time_range, service_name)
+            )
+        finally:
+            shared_scans.reset(token)
+        
+        # With a service filter, keep that service and everything it calls
+        scope = None
+        if service_name:
+            scope = {service_name, *(entry["service"] for entry in traces.get("blast_radius", {}).get("downstream", []))}
+        
+        def in_scope(service: Optional[str]) -> bool:
+            return scope is None or service in scope
+        
+        services = {name: entry for name, entry in health.get("services", {}).items() if in_scope(name)}
+        triage = {
+            "timestamp": datetime.now().isoformat(),
+            "time_range": time_range,
+            "service_filter": service_name,
+            "overall_status": _overall_status(services),
+            "services": services,
+            "alerts": [alert for alert in health.get("alerts", []) if in_scope(alert["service"])],
+            "errors": [error for error in errors.get("errors", []) if in_scope(error["service"])],
+            "slow_operations": [op for op in performance.get("slow_operations", []) if in_scope(op["service"])],
+            "resources": {"cpu": cpu.get("utilization", {}), "memory": memory.get("utilization", {})},
+            "service_dependencies": traces.get("service_dependencies", {}),
+            "critical_path": traces.get("critical_path"),
+            "bottlenecks": traces.get("bottlenecks", [])
+        }
+        if "blast_radius" in traces:
+            triage["blast_radius"] = traces["blast_radius"]
+        
+        triage["recommendations"] = (
+            self.error_recommendations(triage)
+            + self.performance_recommendations(triage)
+            + self.resource_recommendations(cpu, memory)
+        )
+        triage["plan"] = planner.stats()
+        return triage
+    
+    def initialization_options(self) -> InitializationOptions:
+        """MCP initialization options shared by every transport"""
+        return InitializationOptions(
+            server_name="elastic-otel-mcp",
+            server_version="1.0.0",
+            capabilities=self.server.get_capabilities(
+                notification_options=type('NotificationOptions', (), {'tools_changed': False})(),
+                experimental_capabilities={}
+            ),
+        )
+    
     async def run(self):
         """Run the MCP server"""
-        async with stdio_server() as (read_stream, write_stream):
-            await self.server.run(
-                read_stream,
-                write_stream,
-                InitializationOptions(
-                    server_name="elastic-otel-mcp",
-                    server_version="1.0.0",
-                    capabilities=self.server.get_capabilities(
-                        notification_options=type('NotificationOptions', (), {'tools_changed': False})(),
-                        experimental_capabilities={}
-                    ),
-                ),
-            )
+        try:
+            self.start_background_tasks()
+            async with stdio_server() as (read_stream, write_stream):
+                await self.server.run(
+                    read_stream,
+                    write_stream,
+                    self.initialization_options(),
+                )
+        finally:
+            await self.close()
+    
+    def create_http_app(
+        self,
+        stateless: bool = False,
+        auth_token: Optional[str] = None,
+        enable_sse: bool = True,
+    ):
+        """ASGI app serving many MCP clients over streamable HTTP (/mcp) and SSE (/sse)
+        
+        Every session is handled by this server instance, so the HTTP client
+        pool, result cache and aggregates are shared across all clients.
+        """
+        from mcp.server.sse import SseServerTransport
+        from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+        from starlette.applications import Starlette
+        from starlette.middleware import Middleware
+        from starlette.responses import JSONResponse, Response
+        from starlette.routing import Mount, Route
+        
+        session_manager = StreamableHTTPSessionManager(app=self.server, stateless=stateless)
+        sse = SseServerTransport("/messages/")
+        
+        class StreamableHTTPEndpoint:
+            # A class instance makes Starlette pass the raw ASGI scope through
+            async def __call__(self, scope, receive, send):
+                await session_manager.handle_request(scope, receive, send)
+        
+        class BearerTokenMiddleware:
+            def __init__(self, app):
+                self.app = app
+            
+            async def __call__(self, scope, receive, send):
+                if auth_token and scope["type"] == "http" and scope["path"] != "/health":
+                    headers = dict(scope.get("headers") or [])
+                    expected = f"Bearer {auth_token}".encode()
+                    if not hmac.compare_digest(headers.get(b"authorization", b""), expected):
+                        await JSONResponse({"error": "Unauthorized"}, status_code=401)(scope, receive, send)
+                        return
+                await self.app(scope, receive, send)
+        
+        async def handle_sse(request):
+            async with sse.connect_sse(request.scope, request.receive, request._send) as (read_stream, write_stream):
+                await self.server.run(read_stream, write_stream, self.initialization_options())
+            return Response()
+        
+        async def health(request):
+            return JSONResponse({"status": "ok", "pid": os.getpid()})
+        
+        @contextlib.asynccontextmanager
+        async def lifespan(app):
+            async with session_manager.run():
+                self.start_background_tasks()
+                try:
+                    yield
+                finally:
+                    await self.close()
+        
+        routes = [
+            Route("/mcp", endpoint=StreamableHTTPEndpoint()),
+            Route("/health", endpoint=health, methods=["GET"]),
+        ]
+        if enable_sse:
+            routes += [
+                Route("/sse", endpoint=handle_sse, methods=["GET"]),
+                Mount("/messages/", app=sse.handle_post_message),
+            ]
+        
+        return Starlette(
+            routes=routes,
+            middleware=[Middleware(BearerTokenMiddleware)],
+            lifespan=lifespan,
+        )
+    
+    async def run_http(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        stateless: bool = False,
+        auth_token: Optional[str] = None,
+        sock: Optional[socket.socket] = None,
+        enable_sse: bool = True,
+    ):
+        """Run the MCP server over streamable HTTP/SSE"""
+        import uvicorn
+        
+        config = uvicorn.Config(
+            self.create_http_app(stateless, auth_token, enable_sse),
+            host=host,
+            port=port,
+            log_level=os.getenv('LOG_LEVEL', 'info').lower(),
+        )
+        await uvicorn.Server(config).serve(sockets=[sock] if sock else None)
+
+def _http_worker(
+    elastic_endpoint: str,
+    api_key: str,
+    settings: Dict[str, Any],
+    sock: socket.socket,
+    auth_token: Optional[str],
+):
+    """Entry point of one HTTP worker process"""
+    server = ElasticOTELMCPServer(elastic_endpoint, api_key, **settings)
+    # SSE streams and their POSTed messages could land on different workers
+    asyncio.run(server.run_http(stateless=True, auth_token=auth_token, sock=sock, enable_sse=False))
+
+def serve_http_workers(
+    elastic_endpoint: str,
+    api_key: str,
+    settings: Dict[str, Any],
+    host: str,
+    port: int,
+    workers: int,
+    auth_token: Optional[str] = None,
+):
+    """Serve HTTP from several worker processes sharing one listening socket
+    
+    Workers run in stateless mode without the SSE endpoints because an MCP
+    session cannot follow a client from one process to another. Only the
+    first worker prefetches, so background refreshes do not multiply with
+    the worker count; the others answer those calls live.
+    """
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=_http_worker,
+            args=(elastic_endpoint, api_key, settings if i == 0 else {**settings, "prefetch": False}, sock, auth_token),
+            name=f"elastic-otel-mcp-worker-{i}",
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    finally:
+        sock.close()
 
 def main():
     """Main entry point"""
     import sys
-    import os
+    
+    settings = settings_from_env()
     
     # Try to get credentials from environment variables first
     elastic_endpoint = os.getenv('ELASTIC_ENDPOINT')
     api_key = os.getenv('ELASTIC_API_KEY')
     
+    # In federated mode the first endpoint also serves index resolution probes
+    if (not elastic_endpoint or not api_key) and settings["endpoints"] and len(sys.argv) != 3:
+        elastic_endpoint = settings["endpoints"][0]["endpoint"]
+        api_key = settings["endpoints"][0]["api_key"]
+    
     # If not in environment, try command line arguments
     if not elastic_endpoint or not api_key:
         if len(sys.argv) != 3:
-            print("Usage: python elastic-otel-mcp-server.py <elastic-endpoint> <api-key>")
-            print("Or set environment variables: ELASTIC_ENDPOINT and ELASTIC_API_KEY")
-            print("Example: python elastic-otel-mcp-server.py https://your-endpoint.kb.us-east-1.aws.elastic.cloud your-api-key")
+            print("Usage: python elastic-otel-mcp-server.py <elastic-endpoint> <api-key>", file=sys.stderr)
+            print("Or set environment variables: ELASTIC_ENDPOINT and ELASTIC_API_KEY", file=sys.stderr)
+            print("Example: python elastic-otel-mcp-server.py https://your-endpoint.kb.us-east-1.aws.elastic.cloud your-api-key", file=sys.stderr)
             sys.exit(1)
         
         elastic_endpoint = sys.argv[1]
         api_key = sys.argv[2]
     
-    server = ElasticOTELMCPServer(elastic_endpoint, api_key)
+    transport = os.getenv('MCP_TRANSPORT', 'stdio').lower()
+    host = os.getenv('MCP_HTTP_HOST', '127.0.0.1')
+    port = int(os.getenv('MCP_HTTP_PORT', '8000'))
+    workers = int(os.getenv('MCP_HTTP_WORKERS', '1'))
+    auth_token = os.getenv('MCP_HTTP_AUTH_TOKEN')
     
-    print("🚀 Starting Elastic OTEL MCP Server...")
-    print(f"📊 Connecting to: {elastic_endpoint}")
-    print("🎯 Available tools:")
-    print("  - get_application_health")
-    print("  - get_service_metrics")
-    print("  - get_error_analysis")
-    print("  - get_performance_issues")
-    print("  - get_resource_utilization")
-    print("  - get_trace_analysis")
-    print("  - get_code_recommendations")
+    print("🚀 Starting Elastic OTEL MCP Server...", file=sys.stderr)
+    if settings["endpoints"]:
+        print(f"📊 Federating across: {', '.join(endpoint['name'] for endpoint in settings['endpoints'])}", file=sys.stderr)
+    else:
+        print(f"📊 Connecting to: {elastic_endpoint}", file=sys.stderr)
+    print("🎯 Available tools:", file=sys.stderr)
+    print("  - get_application_health", file=sys.stderr)
+    print("  - get_service_metrics", file=sys.stderr)
+    print("  - get_error_analysis", file=sys.stderr)
+    print("  - get_performance_issues", file=sys.stderr)
+    print("  - get_resource_utilization", file=sys.stderr)
+    print("  - get_trace_analysis", file=sys.stderr)
+    print("  - get_code_recommendations", file=sys.stderr)
+    print("  - get_incident_triage", file=sys.stderr)
+    print("  - get_server_stats", file=sys.stderr)
     
-    asyncio.run(server.run())
+    if transport == "stdio":
+        server = ElasticOTELMCPServer(elastic_endpoint, api_key, **settings)
+        asyncio.run(server.run())
+    elif transport == "http":
+        print(f"🌐 Serving MCP on http://{host}:{port}/mcp (streamable HTTP) and /sse (SSE)", file=sys.stderr)
+        if workers > 1:
+            print(f"👥 Workers: {workers} (stateless sessions, SSE disabled)", file=sys.stderr)
+            serve_http_workers(elastic_endpoint, api_key, settings, host, port, workers, auth_token)
+        else:
+            server = ElasticOTELMCPServer(elastic_endpoint, api_key, **settings)
+            asyncio.run(server.run_http(
+                host, port, _env_bool('MCP_HTTP_STATELESS'), auth_token
+            ))
+    else:
+        print(f"Unknown MCP_TRANSPORT: {transport} (expected stdio or http)", file=sys.stderr)
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -56,6 +56,8 @@ echo "  - get_performance_issues: Identify performance bottlenecks"
 echo "  - get_resource_utilization: Monitor CPU, memory, and resource usage"
 echo "  - get_trace_analysis: Analyze distributed traces"
 echo "  - get_code_recommendations: Get optimization recommendations"
+echo "  - get_incident_triage: Health, errors, slow operations, resources and traces in one call"
+echo "  - get_server_stats: Get the MCP server's own latency and traffic statistics"
 echo ""
 echo "🔧 Starting MCP Server..."
 echo ""
@@ -0,0 +1,29 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+SERVER_PATH = Path(__file__).resolve().parent.parent / "elastic-otel-mcp-server.py"
+
+
+def load_server_module():
+    """Import elastic-otel-mcp-server.py despite the hyphenated file name"""
+    name = "elastic_otel_mcp_server"
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, SERVER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def server():
+    return load_server_module()
+
+
+def response(columns, rows):
+    """Row-major ES|QL response with the given column names"""
+    return {"columns": [{"name": name, "type": "keyword"} for name in columns], "values": [list(row) for row in rows]}
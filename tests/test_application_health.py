@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+import httpx
+
+from conftest import response
+
+ERROR_RATES = {"checkout": 0.3, "payments": 0.1, "frontend": 0.01}
+
+
+def health_server(server, error_rates=ERROR_RATES):
+    """Server whose traces answer with fixed error rates and no baseline series"""
+    instance = server.ElasticOTELMCPServer("http://elastic.invalid", "key", cache_size=0)
+
+    async def execute(query, data_view, **kwargs):
+        if "BUCKET" in query:
+            return {"error": "unavailable"}
+        if "error_rate" in query:
+            return response(["error_rate", "count", "service.name"], [[rate, 100, name] for name, rate in error_rates.items()])
+        return response(["avg_response_time", "duration_count", "service.name"], [[1000, 100, name] for name in error_rates])
+
+    instance.execute_esql_query = execute
+    return instance
+
+
+def test_statuses_follow_the_absolute_error_rate_thresholds(server):
+    health = asyncio.run(health_server(server).get_application_health("15m"))
+    assert {name: entry["status"] for name, entry in health["services"].items()} == {
+        "checkout": "critical", "payments": "degraded", "frontend": "healthy"
+    }
+    assert health["overall_status"] == "critical"
+    assert health["alerts"] == [{"service": "checkout", "message": "High error rate for checkout: 30.00%"}]
+
+
+def test_overall_status_is_the_worst_service_status(server):
+    health = asyncio.run(health_server(server, {"frontend": 0.01, "payments": 0.1}).get_application_health("15m"))
+    assert health["overall_status"] == "degraded"
+    assert asyncio.run(health_server(server, {}).get_application_health("15m"))["overall_status"] == "unknown"
+
+
+def test_baselines_only_raise_a_status(server):
+    instance = health_server(server)
+    levels = {"checkout": "normal", "payments": "normal", "frontend": "anomalous"}
+
+    async def entity_baselines(*args, **kwargs):
+        scores = {
+            name: {"level": level, "current": ERROR_RATES[name], "baseline_mean": 0.01, "z_score": 4.0}
+            for name, level in levels.items()
+        }
+        return scores, {"method": "zscore"}
+
+    instance.entity_baselines = entity_baselines
+    health = asyncio.run(instance.get_application_health("15m"))
+    assert {name: entry["status"] for name, entry in health["services"].items()} == {
+        "checkout": "critical", "payments": "degraded", "frontend": "critical"
+    }
+    assert [alert["service"] for alert in health["alerts"]] == ["checkout", "frontend"]
+
+
+def test_host_baselines_only_raise_a_status(server):
+    instance = server.ElasticOTELMCPServer("http://elastic.invalid", "key", cache_size=0)
+    utilization = {"db-1": 0.95, "web-1": 0.85, "web-2": 0.2}
+
+    async def execute_query(query):
+        return response(["avg_utilization", "host.name"], [[value, host] for host, value in utilization.items()])
+
+    async def entity_baselines(*args, **kwargs):
+        return {host: {"level": "normal" if host != "web-2" else "anomalous"} for host in utilization}, {}
+
+    instance.execute_query = execute_query
+    instance.entity_baselines = entity_baselines
+    result = asyncio.run(instance.get_resource_utilization("15m"))
+    assert {host: entry.status for host, entry in result["utilization"].items()} == {
+        "db-1": "critical", "web-1": "warning", "web-2": "critical"
+    }
+
+
+def test_clusters_without_sample_fall_back_to_unsampled_scans(server):
+    queries = []
+
+    def handler(request):
+        query = json.loads(request.content)["query"]
+        queries.append(query)
+        if "| SAMPLE" in query:
+            return httpx.Response(400, json={"error": {"type": "parsing_exception", "reason": "mismatched input 'SAMPLE'"}})
+        if "error_rate" in query:
+            return httpx.Response(200, json=response(["error_rate", "count", "service.name"], [[0.1, 10, "checkout"]]))
+        return httpx.Response(200, json=response(["avg_response_time", "duration_count", "service.name"], [[10, 10, "checkout"]]))
+
+    instance = server.ElasticOTELMCPServer("http://elastic.invalid", "key", cache_size=0, resolution_routing=True)
+    instance._client = httpx.AsyncClient(base_url="http://elastic.invalid", transport=httpx.MockTransport(handler))
+    health = asyncio.run(instance.get_application_health("1d"))
+    assert health["services"]["checkout"]["status"] == "degraded"
+    assert health["resolution"].get("sample_rate", 1.0) == 1.0
+    assert instance.router.sampling is False
+
+    sampled = len([query for query in queries if "| SAMPLE" in query])
+    asyncio.run(instance.get_application_health("1d"))
+    assert len([query for query in queries if "| SAMPLE" in query]) == sampled
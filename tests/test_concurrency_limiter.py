@@ -0,0 +1,34 @@
+import asyncio
+
+
+def test_growing_limit_wakes_waiting_requests(server):
+    async def scenario():
+        limiter = server.AdaptiveConcurrencyLimiter(initial=1, maximum=4)
+        entered, release = asyncio.Event(), asyncio.Event()
+
+        async def waiter():
+            async with limiter:
+                entered.set()
+                await release.wait()
+
+        async with limiter:
+            task = asyncio.ensure_future(waiter())
+            await asyncio.sleep(0.01)
+            assert not entered.is_set()
+            await limiter.on_success()
+            # The waiter gets the new slot while the first request is still running
+            await asyncio.wait_for(entered.wait(), timeout=1)
+            assert limiter.in_flight == 2
+        release.set()
+        await task
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert limiter.in_flight == 0 and int(limiter.limit) == 2
+
+
+def test_overload_cuts_the_limit_once_per_cooldown(server):
+    limiter = server.AdaptiveConcurrencyLimiter(initial=8, cooldown=60)
+    limiter.on_overload()
+    limiter.on_overload()
+    assert int(limiter.limit) == 4 and limiter.overloads == 1
@@ -0,0 +1,79 @@
+import asyncio
+
+from conftest import response
+
+
+def totals(server, call_count, duration_ms=10.0, **overrides):
+    values = {
+        "call_count": call_count,
+        "duration_sum": duration_ms * 1000 * call_count,
+        "max_duration": duration_ms * 1000,
+        **{f"le_{bound}ms": call_count if bound >= duration_ms else 0 for bound in server.LATENCY_BUCKETS_MS},
+    }
+    values.update(overrides)
+    return values
+
+
+def test_edges_carry_counts_and_latency(server):
+    graph = server.DependencyGraph.from_totals({
+        ("frontend", "checkout"): totals(server, 4, 20.0),
+        ("checkout", "payments"): totals(server, 2, 200.0),
+    })
+    assert sorted(graph.services) == ["checkout", "frontend", "payments"]
+    edge = graph.downstream["frontend"]["checkout"]
+    assert edge.call_count == 4
+    assert edge.latency.count == 4
+    assert edge.as_json()["avg_latency_ms"] == 20.0
+    assert graph.upstream["checkout"]["frontend"] is edge
+
+
+def test_self_calls_and_missing_services_are_skipped(server):
+    graph = server.DependencyGraph.from_totals({
+        ("frontend", "frontend"): totals(server, 3),
+        (None, "checkout"): totals(server, 3),
+        ("frontend", None): totals(server, 3),
+    })
+    assert list(graph.edges()) == []
+
+
+def test_null_aggregates_count_as_zero(server):
+    graph = server.DependencyGraph.from_totals({
+        ("frontend", "checkout"): {"call_count": 5, "duration_sum": None, "max_duration": None},
+        ("checkout", "payments"): {**totals(server, 0), "call_count": None, "le_5ms": None},
+    })
+    edge = graph.downstream["frontend"]["checkout"]
+    assert edge.call_count == 5
+    assert edge.as_json()["avg_latency_ms"] == 0.0
+    assert graph.downstream["checkout"]["payments"].call_count == 0
+
+
+def test_blast_radius_follows_edges(server):
+    graph = server.DependencyGraph.from_totals({
+        ("frontend", "checkout"): totals(server, 4),
+        ("checkout", "payments"): totals(server, 2),
+    })
+    downstream = graph.blast_radius("frontend")
+    assert [(entry["service"], entry["depth"]) for entry in downstream] == [("checkout", 1), ("payments", 2)]
+    assert [entry["service"] for entry in graph.blast_radius("payments", "upstream")] == ["checkout", "frontend"]
+
+
+def test_service_filter_walks_the_graph_with_named_params(server):
+    edges = [("frontend", "checkout"), ("checkout", "payments"), ("payments", "bank"), ("ads", "catalog")]
+    names = list(server.DEPENDENCY_AGGREGATES)
+    queries = []
+
+    async def execute_query(query):
+        queries.append(query)
+        services = {value for param in query.params for name, value in param.items() if name.startswith("services_")}
+        side = 0 if query.template == "service_dependencies_downstream" else 1
+        rows = [[*edge, *(totals(server, 3)[name] for name in names)] for edge in edges if edge[side] in services]
+        return response(["service.name", "service.target.name", *names], rows)
+
+    instance = server.ElasticOTELMCPServer("http://elastic.invalid", "key", cache_size=0)
+    instance.execute_query = execute_query
+    result = asyncio.run(instance.get_trace_analysis("15m", "checkout"))
+    assert all("checkout" not in query.query for query in queries)
+    assert {query.template for query in queries} == {"service_dependencies_downstream", "service_dependencies_upstream"}
+    assert result["graph"]["edges"] == 3
+    assert [entry["service"] for entry in result["blast_radius"]["downstream"]] == ["payments", "bank"]
+    assert [entry["service"] for entry in result["blast_radius"]["upstream"]] == ["frontend"]
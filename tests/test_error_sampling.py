@@ -0,0 +1,46 @@
+import asyncio
+import random
+import re
+
+from conftest import response
+
+# Ten error logs, several sharing a timestamp across page boundaries
+LOGS = [
+    ("2026-01-01T00:00:05.000Z", f"payment {index} declined") for index in range(4)
+] + [
+    ("2026-01-01T00:00:04.000Z", f"payment {index} declined") for index in range(4, 7)
+] + [
+    ("2026-01-01T00:00:01.000Z", f"payment {index} declined") for index in range(7, 10)
+]
+
+
+def fake_logs(seed):
+    """Executor answering log sample pages, with ties in arbitrary order as Elastic may return them"""
+    shuffle = random.Random(seed)
+    pages = []
+
+    async def execute_query(query):
+        bound = {name: value for param in query.params for name, value in param.items()}
+        if query.template == "error_counts":
+            return response(["error_count", "service.name"], [[len(LOGS), "checkout"]])
+        rows = [row for row in LOGS if "before" not in bound or row[0] <= bound["before"]]
+        shuffle.shuffle(rows)
+        rows.sort(key=lambda row: row[0], reverse=True)
+        rows = rows[:int(re.search(r"LIMIT (\d+)", query.query).group(1))]
+        pages.append(len(rows))
+        return response(["@timestamp", "service.name", "message"], [[ts, "checkout", message] for ts, message in rows])
+
+    return execute_query, pages
+
+
+def test_pages_neither_skip_nor_repeat_rows_at_the_boundary(server):
+    for seed in range(5):
+        instance = server.ElasticOTELMCPServer(
+            "http://elastic.invalid", "key", cache_size=0, log_templates=True, log_page_size=3, log_sample_size=100
+        )
+        instance.execute_query, pages = fake_logs(seed)
+        result = asyncio.run(instance.get_error_analysis("15m"))
+        assert result["templates"]["messages"] == len(LOGS)
+        assert result["templates"]["complete"] is True
+        assert sum(error["sampled_count"] for error in result["errors"]) == len(LOGS)
+        assert len(pages) > 2
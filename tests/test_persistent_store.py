@@ -0,0 +1,9 @@
+def test_size_cap_evicts_only_enough_results_sharing_a_timestamp(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(server.time, "time", lambda: 1000.0)
+    store = server.PersistentStore(str(tmp_path / "store.db"), max_bytes=1000)
+    for index in range(32):
+        store.put_result((f"FROM traces-* | LIMIT {index}", "traces"), {"values": ["x" * 80]})
+    size = store._run(lambda connection: connection.execute("SELECT SUM(size), COUNT(*) FROM results").fetchone())
+    assert size[0] <= 1000
+    assert size[1] == store.writes - store.evictions
+    assert size[1] >= 1000 // 100
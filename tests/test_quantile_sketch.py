@@ -0,0 +1,75 @@
+import asyncio
+import math
+import random
+import time
+
+from conftest import response
+
+
+def test_quantiles_are_within_the_relative_accuracy(server):
+    values = sorted(random.Random(1).lognormvariate(10, 1) for _ in range(20000))
+    sketch = server.QuantileSketch(0.02)
+    for value in values:
+        sketch.add(value)
+    for q in (0.5, 0.95, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) / exact <= 0.021
+
+
+def test_merged_sketches_match_one_sketch_of_all_values(server):
+    values = [random.Random(2).lognormvariate(8, 1) for _ in range(5000)]
+    whole, first, second = (server.QuantileSketch(0.05) for _ in range(3))
+    for value in values:
+        whole.add(value)
+    for value in values[:2000]:
+        first.add(value)
+    for value in values[2000:]:
+        second.add(value)
+    assert first.merge(second).quantile(0.95) == whole.quantile(0.95)
+
+
+def test_group_latency_totals_bins_and_slow_transactions(server):
+    latency = server.GroupLatency(0.05, slow_threshold=1000)
+    sketch = server.QuantileSketch(0.05)
+    fast, slow = math.ceil(math.log(100, sketch.gamma)), math.ceil(math.log(5000, sketch.gamma))
+    latency.add_bin(fast, {"count": 10, "error_count": 1, "duration_sum": 1000, "duration_count": 10, "max_duration": 120})
+    latency.add_bin(slow, {"count": 2, "error_count": 2, "duration_sum": 10000, "duration_count": 2, "max_duration": 5100})
+    assert (latency.count, latency.error_count, latency.duration_count) == (12, 3, 12)
+    assert (latency.slow_count, latency.slow_duration_sum, latency.slow_max_duration) == (2, 10000, 5100)
+    assert latency.sketch.count == 12
+
+
+def test_scoped_series_are_evicted_by_last_use(server, monkeypatch):
+    monkeypatch.setattr(server, "SCOPED_SERIES_LIMIT", 2)
+    instance = server.ElasticOTELMCPServer("http://elastic.invalid", "key")
+    first = instance.series("latency_by_service", 60, ["a"])
+    instance.series("latency_by_service", 60, ["b"])
+    assert instance.series("latency_by_service", 60, ["a"]) is first
+    instance.series("latency_by_service", 60, ["c"])
+    assert instance.series("latency_by_service", 60, ["a"]) is first
+    assert len([key for key in instance.incremental_series if key.endswith("]")]) == 2
+
+
+def test_service_metrics_come_from_one_binned_scan_without_incremental_mode(server):
+    queries = []
+    minute = int(time.time() // 60) * 60000
+
+    async def execute(query, data_view, no_cache=False, params=None, template=None, window=None):
+        queries.append(query)
+        if "duration_bin" in query:
+            return response(
+                ["count", "error_count", "duration_sum", "duration_count", "max_duration", "minute",
+                 "service.name", "duration_bin"],
+                [[4, 1, 4000, 4, 1500, minute, "checkout", 70], [1, 0, 90000, 1, 90000, minute, "checkout", 114]]
+            )
+        return response(["avg_cpu", "avg_memory", "service.name"], [[0.5, 0.25, "checkout"]])
+
+    instance = server.ElasticOTELMCPServer("http://elastic.invalid", "key", cache_size=0)
+    instance.execute_esql_query = execute
+    result = asyncio.run(instance.get_services_metrics(["checkout"], "1h"))
+    transactions = result["services"]["checkout"]["metrics"]["transactions"]
+    assert (transactions["count"], transactions["errors"]) == (5, 1)
+    assert transactions["avg_duration_ms"] == 18.8
+    assert result["latency"]["count"] == 5
+    assert not any("PERCENTILE" in query for query in queries)
+    assert len([query for query in queries if "duration_bin" in query]) == 1
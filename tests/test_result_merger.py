@@ -0,0 +1,52 @@
+from conftest import response
+
+
+def rows(result):
+    return [list(row) for row in zip(*result["values"])]
+
+
+def test_sums_counts_and_keeps_extremes(server):
+    merger = server.EsqlResultMerger("""FROM traces-*
+| STATS count = COUNT(*), total = SUM(x), top = MAX(x), low = MIN(x) BY service.name""")
+    merged = merger.merge([
+        response(["count", "total", "top", "low", "service.name"], [[2, 10, 7, 1, "a"], [1, 4, 4, 4, "b"]]),
+        response(["count", "total", "top", "low", "service.name"], [[3, 5, 9, 0, "a"]]),
+    ])
+    assert sorted(rows(merged), key=lambda row: row[-1]) == [[5, 15, 9, 0, "a"], [1, 4, 4, 4, "b"]]
+    assert merger.approximate == []
+
+
+def test_weights_averages_by_their_count(server):
+    merger = server.EsqlResultMerger("""FROM traces-*
+| STATS avg_duration = AVG(d), duration_count = COUNT(d) BY service.name""")
+    merged = merger.merge([
+        response(["avg_duration", "duration_count", "service.name"], [[10.0, 1, "a"]]),
+        response(["avg_duration", "duration_count", "service.name"], [[20.0, 3, "a"]]),
+    ])
+    assert rows(merged) == [[17.5, 4, "a"]]
+
+
+def test_percentiles_are_approximate(server):
+    merger = server.EsqlResultMerger("""FROM traces-*
+| STATS p95 = PERCENTILE(d, 95), n = COUNT(*) BY service.name""")
+    assert merger.approximate == ["p95"]
+
+
+def test_sort_and_limit_are_applied_after_merging(server):
+    merger = server.EsqlResultMerger("""FROM traces-*
+| STATS count = COUNT(*) BY service.name
+| SORT count DESC
+| LIMIT 2""")
+    merged = merger.merge([
+        response(["count", "service.name"], [[1, "a"], [5, "b"], [None, "d"]]),
+        response(["count", "service.name"], [[3, "c"], [1, "a"]]),
+    ])
+    assert rows(merged) == [[5, "b"], [3, "c"]]
+
+
+def test_queries_without_stats_are_concatenated(server):
+    merger = server.EsqlResultMerger("""FROM logs-*
+| KEEP message
+| LIMIT 3""")
+    merged = merger.merge([response(["message"], [["x"], ["y"]]), response(["message"], [["z"], ["w"]])])
+    assert rows(merged) == [["x"], ["y"], ["z"]]
@@ -0,0 +1,123 @@
+import asyncio
+
+from conftest import response
+
+ERRORS = """FROM traces-*
+| WHERE @timestamp >= NOW() - 15 minutes
+| STATS count = COUNT(*), error_count = SUM(CASE WHEN transaction.result = "error" THEN 1 ELSE 0 END) BY service.name
+| SORT error_count DESC"""
+LATENCY = """FROM traces-*
+| WHERE @timestamp >= NOW() - 15 minutes
+| STATS count = COUNT(transaction.duration.us), latency = AVG(transaction.duration.us) BY service.name
+| SORT latency DESC
+| LIMIT 1"""
+HOSTS = """FROM metrics-*
+| WHERE @timestamp >= NOW() - 15 minutes
+| STATS cpu = AVG(system.cpu.utilization) BY host.name"""
+
+
+class FakeElastic:
+    """Executor answering every query with a fixed number of groups"""
+
+    def __init__(self, server, groups=3):
+        self.server = server
+        self.groups = groups
+        self.queries = []
+
+    async def __call__(self, query, data_view, params=None, template=None, window=None):
+        self.queries.append(query)
+        _, aggregates, by = self.server.SharedScanPlanner.shape(query)
+        names = [name for name, _ in aggregates] + [by]
+        # Later groups score higher, so a caller's SORT is visible
+        values = [
+            [(index + 1) * (group + 1) for index in range(len(aggregates))] + [f"{by}-{group}"]
+            for group in range(self.groups)
+        ]
+        return response(names, values)
+
+
+def run(planner, *queries):
+    async def submit_all():
+        return await asyncio.wait_for(
+            asyncio.gather(*(planner.submit(query, "traces-*") for query in queries)), timeout=5
+        )
+    return asyncio.run(submit_all())
+
+
+def rows(server, result):
+    return list(server.EsqlColumns.from_response(result).rows(*(column["name"] for column in result["columns"])))
+
+
+def test_identical_queries_run_once(server):
+    fake = FakeElastic(server)
+    planner = server.SharedScanPlanner(fake)
+    first, second = run(planner, ERRORS, ERRORS)
+    assert len(fake.queries) == 1
+    assert first is second
+    assert planner.stats()["deduplicated"] == 1
+
+
+def test_same_scan_is_merged_and_projected(server):
+    fake = FakeElastic(server)
+    planner = server.SharedScanPlanner(fake)
+    errors, latency = run(planner, ERRORS, LATENCY)
+    assert len(fake.queries) == 1
+    assert "| LIMIT 10000" in fake.queries[0]
+    assert planner.stats()["merged"] == 1
+
+    # Each caller gets only its own columns, under its own names, sorted and limited as it asked
+    assert [column["name"] for column in errors["columns"]] == ["count", "error_count", "service.name"]
+    assert [row[-1] for row in rows(server, errors)] == ["service.name-2", "service.name-1", "service.name-0"]
+    assert [column["name"] for column in latency["columns"]] == ["count", "latency", "service.name"]
+    assert len(rows(server, latency)) == 1
+
+
+def test_clashing_aggregate_names_are_aliased(server):
+    fake = FakeElastic(server)
+    planner = server.SharedScanPlanner(fake)
+    errors, latency = run(planner, ERRORS, LATENCY)
+    merged = fake.queries[0]
+    assert "count = COUNT(*)" in merged and "count_1 = COUNT(transaction.duration.us)" in merged
+    assert rows(server, errors)[0][0] != rows(server, latency)[0][0]
+
+
+def test_repeated_clashes_find_a_free_alias(server):
+    queries = [ERRORS.replace("COUNT(*)", f"COUNT(field_{index})") for index in range(4)]
+    fake = FakeElastic(server)
+    planner = server.SharedScanPlanner(fake)
+    results = run(planner, *queries)
+    assert len(fake.queries) == 1
+    for alias in ("count", "count_1", "count_2", "count_3"):
+        assert f"{alias} = COUNT(field_" in fake.queries[0]
+    counts = []
+    for result in results:
+        assert sorted(column["name"] for column in result["columns"]) == ["count", "error_count", "service.name"]
+        counts.append(tuple(server.EsqlColumns.from_response(result).column("count")))
+    assert len(set(counts)) == len(queries)
+
+
+def test_different_scans_are_not_merged(server):
+    fake = FakeElastic(server)
+    planner = server.SharedScanPlanner(fake)
+    run(planner, ERRORS, HOSTS)
+    assert len(fake.queries) == 2
+    assert planner.stats()["merged"] == 0
+
+
+def test_full_merged_scan_runs_queries_separately(server):
+    fake = FakeElastic(server, groups=server.SHARED_SCAN_ROW_LIMIT)
+    planner = server.SharedScanPlanner(fake)
+    errors, latency = run(planner, ERRORS, LATENCY)
+    assert len(fake.queries) == 3
+    assert fake.queries[1:] == [ERRORS, LATENCY]
+    assert planner.stats()["merged"] == 0
+    assert len(rows(server, latency)) == server.SHARED_SCAN_ROW_LIMIT
+
+
+def test_errors_reach_every_caller(server):
+    async def failing(query, data_view, params=None, template=None, window=None):
+        return {"error": "boom"}
+
+    planner = server.SharedScanPlanner(failing)
+    errors, latency = run(planner, ERRORS, LATENCY)
+    assert errors == latency == {"error": "boom"}
@@ -0,0 +1,118 @@
+import asyncio
+import re
+import time
+from datetime import datetime
+
+import pytest
+
+from conftest import response
+
+
+def minute_of(timestamp):
+    return int(datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp() // 60)
+
+
+class FakeSeries:
+    """Executor returning one row per minute and group, cut at the query's LIMIT"""
+
+    def __init__(self, groups=("a", "b"), fail=False):
+        self.groups = groups
+        self.fail = fail
+        self.calls = []
+
+    async def __call__(self, query, data_view, no_cache=False, params=None, template=None, window=None):
+        bound = {name: value for param in params for name, value in param.items()}
+        self.calls.append({"bound": bound, "no_cache": no_cache, "query": query})
+        if self.fail:
+            return {"error": "unavailable"}
+        start = minute_of(bound["start"])
+        end = minute_of(bound["end"]) if "end" in bound else int(time.time() // 60) + 1
+        rows = [
+            [minute * 60000, group, 1, minute % 7]
+            for minute in range(start, end) for group in self.groups
+        ]
+        limit = int(re.search(r"\| LIMIT (\d+)", query).group(1))
+        return response(["minute", "service.name", "count", "max_value"], rows[:limit])
+
+
+def aggregator(server, **options):
+    return server.SlidingWindowAggregator(
+        "traces-*", "service.name", {"count": "COUNT(*)", "max_value": "MAX(x)"}, name="test", **options
+    )
+
+
+def test_totals_sum_counts_and_merge_maxima(server):
+    series = aggregator(server)
+    totals = asyncio.run(series.window(10, FakeSeries(), "traces-*"))
+    assert set(totals) == {"a", "b"}
+    # The window is widened to whole minutes, up to and including the current one
+    assert totals["a"]["count"] == 11
+    assert totals["a"]["max_value"] == 6
+
+
+def test_repeat_window_only_fetches_unsettled_minutes(server):
+    fake = FakeSeries()
+    series = aggregator(server, settle_minutes=2)
+    asyncio.run(series.window(30, fake, "traces-*"))
+    asyncio.run(series.window(30, fake, "traces-*"))
+    first, second = (minute_of(call["bound"]["start"]) for call in fake.calls)
+    assert second - first >= 27
+
+
+def test_refreshes_bypass_the_result_cache(server):
+    fake = FakeSeries()
+    asyncio.run(aggregator(server).window(5, fake, "traces-*"))
+    assert all(call["no_cache"] for call in fake.calls)
+    assert all("| LIMIT 10000" in call["query"] for call in fake.calls)
+
+
+def test_full_pages_are_split_until_they_fit(server):
+    fake = FakeSeries()
+    series = aggregator(server, limit=8)
+    totals = asyncio.run(series.window(10, fake, "traces-*"))
+    assert len(fake.calls) > 1
+    assert totals["a"]["count"] == totals["b"]["count"] == 11
+
+
+def test_overflowing_bucket_fails_and_backs_off(server):
+    fake = FakeSeries(groups=("a", "b", "c"))
+    series = aggregator(server, limit=3)
+    assert asyncio.run(series.window(5, fake, "traces-*")) is None
+    assert series.covered_from is None
+    calls = len(fake.calls)
+    assert asyncio.run(series.window(5, fake, "traces-*")) is None
+    assert len(fake.calls) == calls
+
+
+def test_query_errors_leave_nothing_covered(server):
+    series = aggregator(server)
+    assert asyncio.run(series.window(5, FakeSeries(fail=True), "traces-*")) is None
+    assert series.covered_from is None and series.buckets == {}
+
+
+def test_partial_federated_pages_are_not_settled(server):
+    fake = FakeSeries()
+    series = aggregator(server)
+
+    async def partial(*args, **kwargs):
+        return {**await fake(*args, **kwargs), "partial": True}
+
+    assert asyncio.run(series.window(5, partial, "traces-*")) is None
+    assert series.covered_from is None and series.settled_through is None and series.buckets == {}
+
+
+def test_query_bounds_and_filters_travel_as_params(server):
+    series = aggregator(server, where="service.name IN (?service_0)", params=[{"service_0": "a"}])
+    query, params = series.build_query(100, 160)
+    assert "@timestamp < TO_DATETIME(?end)" in query
+    assert "service.name IN (?service_0)" in query
+    assert params == [
+        {"start": "1970-01-01T01:40:00.000Z"}, {"service_0": "a"}, {"end": "1970-01-01T02:40:00.000Z"}
+    ]
+
+
+@pytest.mark.parametrize("params", [None, [{"service_0": "b"}]])
+def test_signature_depends_on_the_definition(server, params):
+    reference = aggregator(server, where="service.name IN (?service_0)", params=[{"service_0": "a"}])
+    other = aggregator(server, where="service.name IN (?service_0)", params=params)
+    assert reference.signature != other.signature